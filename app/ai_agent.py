@@ -1,9 +1,18 @@
+import asyncio
+import hashlib
+import logging
+import re
+import time
 import aiohttp
 import uuid
 import json
 import ssl
+from collections import OrderedDict
 from datetime import datetime
 from config import GIGACHAT_CREDENTIALS
+from app import repo
+from app.ai_gateway import AIGateway, AIGatewayError
+from app.metrics import REGISTRY
 
 # --- КОНСТАНТЫ ---
 AUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
@@ -29,59 +38,361 @@ SYSTEM_PROMPT = """
 4. Если это просто вопрос или просьба спланировать день — отвечай обычным текстом.
 """
 
-async def get_token() -> str:
-    payload = {'scope': 'GIGACHAT_API_PERS'}
-    headers = {
-        'Content-Type': 'application/x-www-form-urlencoded',
-        'Accept': 'application/json',
-        'RqUID': str(uuid.uuid4()),
-        'Authorization': f'Basic {GIGACHAT_CREDENTIALS}'
-    }
+# Обновляем токен заранее, за столько секунд до истечения
+TOKEN_REFRESH_MARGIN = 120
+
+def _make_ssl_context():
     ssl_ctx = ssl.create_default_context()
     ssl_ctx.check_hostname = False
     ssl_ctx.verify_mode = ssl.CERT_NONE
+    return ssl_ctx
+
+class GigaChatClient:
+    """
+    Клиент GigaChat с одной общей сессией (keep-alive пул соединений) и кэшем
+    OAuth-токена. Токен живёт до expires_at; незадолго до истечения он
+    обновляется в фоне, и одновременные запросы ждут одно и то же обновление.
+    """
+
+    def __init__(self, credentials=GIGACHAT_CREDENTIALS, auth_url=AUTH_URL, chat_url=CHAT_URL):
+        self.credentials = credentials
+        self.auth_url = auth_url
+        self.chat_url = chat_url
+        self._ssl_ctx = None  # создаётся при первом запросе: загрузка сертификатов небыстрая
+        self._session = None
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_task = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            if self._ssl_ctx is None:
+                self._ssl_ctx = _make_ssl_context()
+            connector = aiohttp.TCPConnector(ssl=self._ssl_ctx, limit=100, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    # --- OAuth ---
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(AUTH_URL, headers=headers, data=payload, ssl=ssl_ctx) as resp:
+    async def _fetch_token(self):
+        payload = {'scope': 'GIGACHAT_API_PERS'}
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Accept': 'application/json',
+            'RqUID': str(uuid.uuid4()),
+            'Authorization': f'Basic {self.credentials}'
+        }
+        async with self._get_session().post(self.auth_url, headers=headers, data=payload) as resp:
             data = await resp.json()
             if resp.status != 200:
                 raise ValueError(f"Auth Error: {data}")
-            return data['access_token']
+        expires_at = float(data.get('expires_at', 0))
+        # GigaChat отдаёт expires_at в миллисекундах
+        if expires_at > 1e11:
+            expires_at /= 1000
+        self._token = data['access_token']
+        self._expires_at = expires_at or (time.time() + 30 * 60)
+        return self._token
 
-async def ai_answer(user_text: str, tasks_context: str = "Список пуст") -> str:
-    try:
-        access_token = await get_token()
-        now = datetime.now()
-        
-        full_prompt = (
-            f"{SYSTEM_PROMPT}\n\n"
-            f"📅 СЕГОДНЯ: {now.strftime('%d/%m/%Y')}\n"
-            f"🕒 ВРЕМЯ: {now.strftime('%H:%M')}\n"
-            f"📋 ЗАДАЧИ:\n{tasks_context}"
-        )
+    def _refresh(self):
+        """Single-flight: все ожидающие получают результат одного запроса к AUTH_URL"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch_token())
+            # Ошибку фонового обновления забираем сами: следующий запрос просто попробует снова
+            self._refresh_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self._refresh_task
 
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {access_token}'
+    async def get_token(self) -> str:
+        left = self._expires_at - time.time()
+        if self._token and left > TOKEN_REFRESH_MARGIN:
+            return self._token
+        if self._token and left > 0:
+            # Токен ещё действует — обновим в фоне, не задерживая запрос
+            self._refresh()
+            return self._token
+        return await asyncio.shield(self._refresh())
+
+    def invalidate_token(self):
+        self._token = None
+        self._expires_at = 0.0
+
+    # --- Chat ---
+
+    async def chat(self, messages, temperature=0.1) -> str:
+        payload = {
+            "model": "GigaChat",
+            "messages": messages,
+            "temperature": temperature
         }
-        
+        for attempt in range(2):
+            headers = {
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {await self.get_token()}'
+            }
+            async with self._get_session().post(self.chat_url, headers=headers, json=payload) as resp:
+                # Токен отозван раньше срока — получаем новый и повторяем один раз
+                if resp.status == 401 and attempt == 0:
+                    self.invalidate_token()
+                    continue
+                if resp.status != 200:
+                    raise ValueError(f"Chat Error {resp.status}: {await resp.text()}")
+                result = await resp.json()
+                return result['choices'][0]['message']['content']
+
+    async def chat_stream(self, messages, temperature=0.1):
+        """Потоковый ответ (stream: true): отдаёт куски текста по мере генерации"""
         payload = {
             "model": "GigaChat",
-            "messages": [
-                {"role": "system", "content": full_prompt},
-                {"role": "user", "content": user_text}
-            ],
-            "temperature": 0.1  # Минимальная температура для строгости
+            "messages": messages,
+            "temperature": temperature,
+            "stream": True
         }
+        for attempt in range(2):
+            headers = {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+                'Authorization': f'Bearer {await self.get_token()}'
+            }
+            async with self._get_session().post(self.chat_url, headers=headers, json=payload) as resp:
+                if resp.status == 401 and attempt == 0:
+                    self.invalidate_token()
+                    continue
+                if resp.status != 200:
+                    raise ValueError(f"Chat Error {resp.status}: {await resp.text()}")
+                # SSE: строки вида "data: {...}", поток завершается "data: [DONE]"
+                async for raw_line in resp.content:
+                    line = raw_line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+                    chunk = json.loads(data)
+                    delta = chunk['choices'][0].get('delta', {}).get('content')
+                    if delta:
+                        yield delta
+                return
 
-        ssl_ctx = ssl.create_default_context()
-        ssl_ctx.check_hostname = False
-        ssl_ctx.verify_mode = ssl.CERT_NONE
+# Общий клиент на весь процесс: создаётся при первом запросе к ИИ, закрывается в run.py
+_client = None
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(CHAT_URL, headers=headers, json=payload, ssl=ssl_ctx) as resp:
-                result = await resp.json()
-                return result['choices'][0]['message']['content']
+def get_client():
+    global _client
+    if _client is None:
+        _client = GigaChatClient()
+    return _client
+
+async def close_client():
+    if _client is not None:
+        await _client.close()
+
+# Лимит параллельности, очередь на пользователя и предохранитель перед клиентом
+gateway = AIGateway()
+
+# Ответ на сбой GigaChat, который не распознал шлюз
+AI_ERROR_TEXT = "⚠ Не получилось получить ответ от ИИ. Попробуйте ещё раз."
 
+REGISTRY.gauge("ai_gateway", "Состояние шлюза GigaChat (in_flight, queued, счётчики отказов)",
+               gateway.stats, label="stat")
+
+def _observe_ai(kind, outcome, started):
+    REGISTRY.histogram("ai_request_seconds", "Время ответа ИИ", kind=kind, outcome=outcome).observe(
+        time.perf_counter() - started
+    )
+
+# ==========================================================
+# 🧠 КЭШ ОТВЕТОВ ИИ
+# ==========================================================
+
+# Сколько живёт ответ и ширина «окна времени»: в промпт попадают дата и время,
+# поэтому ответ на «что у меня сегодня?» переиспользуем только в пределах окна
+AI_CACHE_TTL = 10 * 60
+AI_CACHE_BUCKET_MINUTES = 15
+AI_CACHE_SIZE = 5000
+
+# Ответы-команды (создать/удалить задачу) не кэшируем: их нужно выполнить заново
+_ACTION_RE = re.compile(r'"action"\s*:\s*"(create_task|delete_task)"')
+
+def normalize_prompt(text: str) -> str:
+    """«Что у меня сегодня?» и «что у меня  сегодня» — один и тот же вопрос"""
+    text = text.lower().replace("ё", "е")
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!.… ")
+
+class ResponseCache:
+    """
+    LRU + TTL кэш ответов GigaChat. Ключ — пользователь, нормализованный текст,
+    хэш списка задач и окно времени. Изменение задач пользователя сбрасывает
+    его записи (repo.on_change); хэш контекста страхует от изменений из других
+    процессов.
+    """
+
+    def __init__(self, maxsize=AI_CACHE_SIZE, ttl=AI_CACHE_TTL, bucket_minutes=AI_CACHE_BUCKET_MINUTES):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.bucket_minutes = bucket_minutes
+        self._entries = OrderedDict()   # key -> (expires_at, text, latency)
+        self._by_user = {}              # user_id -> {key}
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_seconds = 0.0
+
+    def key(self, user_id, user_text, tasks_context, now=None):
+        now = now or datetime.now()
+        bucket = now.strftime("%Y-%m-%d ") + str((now.hour * 60 + now.minute) // self.bucket_minutes)
+        context_hash = hashlib.sha1(tasks_context.encode("utf-8")).hexdigest()
+        return (user_id, normalize_prompt(user_text), context_hash, bucket)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += entry[2]
+        return entry[1]
+
+    def put(self, key, text, latency):
+        if not self.maxsize:
+            return
+        if text.startswith("Error:") or _ACTION_RE.search(text):
+            self.bypassed += 1
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, text, latency)
+        self._entries.move_to_end(key)
+        self._by_user.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        keys = self._by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+
+    def invalidate_user(self, user_id):
+        for key in self._by_user.pop(user_id, ()):
+            self._entries.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
+
+response_cache = ResponseCache()
+REGISTRY.gauge("ai_response_cache", "Кэш ответов ИИ (hits, misses, hit_rate, saved_seconds)",
+               response_cache.stats, label="stat")
+
+@repo.on_change
+def _invalidate_response_cache(event, data):
+    response_cache.invalidate_user(data.get("user_id"))
+
+async def get_token() -> str:
+    return await get_client().get_token()
+
+def build_messages(user_text: str, tasks_context: str):
+    now = datetime.now()
+    full_prompt = (
+        f"{SYSTEM_PROMPT}\n\n"
+        f"📅 СЕГОДНЯ: {now.strftime('%d/%m/%Y')}\n"
+        f"🕒 ВРЕМЯ: {now.strftime('%H:%M')}\n"
+        f"📋 ЗАДАЧИ:\n{tasks_context}"
+    )
+    return [
+        {"role": "system", "content": full_prompt},
+        {"role": "user", "content": user_text}
+    ]
+
+async def ai_answer(user_text: str, tasks_context: str = "Список пуст", user_id=None) -> str:
+    started = time.perf_counter()
+    key = response_cache.key(user_id, user_text, tasks_context)
+    cached = response_cache.get(key)
+    if cached is not None:
+        _observe_ai("answer", "cached", started)
+        return cached
+    try:
+        async with gateway.slot(user_id):
+            # Минимальная температура для строгости
+            text = await asyncio.wait_for(
+                get_client().chat(build_messages(user_text, tasks_context), temperature=0.1), gateway.timeout
+            )
+    except AIGatewayError as e:
+        _observe_ai("answer", type(e).__name__, started)
+        return e.user_message
+    except Exception as e:
+        logging.error(f"GigaChat: {e!r}")
+        _observe_ai("answer", "error", started)
+        return AI_ERROR_TEXT
+    _observe_ai("answer", "ok", started)
+    response_cache.put(key, text, time.perf_counter() - started)
+    return text
+
+async def ai_answer_stream(user_text: str, tasks_context: str = "Список пуст", timings: dict = None, user_id=None):
+    """
+    Потоковый вариант ai_answer: отдаёт куски ответа по мере генерации.
+    В timings (если передан) записываются ttft_ms (время до первого токена) и total_ms;
+    ответ из кэша отдаётся одним куском с cached = True.
+    """
+    if timings is None:
+        timings = {}
+    started = time.perf_counter()
+    key = response_cache.key(user_id, user_text, tasks_context)
+    cached = response_cache.get(key)
+    if cached is not None:
+        timings["cached"] = True
+        timings["ttft_ms"] = timings["total_ms"] = (time.perf_counter() - started) * 1000
+        _observe_ai("stream", "cached", started)
+        yield cached
+        return
+    parts = []
+    outcome = "cancelled"
+    try:
+        async with gateway.slot(user_id):
+            chunks = get_client().chat_stream(build_messages(user_text, tasks_context), temperature=0.1)
+            try:
+                # Таймаут шлюза — на каждый кусок: зависший поток не держит место вечно
+                while True:
+                    try:
+                        delta = await asyncio.wait_for(chunks.__anext__(), gateway.timeout)
+                    except StopAsyncIteration:
+                        break
+                    if "ttft_ms" not in timings:
+                        timings["ttft_ms"] = (time.perf_counter() - started) * 1000
+                    parts.append(delta)
+                    yield delta
+            finally:
+                await chunks.aclose()
+        outcome = "ok"
+        response_cache.put(key, "".join(parts), time.perf_counter() - started)
+    except AIGatewayError as e:
+        outcome = type(e).__name__
+        yield e.user_message
     except Exception as e:
-        return f"Error: {e}"
\ No newline at end of file
+        outcome = "error"
+        logging.error(f"GigaChat stream: {e!r}")
+        yield AI_ERROR_TEXT
+    finally:
+        _observe_ai("stream", outcome, started)
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        logging.info(
+            f"GigaChat stream: TTFT {timings.get('ttft_ms', timings['total_ms']):.0f} мс, "
+            f"всего {timings['total_ms']:.0f} мс"
+        )
@@ -0,0 +1,137 @@
+"""
+Сборка списка задач для промпта ИИ с ограничением по токенам.
+
+Вместо всех задач пользователя в промпт попадают: задачи рядом с «сейчас»,
+задачи на даты, упомянутые в вопросе, и затем остальные по совпадению слов
+с вопросом — пока не кончится бюджет. Остаток сворачивается в строку
+«…и ещё N задач».
+"""
+import re
+from datetime import datetime, timedelta
+
+from config import AI_CONTEXT_TOKENS
+from app.db import parse_due
+
+# Задачи в этом окне вокруг текущего момента попадают в контекст всегда
+NEAR_BEFORE = timedelta(hours=2)
+NEAR_AFTER = timedelta(hours=24)
+
+EMPTY_CONTEXT = "Список задач пуст."
+
+MONTHS = {
+    "январ": 1, "феврал": 2, "март": 3, "апрел": 4, "ма": 5, "июн": 6,
+    "июл": 7, "август": 8, "сентябр": 9, "октябр": 10, "ноябр": 11, "декабр": 12,
+}
+WEEKDAYS = ("понедельник", "вторник", "сред", "четверг", "пятниц", "суббот", "воскресень")
+
+_WORD_RE = re.compile(r"[a-zа-яё0-9]+")
+_NUM_DATE_RE = re.compile(r"\b(\d{1,2})[./](\d{1,2})(?:[./](\d{2,4}))?\b")
+_TEXT_DATE_RE = re.compile(r"\b(\d{1,2})\s+([а-я]+)")
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка: у GigaChat на русский текст примерно 3 символа на токен"""
+    return len(text) // 3 + 1
+
+def _stem(word: str) -> str:
+    # Без морфологии: «отчёт», «отчёта», «отчётом» совпадают по первым 5 буквам
+    return word[:5]
+
+def _keywords(text: str):
+    return {_stem(w) for w in _WORD_RE.findall(text.lower().replace("ё", "е")) if len(w) >= 3}
+
+def _safe_date(year, month, day):
+    try:
+        return datetime(year, month, day).date()
+    except ValueError:
+        return None
+
+def mentioned_dates(query: str, now: datetime):
+    """Даты, упомянутые в вопросе: «сегодня», «завтра», «пятница», «05.03», «5 марта»"""
+    text = query.lower().replace("ё", "е")
+    today = now.date()
+    dates = set()
+    if "сегодня" in text:
+        dates.add(today)
+    if "послезавтра" in text:
+        dates.add(today + timedelta(days=2))
+    elif "завтра" in text:
+        dates.add(today + timedelta(days=1))
+    if "вчера" in text:
+        dates.add(today - timedelta(days=1))
+    if "недел" in text:
+        dates.update(today + timedelta(days=i) for i in range(7))
+    for index, prefix in enumerate(WEEKDAYS):
+        if prefix in text:
+            dates.add(today + timedelta(days=(index - today.weekday()) % 7))
+    for day, month, year in _NUM_DATE_RE.findall(text):
+        year = int(year) if year else today.year
+        if year < 100:
+            year += 2000
+        date = _safe_date(year, int(month), int(day))
+        if date:
+            dates.add(date)
+    for day, word in _TEXT_DATE_RE.findall(text):
+        for prefix, month in MONTHS.items():
+            if word.startswith(prefix) and (prefix != "ма" or word in ("мая", "май")):
+                date = _safe_date(today.year, month, int(day))
+                if date:
+                    dates.add(date)
+                break
+    return dates
+
+def _due(value):
+    # fromisoformat в разы быстрее strptime — заметно на тысячах задач
+    try:
+        due = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return parse_due(value)
+    if due.tzinfo is not None:
+        # «…Z» / «+03:00» из Mini App: сравниваем с наивным now — переводим в местное время
+        due = due.astimezone().replace(tzinfo=None)
+    return due
+
+def _task_line(task):
+    return f"- {task['title']} ({task['due_datetime']})"
+
+def build_tasks_context(tasks, query: str, budget: int = None, now: datetime = None) -> str:
+    """
+    Список задач для промпта не длиннее budget токенов (по умолчанию AI_CONTEXT_TOKENS).
+    Обязательные задачи (рядом с now и на упомянутые даты) идут первыми, остальные —
+    по числу общих с вопросом слов, при равенстве — по близости срока.
+    """
+    if not tasks:
+        return EMPTY_CONTEXT
+    budget = AI_CONTEXT_TOKENS if budget is None else budget
+    now = now or datetime.now()
+    query = query or ""
+    dates = mentioned_dates(query, now)
+    words = _keywords(query)
+
+    ranked = []
+    for order, task in enumerate(tasks):
+        due = _due(task["due_datetime"])
+        required = due is not None and (
+            now - NEAR_BEFORE <= due <= now + NEAR_AFTER or due.date() in dates
+        )
+        overlap = len(words & _keywords(task["title"])) if words else 0
+        distance = abs((due - now).total_seconds()) if due else float("inf")
+        ranked.append((not required, -overlap, distance, order, task))
+    ranked.sort(key=lambda item: item[:4])
+
+    # Хвост «…и ещё N задач» резервируем заранее, чтобы не выйти за бюджет
+    used = estimate_tokens("…и ещё 00000 задач")
+    chosen = []
+    for _, _, _, order, task in ranked:
+        cost = estimate_tokens(_task_line(task))
+        if used + cost > budget:
+            break
+        used += cost
+        chosen.append((order, task))
+
+    # В промпте задачи идут в исходном порядке (по сроку) — так модели проще
+    chosen.sort(key=lambda item: item[0])
+    lines = [_task_line(task) for _, task in chosen]
+    rest = len(tasks) - len(chosen)
+    if rest:
+        lines.append(f"…и ещё {rest} задач")
+    return "\n".join(lines)
@@ -0,0 +1,207 @@
+"""
+Допуск запросов к GigaChat: общий лимит параллельности, очередь на пользователя
+и предохранитель (circuit breaker).
+
+- Одновременно к GigaChat уходит не больше max_concurrency запросов.
+- У пользователя в работе один запрос; следующий ждёт, а ещё более новый
+  вытесняет ждущий (отвечать на устаревший вопрос смысла нет).
+- После failure_threshold ошибок подряд предохранитель размыкается: запросы
+  сразу получают понятный отказ, а через reset_timeout один пробный запрос
+  проверяет, ожил ли GigaChat.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+
+from config import AI_MAX_CONCURRENCY, AI_TIMEOUT
+from app.metrics import REGISTRY
+
+class AIGatewayError(Exception):
+    """Отказ шлюза; user_message можно показать пользователю"""
+    user_message = "⚠ ИИ сейчас недоступен, попробуйте чуть позже."
+
+class AIUnavailable(AIGatewayError):
+    user_message = "⚠ ИИ временно недоступен. Попробуйте через минуту — задачи можно вести и без него."
+
+class AISuperseded(AIGatewayError):
+    user_message = "⏭ Запрос заменён более новым сообщением."
+
+class AITimeout(AIGatewayError):
+    user_message = "⌛ ИИ отвечает слишком долго. Попробуйте ещё раз."
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe = False
+
+    def rejecting(self):
+        """Разомкнут и время на восстановление ещё не вышло"""
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow(self):
+        """Можно ли пропустить запрос сейчас (в полуоткрытом состоянии — только один пробный)"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe = False
+        if self.state == self.HALF_OPEN:
+            if self._probe:
+                return False
+            self._probe = True
+        return True
+
+    def abandon(self):
+        """Пробный запрос отменён без ответа — следующий сможет попробовать снова"""
+        if self.state == self.HALF_OPEN:
+            self._probe = False
+
+    def success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe = False
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logging.warning(f"GigaChat: предохранитель разомкнут после {self.failures} ошибок")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe = False
+
+class _UserSlot:
+    __slots__ = ("active", "waiter")
+
+    def __init__(self):
+        self.active = False
+        self.waiter = None
+
+class AIGateway:
+    def __init__(self, max_concurrency=AI_MAX_CONCURRENCY, timeout=AI_TIMEOUT, breaker=None):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = None
+        self._users = {}
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.superseded = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.wait_latency = REGISTRY.histogram("ai_gateway_wait_seconds", "Ожидание места в шлюзе GigaChat")
+
+    def check(self):
+        """Бросает AIUnavailable, если предохранитель разомкнут (место при этом не занимается)"""
+        if self.breaker.rejecting():
+            self.rejected += 1
+            raise AIUnavailable()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id):
+        """
+        Ждёт своей очереди и держит место на время запроса к GigaChat.
+        Бросает AIUnavailable (предохранитель разомкнут) или AISuperseded (пришёл запрос новее).
+        Ошибка внутри блока считается сбоем GigaChat, успешный выход — успехом.
+        """
+        self.check()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        started = time.perf_counter()
+        self.queued += 1
+        try:
+            await self._acquire_user(user_id)
+            try:
+                await self._semaphore.acquire()
+            except BaseException:
+                self._release_user(user_id)
+                raise
+        finally:
+            self.queued -= 1
+        self.wait_latency.observe(time.perf_counter() - started)
+
+        try:
+            # Пока ждали, GigaChat мог упасть — проверяем ещё раз перед запросом
+            if not self.breaker.allow():
+                self.rejected += 1
+                raise AIUnavailable()
+            self.admitted += 1
+            self.in_flight += 1
+            try:
+                yield
+            except (asyncio.CancelledError, GeneratorExit):
+                self.breaker.abandon()
+                raise
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self.breaker.failure()
+                raise AITimeout()
+            except Exception:
+                self.failures += 1
+                self.breaker.failure()
+                raise
+            else:
+                self.breaker.success()
+            finally:
+                self.in_flight -= 1
+        finally:
+            self._semaphore.release()
+            self._release_user(user_id)
+
+    async def _acquire_user(self, user_id):
+        if user_id is None:
+            return
+        slot = self._users.setdefault(user_id, _UserSlot())
+        if not slot.active:
+            slot.active = True
+            return
+        if slot.waiter is not None and not slot.waiter.done():
+            slot.waiter.set_exception(AISuperseded())
+            self.superseded += 1
+        waiter = asyncio.get_running_loop().create_future()
+        slot.waiter = waiter
+        try:
+            # Место передаётся ждущему напрямую в _release_user
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self._release_user(user_id)
+            elif slot.waiter is waiter:
+                slot.waiter = None
+            raise
+
+    def _release_user(self, user_id):
+        if user_id is None:
+            return
+        slot = self._users.get(user_id)
+        if slot is None:
+            return
+        waiter, slot.waiter = slot.waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+            return
+        slot.active = False
+        del self._users[user_id]
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "superseded": self.superseded,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "breaker": self.breaker.state,
+            "wait": self.wait_latency.snapshot(),
+        }
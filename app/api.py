@@ -1,17 +1,54 @@
 from aiohttp import web
 import json
-from app.db import get_all_tasks_json, add_task, delete_task, mark_task_completed
-from app.ai_agent import ai_answer
+from app.repo import (
+    get_all_tasks_json, list_tasks, add_task, delete_task, mark_task_completed,
+    get_user_revision, get_task_changes, apply_task_batch
+)
+from app.ai_agent import ai_answer, ai_answer_stream, gateway
+from app.ai_gateway import AIGatewayError
+from app.ai_context import build_tasks_context
+from app.monitoring import http_metrics_middleware
 
 # Настройка CORS (чтобы сайт с GitHub мог обращаться к локальному боту)
 import aiohttp_cors
 
+# Размер страницы дельта-синхронизации по умолчанию и максимальный
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+
 async def get_tasks_handler(request):
-    """Отдает список задач для пользователя"""
+    """
+    Отдает список задач для пользователя.
+
+    Без параметров — все задачи, как раньше. С ?since=<revision> (и/или ?cursor=, ?limit=)
+    — только изменённые после ревизии задачи и id удалённых, страницами по revision.
+    ETag — последняя ревизия пользователя (у дельты — ещё и since и limit, ведь от них
+    зависит ответ): при If-None-Match без изменений вернётся 304.
+    """
     try:
         user_id = int(request.query.get('user_id'))
-        tasks = get_all_tasks_json(user_id)
-        return web.json_response({"tasks": tasks})
+        revision = await get_user_revision(user_id)
+        full = "since" not in request.query and "cursor" not in request.query and "limit" not in request.query
+        if full:
+            etag = f'"r{revision}"'
+        else:
+            since = int(request.query.get('cursor') or request.query.get('since') or 0)
+            limit = min(int(request.query.get('limit', SYNC_PAGE_SIZE)), SYNC_MAX_PAGE_SIZE)
+            etag = f'"r{revision}-s{since}-l{limit}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+
+        if full:
+            tasks = await get_all_tasks_json(user_id)
+            return web.json_response({"tasks": tasks, "revision": revision}, headers={"ETag": etag})
+
+        tasks, deleted, next_cursor = await get_task_changes(user_id, since, limit)
+        return web.json_response({
+            "tasks": tasks,
+            "deleted": deleted,
+            "revision": revision,
+            "next_cursor": next_cursor,
+        }, headers={"ETag": etag})
     except Exception as e:
         return web.json_response({"error": str(e)}, status=400)
 
@@ -23,7 +60,7 @@ async def add_task_handler(request):
         title = data.get('title')
         due_datetime = data.get('due_datetime')
         
-        add_task(user_id, title, due_datetime)
+        await add_task(user_id, title, due_datetime)
         return web.json_response({"status": "ok"})
     except Exception as e:
         return web.json_response({"error": str(e)}, status=400)
@@ -36,14 +73,37 @@ async def update_task_handler(request):
         task_id = int(data.get('id'))
         
         if action == 'complete':
-            mark_task_completed(task_id)
+            await mark_task_completed(task_id)
         elif action == 'delete':
-            delete_task(task_id)
+            await delete_task(task_id)
             
         return web.json_response({"status": "ok"})
     except Exception as e:
         return web.json_response({"error": str(e)}, status=400)
 
+# Ограничение размера одного пакета операций
+BATCH_MAX_OPS = 500
+
+async def batch_tasks_handler(request):
+    """
+    Пакет операций над задачами одной транзакцией:
+    {"user_id": 1, "ops": [{"op_id": "...", "action": "add|complete|delete|edit", ...}]}
+    Возвращает результат по каждой операции; повтор с теми же op_id ничего не применит дважды.
+    """
+    try:
+        data = await request.json()
+        user_id = int(data.get('user_id'))
+        ops = data.get('ops')
+        if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+            raise ValueError("ops must be a list of objects")
+        if len(ops) > BATCH_MAX_OPS:
+            raise ValueError(f"too many ops (max {BATCH_MAX_OPS})")
+
+        results = await apply_task_batch(user_id, ops)
+        return web.json_response({"status": "ok", "results": results})
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=400)
+
 async def ai_chat_handler(request):
     """Чат с ИИ внутри Mini App"""
     try:
@@ -52,17 +112,53 @@ async def ai_chat_handler(request):
         user_id = int(data.get('user_id'))
         
         # Получаем контекст задач для умного ответа
-        tasks = get_all_tasks_json(user_id)
-        tasks_ctx = "\n".join([f"- {t['title']} ({t['due_datetime']})" for t in tasks if t['status'] != 'done'])
+        tasks_ctx = build_tasks_context(await list_tasks(user_id), message)
         
         # Генерируем ответ
-        response_text = await ai_answer(message, tasks_context=tasks_ctx)
+        response_text = await ai_answer(message, tasks_context=tasks_ctx, user_id=user_id)
         
         return web.json_response({"response": response_text})
     except Exception as e:
         return web.json_response({"error": str(e)}, status=400)
 
+async def ai_stream_handler(request):
+    """Чат с ИИ в режиме стриминга (Server-Sent Events)"""
+    try:
+        data = await request.json()
+        message = data.get('message')
+        user_id = int(data.get('user_id'))
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    # До prepare() ответ ещё можно отдать обычным JSON — ошибки здесь те же, что у ai_chat_handler
+    try:
+        tasks_ctx = build_tasks_context(await list_tasks(user_id), message)
+        # Предохранитель разомкнут — отказываем сразу, не открывая поток
+        gateway.check()
+    except AIGatewayError as e:
+        return web.json_response({"response": e.user_message})
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+    })
+    await response.prepare(request)
+
+    # Каждый кусок ответа — отдельное событие; в конце событие done с замерами
+    timings = {}
+    async for delta in ai_answer_stream(message, tasks_context=tasks_ctx, timings=timings, user_id=user_id):
+        await response.write(f"data: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n".encode("utf-8"))
+    await response.write(f"event: done\ndata: {json.dumps(timings)}\n\n".encode("utf-8"))
+    await response.write_eof()
+    return response
+
 def setup_api_routes(app):
+    # Задержки и коды ответов всех маршрутов. Сами метрики здесь не отдаём: это
+    # публичный сервер webhook — /metrics поднимается отдельно на METRICS_PORT
+    app.middlewares.append(http_metrics_middleware)
+
     # Настройка CORS (разрешаем запросы с любого сайта)
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
@@ -76,4 +172,6 @@ def setup_api_routes(app):
     cors.add(app.router.add_get('/api/tasks', get_tasks_handler))
     cors.add(app.router.add_post('/api/tasks/add', add_task_handler))
     cors.add(app.router.add_post('/api/tasks/update', update_task_handler))
-    cors.add(app.router.add_post('/api/ai', ai_chat_handler))
\ No newline at end of file
+    cors.add(app.router.add_post('/api/tasks/batch', batch_tasks_handler))
+    cors.add(app.router.add_post('/api/ai', ai_chat_handler))
+    cors.add(app.router.add_post('/api/ai/stream', ai_stream_handler))
\ No newline at end of file
@@ -1,52 +1,88 @@
 import calendar
+from datetime import date
+from functools import lru_cache
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-def build_month(year: int, month: int, active_days: list = None) -> InlineKeyboardMarkup:
+# Названия месяцев по локалям (None — как в модуле calendar текущего процесса)
+MONTH_NAMES = {
+    "ru": ["", "Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+           "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"],
+    "en": ["", "January", "February", "March", "April", "May", "June",
+           "July", "August", "September", "October", "November", "December"],
+}
+DAYS_OF_WEEK = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+def _ignore(text):
+    return InlineKeyboardButton(text=text, callback_data="cal:ignore")
+
+@lru_cache(maxsize=64)
+def _month_skeleton(year: int, month: int, locale, show_weeks: bool):
     """
-    Создает клавиатуру-календарь на месяц.
-    active_days — список чисел дней, где есть задачи (их выделим).
+    Неизменяемая часть месяца: шапка, дни недели и сетка, где для каждого дня
+    заранее созданы обе кнопки — обычная и выделенная.
     """
-    if active_days is None:
-        active_days = []
+    month_name = MONTH_NAMES[locale][month] if locale else calendar.month_name[month]
+    corner = [_ignore("№")] if show_weeks else []
 
-    kb = InlineKeyboardBuilder()
-    
     # --- 1. Шапка (Месяц Год) и навигация ---
     # Кнопки: <  Месяц Год  >
-    kb.row(
+    header = [
         InlineKeyboardButton(text="<<", callback_data=f"cal:prev:{year}:{month}"),
-        InlineKeyboardButton(text=f"{calendar.month_name[month]} {year}", callback_data="cal:ignore"),
+        _ignore(f"{month_name} {year}"),
         InlineKeyboardButton(text=">>", callback_data=f"cal:next:{year}:{month}")
-    )
+    ]
 
     # --- 2. Дни недели ---
-    days_of_week = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
-    row_days = [InlineKeyboardButton(text=d, callback_data="cal:ignore") for d in days_of_week]
-    kb.row(*row_days)
-
-    # --- 3. Сетка дней ---
-    cal = calendar.Calendar(firstweekday=0) # 0 = Понедельник
-    month_days = cal.monthdayscalendar(year, month)
+    weekdays = corner + [_ignore(d) for d in DAYS_OF_WEEK]
 
-    for week in month_days:
-        row_btns = []
+    # --- 3. Сетка дней: (день, обычная кнопка, выделенная кнопка) ---
+    empty = _ignore(" ")  # Пустая кнопка (день другого месяца)
+    weeks = []
+    for week in calendar.Calendar(firstweekday=0).monthdayscalendar(year, month):  # 0 = Понедельник
+        cells = []
+        if show_weeks:
+            first_day = next(d for d in week if d)
+            iso_week = date(year, month, first_day).isocalendar()[1]
+            cells.append((0, _ignore(str(iso_week)), None))
         for day in week:
             if day == 0:
-                # Пустая кнопка (день другого месяца)
-                row_btns.append(InlineKeyboardButton(text=" ", callback_data="cal:ignore"))
+                cells.append((0, empty, None))
             else:
-                # Проверяем, есть ли задачи на этот день
-                if day in active_days:
-                    btn_text = f"• {day} •"  # Выделяем
-                else:
-                    btn_text = str(day)
-                
-                row_btns.append(InlineKeyboardButton(text=btn_text, callback_data=f"cal:day:{year}:{month}:{day}"))
-        
-        kb.row(*row_btns)
+                callback_data = f"cal:day:{year}:{month}:{day}"
+                cells.append((
+                    day,
+                    InlineKeyboardButton(text=str(day), callback_data=callback_data),
+                    InlineKeyboardButton(text=f"• {day} •", callback_data=callback_data),
+                ))
+        weeks.append(tuple(cells))
+
+    return header, weekdays, tuple(weeks)
+
+@lru_cache(maxsize=1024)
+def _build_month_cached(year: int, month: int, active_mask: int, locale, show_weeks: bool) -> InlineKeyboardMarkup:
+    header, weekdays, weeks = _month_skeleton(year, month, locale, show_weeks)
+    rows = [header, weekdays]
+    for week in weeks:
+        # Накладываем выделение: бит day в маске — на этот день есть задачи
+        rows.append([
+            highlighted if day and active_mask >> day & 1 else plain
+            for day, plain, highlighted in week
+        ])
 
     # --- 4. Кнопка "Назад" ---
-    kb.row(InlineKeyboardButton(text="🔙 Назад в меню", callback_data="back_main"))
+    rows.append([InlineKeyboardButton(text="🔙 Назад в меню", callback_data="back_main")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def build_month(year: int, month: int, active_days: list = None, locale=None, show_weeks=False) -> InlineKeyboardMarkup:
+    """
+    Создает клавиатуру-календарь на месяц.
+    active_days — список чисел дней, где есть задачи (их выделим).
+    locale — язык названия месяца ("ru", "en"), show_weeks — колонка с номером ISO-недели.
 
-    return kb.as_markup()
\ No newline at end of file
+    Каркас месяца кэшируется, поэтому навигация собирает только выделение дней.
+    Возвращаемую разметку не изменяйте: она может быть общей для нескольких вызовов.
+    """
+    active_mask = 0
+    for day in active_days or ():
+        active_mask |= 1 << day
+    return _build_month_cached(year, month, active_mask, locale, show_weeks)
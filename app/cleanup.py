@@ -0,0 +1,162 @@
+"""
+Очередь удаления служебных сообщений.
+
+Обработчики удаляют по два-три сообщения на каждое действие (сообщение
+пользователя, прошлое сообщение бота, «Думаю...»). Вместо отдельного вызова
+deleteMessage на каждое, да ещё и до ответа, id копятся по чатам, а фоновая
+задача через flush_delay удаляет их пачками одним deleteMessages (до 100 id).
+Сообщения, которые удалить уже нельзя, Telegram в пачке пропускает сам; если
+отказ пришёл на всю пачку, она делится пополам, пока не останутся отдельные
+неудаляемые сообщения — отбрасываются только они. На flood control и сетевые
+ошибки пачка возвращается в очередь своего чата и повторяется после паузы;
+остальные чаты её не ждут.
+"""
+import asyncio
+import logging
+
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramBadRequest,
+    TelegramNetworkError,
+)
+
+from app.metrics import REGISTRY
+
+# Лимит Bot API на один вызов deleteMessages
+MAX_BATCH = 100
+MAX_RETRIES = 3
+
+class MessageCleaner:
+    def __init__(self, flush_delay=0.3):
+        self.flush_delay = flush_delay
+        self._pending = {}   # chat_id -> (bot, [message_id, ...])
+        self._backoff = {}   # chat_id -> (не раньше loop.time(), номер повтора)
+        self._wakeup = None
+        self._task = None
+        self.counters = {"queued": 0, "deleted": 0, "batches": 0, "retried": 0, "dropped": 0}
+
+    # --- Публичный интерфейс ---
+
+    def schedule(self, bot, chat_id, message_id):
+        """Ставит сообщение в очередь на удаление и сразу возвращается"""
+        if not message_id:
+            return
+        entry = self._pending.get(chat_id)
+        if entry is None:
+            entry = self._pending[chat_id] = (bot, [])
+        if message_id not in entry[1]:
+            entry[1].append(message_id)
+            self.counters["queued"] += 1
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def stop(self):
+        """Удаляет всё, что накопилось, и останавливает фоновую задачу"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        # Отложенные повторы дожидаемся: число попыток ограничено MAX_RETRIES
+        while self._pending:
+            await asyncio.sleep(self._next_retry_in() or 0)
+            await self.flush()
+
+    async def flush(self):
+        """Удаляет накопленное во всех чатах, кроме тех, что ждут паузы flood control"""
+        now = asyncio.get_running_loop().time()
+        due = [chat_id for chat_id in self._pending
+               if chat_id not in self._backoff or self._backoff[chat_id][0] <= now]
+        batches = []
+        for chat_id in due:
+            bot, message_ids = self._pending.pop(chat_id)
+            attempt = self._backoff.pop(chat_id, (0, 0))[1]
+            batches.extend((bot, chat_id, message_ids[i:i + MAX_BATCH], attempt)
+                           for i in range(0, len(message_ids), MAX_BATCH))
+        await asyncio.gather(*(self._delete(*batch) for batch in batches))
+
+    def stats(self):
+        return {**self.counters, "pending": sum(len(ids) for _, ids in self._pending.values())}
+
+    # --- Фоновая задача ---
+
+    def _next_retry_in(self):
+        """Секунды до ближайшего отложенного повтора или None, если повторов нет"""
+        if not self._backoff:
+            return None
+        return max(min(at for at, _ in self._backoff.values()) - asyncio.get_running_loop().time(), 0)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._next_retry_in())
+            except asyncio.TimeoutError:
+                pass  # подошёл срок повтора для чата на паузе
+            # Пауза собирает в одну пачку все удаления текущего действия пользователя
+            await asyncio.sleep(self.flush_delay)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Очистка сообщений: непредвиденная ошибка: {e}")
+
+    def _retry_later(self, bot, chat_id, message_ids, attempt, delay):
+        """Возвращает пачку в очередь чата; до срока flush этот чат пропускает"""
+        entry = self._pending.get(chat_id)
+        if entry is None:
+            entry = self._pending[chat_id] = (bot, [])
+        # Пачка встаёт перед тем, что чат успел накопить за время попытки
+        entry[1][:0] = [message_id for message_id in message_ids if message_id not in entry[1]]
+        at = asyncio.get_running_loop().time() + delay
+        previous = self._backoff.get(chat_id)
+        if previous is not None:
+            at, attempt = max(at, previous[0]), max(attempt, previous[1])
+        self._backoff[chat_id] = (at, attempt)
+        if self._wakeup is not None:
+            self._wakeup.set()  # фоновая задача пересчитает срок ближайшего повтора
+
+    async def _delete(self, bot, chat_id, message_ids, attempt=0):
+        try:
+            await bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+            self.counters["batches"] += 1
+            self.counters["deleted"] += len(message_ids)
+            return
+        except TelegramRetryAfter as e:
+            delay = e.retry_after
+            error = e
+        except TelegramNetworkError as e:
+            delay = min(2 ** attempt, 10)
+            error = e
+        except TelegramBadRequest as e:
+            if len(message_ids) > 1:
+                # Отказ на всю пачку может быть из-за одного сообщения: делим пополам,
+                # чтобы остальные всё же удалились, а отброшены были только «плохие»
+                middle = len(message_ids) // 2
+                await self._delete(bot, chat_id, message_ids[:middle], attempt)
+                await self._delete(bot, chat_id, message_ids[middle:], attempt)
+                return
+            # «message can't be deleted» — повтор не поможет
+            error = e
+            delay = None
+        except TelegramForbiddenError as e:
+            # Чат недоступен — не удалится ни одно сообщение пачки
+            error = e
+            delay = None
+        if delay is not None and attempt < MAX_RETRIES:
+            self.counters["retried"] += 1
+            self._retry_later(bot, chat_id, message_ids, attempt + 1, delay)
+            return
+        self.counters["dropped"] += len(message_ids)
+        REGISTRY.counter("telegram_delete_failures_total", "Неудачные удаления сообщений",
+                         error=type(error).__name__).inc(len(message_ids))
+        logging.debug(f"Очистка сообщений: чат {chat_id}, {len(message_ids)} шт. не удалены: {error}")
+
+# Общая очередь на весь процесс (останавливается в run.py)
+cleaner = MessageCleaner()
+REGISTRY.gauge("message_cleanup", "Очередь удаления сообщений (счётчики и ожидающие)", cleaner.stats, label="stat")
@@ -0,0 +1,93 @@
+"""
+Write-behind коалесер записей (group commit).
+
+Мутации из параллельных обработчиков складываются в очередь и уходят в поток
+БД пачкой: одна транзакция и один коммит на всю пачку вместо коммита на каждую
+запись. Пока пачка коммитится, копится следующая. Вызывающий получает
+результат только после коммита своей пачки.
+"""
+import asyncio
+import time
+
+from app import db
+from app.metrics import REGISTRY
+
+# Размеры пачек: 1, 2, 5, ... 500 операций
+FLUSH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+class WriteCoalescer:
+    def __init__(self, max_batch=200, max_delay=0.0):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._full = None
+        self._flusher = None
+        self.flush_size = REGISTRY.histogram("db_write_flush_size", "Операций в одной пачке записи",
+                                             buckets=FLUSH_SIZE_BUCKETS)
+        self.flush_latency = REGISTRY.histogram("db_write_flush_seconds", "Длительность транзакции пачки")
+        self.write_latency = REGISTRY.histogram("db_write_seconds", "От постановки записи в очередь до коммита")
+
+    async def submit(self, func, *args):
+        """Ставит func(conn, *args) в ближайшую пачку и ждёт её коммита"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((func, args, future, time.perf_counter()))
+        if self._flusher is None or self._flusher.done():
+            self._full = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def drain(self):
+        """Дожидается коммита всего, что уже стоит в очереди (перед закрытием БД)"""
+        if self._flusher is not None and not self._flusher.done():
+            await self._flusher
+
+    async def _flush_loop(self):
+        while self._pending:
+            if len(self._pending) < self.max_batch:
+                # Даём соседним обработчикам присоединиться к пачке. С max_delay = 0 пачку
+                # составляет всё, что пришло за время коммита предыдущей, — одиночная
+                # запись при этом не ждёт лишнего.
+                if self.max_delay > 0:
+                    try:
+                        await asyncio.wait_for(self._full.wait(), timeout=self.max_delay)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(0)
+            self._full.clear()
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                db.executor, db.run_write_batch, [(func, args) for func, args, _, _ in batch]
+            )
+        except Exception as e:
+            # Упала вся транзакция (например, диск) — ошибка у каждого из пачки
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        committed = time.perf_counter()
+        self.flush_size.observe(len(batch))
+        self.flush_latency.observe(committed - started)
+        for (_, _, future, enqueued), (ok, value) in zip(batch, results):
+            self.write_latency.observe(committed - enqueued)
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stats(self):
+        return {
+            "flush_size": self.flush_size.snapshot(),
+            "flush_latency": self.flush_latency.snapshot(),
+            "write_latency": self.write_latency.snapshot(),
+        }
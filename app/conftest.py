@@ -0,0 +1,13 @@
+import pytest
+
+from app import db
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    """Чистая база во временном каталоге со всеми миграциями"""
+    monkeypatch.setattr(db, "DB_NAME", str(tmp_path / "test.db"))
+    monkeypatch.setattr(db, "_conn", None)
+    db.init_db()
+    connection = db.get_conn()
+    yield connection
+    connection.close()
@@ -1,146 +1,607 @@
+import calendar
+import json
+import re
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-DB_NAME = "tasks.db"
+from config import DB_PATH
+
+DB_NAME = DB_PATH
+
+# ==========================================================
+# 🔌 СОЕДИНЕНИЕ И ПОТОК БАЗЫ ДАННЫХ
+# ==========================================================
+# Одно долгоживущее соединение вместо sqlite3.connect() на каждый вызов.
+# Все запросы из асинхронного кода выполняются в отдельном потоке БД
+# (см. app/repo.py), поэтому fsync больше не блокирует event loop.
+
+_conn = None
+_conn_lock = threading.Lock()
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+def get_conn():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = sqlite3.connect(DB_NAME, check_same_thread=False, cached_statements=256)
+            _conn.row_factory = sqlite3.Row  # Позволяет обращаться к полям по имени
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=NORMAL")
+            _conn.execute("PRAGMA busy_timeout=5000")
+        return _conn
+
+def close_db():
+    """Дожидается запросов в очереди и закрывает соединение"""
+    global _conn
+    executor.shutdown(wait=True)
+    with _conn_lock:
+        if _conn is not None:
+            # Обновляет статистику планировщика для таблиц, где она устарела
+            _conn.execute("PRAGMA analysis_limit=1000")
+            _conn.execute("PRAGMA optimize")
+            _conn.close()
+            _conn = None
 
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            title TEXT,
-            due_datetime TEXT,
-            status TEXT DEFAULT 'pending'
-        )
-    """)
-    conn.commit()
-    conn.close()
+    """Создаёт/обновляет схему до последней версии (см. app/migrations.py)"""
+    from app.migrations import migrate  # migrations сами используют функции этого модуля
+    migrate(get_conn())
+
+# ==========================================================
+# 🕒 СРОКИ ЗАДАЧ
+# ==========================================================
+# В due_datetime хранится строка для отображения, в due_ts — то же настенное
+# время в секундах (как если бы оно было UTC). Все диапазонные запросы идут по due_ts.
+
+DUE_FORMATS = ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M")
+
+def parse_due(value):
+    """Строка срока из БД/Mini App -> datetime (или None, если формат неизвестен)"""
+    value = str(value).strip()
+    for fmt in DUE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+def to_ts(value):
+    if isinstance(value, str):
+        value = parse_due(value)
+    if value is None:
+        return None
+    return calendar.timegm(value.timetuple())
+
+def from_ts(ts):
+    return datetime(1970, 1, 1) + timedelta(seconds=ts)
+
+def parse_category(title):
+    """Категория из заголовка вида «[Категория] Название» (или None)"""
+    if title and title.startswith("[") and "]" in title:
+        return title.split("]")[0].strip("[")
+    return None
+
+# --- ЗАПИСЬ ---
+# Функции *_in(conn, ...) работают внутри уже открытой транзакции (пакетные операции,
+# group commit), остальные открывают свою.
+
+def insert_task_in(conn, user_id, title, due_datetime):
+    category = parse_category(title)
+    cursor = conn.execute(
+        "INSERT INTO tasks (user_id, title, due_datetime, due_ts, category) VALUES (?, ?, ?, ?, ?)",
+        (user_id, title, due_datetime, to_ts(due_datetime), category)
+    )
+    _stats_on_add(conn, user_id, category, due_datetime)
+    return cursor.lastrowid
+
+def delete_task_in(conn, task_id, user_id=None):
+    owner_filter = "" if user_id is None else " AND user_id = ?"
+    params = (task_id,) if user_id is None else (task_id, user_id)
+    row = conn.execute(
+        f"DELETE FROM tasks WHERE id = ?{owner_filter} RETURNING user_id, status, category, due_datetime", params
+    ).fetchone()
+    if row is None:
+        return None
+    _stats_on_delete(conn, row["user_id"], row["status"], row["category"], row["due_datetime"])
+    return row["user_id"]
+
+def complete_task_in(conn, task_id, user_id=None):
+    owner_filter = "" if user_id is None else " AND user_id = ?"
+    params = (task_id,) if user_id is None else (task_id, user_id)
+    row = conn.execute(
+        f"UPDATE tasks SET status = 'done' WHERE id = ? AND status != 'done'{owner_filter} RETURNING user_id", params
+    ).fetchone()
+    if row is None:
+        return None
+    conn.execute(
+        "UPDATE user_stats SET pending = pending - 1, completed = completed + 1 WHERE user_id = ?",
+        (row["user_id"],)
+    )
+    return row["user_id"]
+
+def edit_task_in(conn, task_id, user_id, title=None, due_datetime=None):
+    """Меняет название и/или срок задачи пользователя; возвращает новую строку (или None)"""
+    old = conn.execute("SELECT * FROM tasks WHERE id = ? AND user_id = ?", (task_id, user_id)).fetchone()
+    if old is None:
+        return None
+    title = old["title"] if title is None else title
+    due_datetime = old["due_datetime"] if due_datetime is None else due_datetime
+    category = parse_category(title)
+    # Новый срок — напоминание должно прийти заново
+    reminded = old["reminded"] if due_datetime == old["due_datetime"] else 0
+    row = conn.execute(
+        "UPDATE tasks SET title = ?, due_datetime = ?, due_ts = ?, category = ?, reminded = ? "
+        "WHERE id = ? RETURNING *",
+        (title, due_datetime, to_ts(due_datetime), category, reminded, task_id)
+    ).fetchone()
+    if category != old["category"]:
+        _stats_category(conn, user_id, old["category"], -1)
+        _stats_category(conn, user_id, category, +1)
+    if due_datetime[:10] != (old["due_datetime"] or "")[:10]:
+        _stats_day(conn, user_id, old["due_datetime"], -1)
+        _stats_day(conn, user_id, due_datetime, +1)
+    return row
+
+def run_write_batch(ops):
+    """
+    Групповой коммит: выполняет [(func, args)] одной транзакцией, где func(conn, *args) —
+    одна из функций записи выше. Каждая операция в своём SAVEPOINT, поэтому ошибка одной
+    не откатывает остальные. Возвращает [(True, результат) | (False, исключение)].
+    """
+    conn = get_conn()
+    results = []
+    # IMMEDIATE: блокировку записи берём сразу. Базу делят несколько процессов-воркеров,
+    # и отложенный BEGIN, прочитав данные, на первой записи получил бы SQLITE_BUSY
+    # без ожидания busy_timeout, если другой процесс успел записать раньше
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for func, args in ops:
+            conn.execute("SAVEPOINT write_op")
+            try:
+                results.append((True, func(conn, *args)))
+                conn.execute("RELEASE write_op")
+            except Exception as e:
+                conn.execute("ROLLBACK TO write_op")
+                conn.execute("RELEASE write_op")
+                results.append((False, e))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results
 
 def add_task(user_id, title, due_datetime):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO tasks (user_id, title, due_datetime) VALUES (?, ?, ?)", 
-                   (user_id, title, due_datetime))
-    conn.commit()
-    conn.close()
+    """Добавляет задачу и возвращает её id"""
+    conn = get_conn()
+    with conn:
+        return insert_task_in(conn, user_id, title, due_datetime)
+
+def _task_to_dict(row):
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "due_datetime": row["due_datetime"],
+        "status": row["status"]
+    }
 
 def list_tasks(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row # Позволяет обращаться к полям по имени
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM tasks WHERE user_id = ? AND status != 'done' ORDER BY due_datetime", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    
+    rows = get_conn().execute(
+        "SELECT * FROM tasks WHERE user_id = ? AND status = 'pending' ORDER BY due_ts", (user_id,)
+    ).fetchall()
     # Конвертируем в список словарей для удобства JSON
-    tasks = []
-    for row in rows:
-        tasks.append({
-            "id": row["id"],
-            "title": row["title"],
-            "due_datetime": row["due_datetime"],
-            "status": row["status"]
-        })
-    return tasks
+    return [_task_to_dict(row) for row in rows]
+
+# Ключ страницы списка: задачи с неразобранным сроком (due_ts IS NULL) идут в конце.
+# То же выражение стоит в индексе idx_tasks_user_status_page (миграция m011).
+DUE_TS_LAST = 253402300799  # 9999-12-31 23:59:59
+PAGE_KEY = f"COALESCE(due_ts, {DUE_TS_LAST})"
+
+def list_tasks_page(user_id, limit, after=None, before=None):
+    """
+    Невыполненные задачи по ключу (sort_ts, id) строго после after или строго перед
+    before (кортежи (sort_ts, id)), не больше limit, по возрастанию; sort_ts — due_ts,
+    а без срока — DUE_TS_LAST. Страница берётся диапазоном по индексу без OFFSET —
+    цена не зависит от того, насколько далеко пролистан список.
+    """
+    sql = (f"SELECT id, title, due_datetime, status, {PAGE_KEY} AS sort_ts FROM tasks "
+           f"WHERE user_id = ? AND status = 'pending'")
+    params = [user_id]
+    # Сравнение ключей расписано явно: с (выражение, id) > (?, ?) SQLite не строит
+    # диапазон по индексу выражения и листал бы страницы от начала списка
+    if before is not None:
+        sql += f" AND {PAGE_KEY} <= ? AND ({PAGE_KEY} < ? OR id < ?) ORDER BY {PAGE_KEY} DESC, id DESC LIMIT ?"
+        params += [before[0], before[0], before[1], limit]
+    else:
+        if after is not None:
+            sql += f" AND {PAGE_KEY} >= ? AND ({PAGE_KEY} > ? OR id > ?)"
+            params += [after[0], after[0], after[1]]
+        sql += f" ORDER BY {PAGE_KEY}, id LIMIT ?"
+        params.append(limit)
+    rows = get_conn().execute(sql, params).fetchall()
+    if before is not None:
+        rows.reverse()
+    return [dict(_task_to_dict(row), sort_ts=row["sort_ts"]) for row in rows]
 
 # --- НОВАЯ ФУНКЦИЯ ДЛЯ MINI APP ---
 def get_all_tasks_json(user_id):
     """Возвращает ВСЕ задачи (и выполненные) для статистики и календаря"""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM tasks WHERE user_id = ? ORDER BY due_datetime", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    
-    tasks = []
-    for row in rows:
-        tasks.append({
-            "id": row["id"],
-            "title": row["title"],
-            "due_datetime": row["due_datetime"],
-            "status": row["status"]
-        })
-    return tasks
+    rows = get_conn().execute(
+        "SELECT * FROM tasks WHERE user_id = ? ORDER BY due_ts", (user_id,)
+    ).fetchall()
+    return [_task_to_dict(row) for row in rows]
+
+# --- ДЕЛЬТА-СИНХРОНИЗАЦИЯ ДЛЯ MINI APP ---
+def get_user_revision(user_id):
+    """Последняя ревизия задач пользователя (включая удаления) — основа для ETag"""
+    conn = get_conn()
+    tasks_rev = conn.execute("SELECT MAX(revision) FROM tasks WHERE user_id = ?", (user_id,)).fetchone()[0]
+    deleted_rev = conn.execute(
+        "SELECT MAX(revision) FROM task_tombstones WHERE user_id = ?", (user_id,)
+    ).fetchone()[0]
+    return max(tasks_rev or 0, deleted_rev or 0)
+
+def get_task_changes(user_id, since=0, limit=500):
+    """
+    Задачи, изменённые после ревизии since (keyset-пагинация по revision), и id удалённых.
+    next_cursor — ревизия, с которой запрашивать следующую страницу (None — это последняя).
+    """
+    conn = get_conn()
+    rows = conn.execute(
+        "SELECT * FROM tasks WHERE user_id = ? AND revision > ? ORDER BY revision LIMIT ?",
+        (user_id, since, limit)
+    ).fetchall()
+    tasks = [{**_task_to_dict(row), "revision": row["revision"]} for row in rows]
+
+    next_cursor = rows[-1]["revision"] if len(rows) == limit else None
+    # Удаления отдаём в том же диапазоне ревизий, что и страницу задач
+    if next_cursor is None:
+        deleted = conn.execute(
+            "SELECT task_id FROM task_tombstones WHERE user_id = ? AND revision > ?", (user_id, since)
+        ).fetchall()
+    else:
+        deleted = conn.execute(
+            "SELECT task_id FROM task_tombstones WHERE user_id = ? AND revision > ? AND revision <= ?",
+            (user_id, since, next_cursor)
+        ).fetchall()
+    return tasks, [row[0] for row in deleted], next_cursor
 
 def delete_task(task_id):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
-    conn.commit()
-    conn.close()
+    """Удаляет задачу; возвращает user_id владельца (None, если задачи не было)"""
+    conn = get_conn()
+    with conn:
+        return delete_task_in(conn, task_id)
 
 def mark_task_completed(task_id):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE tasks SET status = 'done' WHERE id = ?", (task_id,))
-    conn.commit()
-    conn.close()
-
-def get_pending_reminders(current_time_str):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM tasks WHERE due_datetime = ? AND status != 'done'", (current_time_str,))
-    rows = cursor.fetchall()
-    conn.close()
+    """Отмечает задачу выполненной; возвращает user_id владельца (None, если менять нечего)"""
+    conn = get_conn()
+    with conn:
+        return complete_task_in(conn, task_id)
+
+# --- ПАКЕТНЫЕ ОПЕРАЦИИ ИЗ MINI APP ---
+BATCH_ACTIONS = ("add", "complete", "delete", "edit")
+
+def apply_task_batch(user_id, ops):
+    """
+    Применяет список операций пользователя одной транзакцией.
+
+    Каждая операция — {"op_id", "action", ...}; уже применённые op_id не повторяются,
+    а возвращают сохранённый результат (повтор запроса клиентом безопасен).
+    Возвращает список результатов в порядке операций.
+    """
+    results = []
+    conn = get_conn()
+    with conn:
+        for op in ops:
+            op_id = str(op.get("op_id") or "")
+            if op_id:
+                done = conn.execute(
+                    "SELECT result FROM applied_ops WHERE user_id = ? AND op_id = ?", (user_id, op_id)
+                ).fetchone()
+                if done is not None:
+                    results.append({**json.loads(done["result"]), "duplicate": True})
+                    continue
+
+            result = _apply_op(conn, user_id, op)
+            result["op_id"] = op_id or None
+            if op_id:
+                conn.execute(
+                    "INSERT INTO applied_ops (user_id, op_id, result, applied_at) VALUES (?, ?, ?, ?)",
+                    (user_id, op_id, json.dumps(result, ensure_ascii=False), int(time.time()))
+                )
+            results.append(result)
+    return results
+
+def _apply_op(conn, user_id, op):
+    action = op.get("action")
+    if action not in BATCH_ACTIONS:
+        return {"action": action, "status": "error", "error": "unknown_action"}
+    # Поля приходят из JSON клиента: не тех типов — ошибка этой операции, а не всего пакета
+    for field in ("title", "due_datetime"):
+        if op.get(field) is not None and not isinstance(op[field], str):
+            return {"action": action, "status": "error", "error": "invalid"}
+    if op.get("id") is not None and (isinstance(op["id"], bool) or not isinstance(op["id"], (int, str))):
+        return {"action": action, "status": "error", "error": "invalid"}
+
+    if action == "add":
+        title, due_datetime = op.get("title"), op.get("due_datetime")
+        if not title or not due_datetime:
+            return {"action": action, "status": "error", "error": "title_and_due_datetime_required"}
+        task_id = insert_task_in(conn, user_id, title, due_datetime)
+        return {"action": action, "status": "ok", "id": task_id, "due_datetime": due_datetime}
+
+    try:
+        task_id = int(op.get("id"))
+    except (TypeError, ValueError):
+        return {"action": action, "status": "error", "error": "id_required"}
+
+    # Владелец проверяется прямо в запросе: чужая задача выглядит как несуществующая
+    if action == "complete":
+        changed = complete_task_in(conn, task_id, user_id) is not None
+    elif action == "delete":
+        changed = delete_task_in(conn, task_id, user_id) is not None
+    else:
+        row = edit_task_in(conn, task_id, user_id, op.get("title"), op.get("due_datetime"))
+        changed = row is not None
+        if changed:
+            return {"action": action, "status": "ok", "id": task_id, "due_datetime": row["due_datetime"]}
+
+    if not changed:
+        return {"action": action, "status": "error", "id": task_id, "error": "not_found"}
+    return {"action": action, "status": "ok", "id": task_id}
+
+# --- НАПОМИНАНИЯ ---
+def get_upcoming_reminders(start_ts, end_ts):
+    """Активные задачи без отправленного напоминания со сроком в [start_ts, end_ts]"""
+    rows = get_conn().execute(
+        "SELECT id, due_ts FROM tasks "
+        "WHERE status = 'pending' AND due_ts BETWEEN ? AND ? AND reminded = 0",
+        (start_ts, end_ts)
+    ).fetchall()
     return [dict(row) for row in rows]
 
+def claim_reminders(task_ids, now_ts):
+    """
+    Помечает напоминания отправленными и возвращает задачи, которые ещё нужно отправить.
+    Задачу, уже выполненную, напомненную ранее или перенесённую на будущее, не вернёт.
+    """
+    if not task_ids:
+        return []
+    placeholders = ",".join("?" * len(task_ids))
+    conn = get_conn()
+    with conn:
+        # «+» снимает индексы со status/due_ts: иначе без статистики планировщик берёт
+        # idx_tasks_status_due и перебирает все просроченные задачи вместо поиска по id
+        rows = conn.execute(
+            f"UPDATE tasks SET reminded = 1 "
+            f"WHERE id IN ({placeholders}) AND +status = 'pending' AND reminded = 0 AND +due_ts <= ? "
+            f"RETURNING id, user_id, title, due_datetime",
+            [*task_ids, now_ts]
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+# --- КАЛЕНДАРЬ ---
 def get_days_with_tasks(user_id, year, month):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    search_pattern = f"{year}-{month:02d}-%"
-    cursor.execute("SELECT due_datetime FROM tasks WHERE user_id = ? AND due_datetime LIKE ?", (user_id, search_pattern))
-    rows = cursor.fetchall()
-    conn.close()
-    
-    days = set()
-    for row in rows:
-        try:
-            date_part = row[0].split(" ")[0] # Берём '2023-10-25'
-            day = int(date_part.split("-")[2])
-            days.add(day)
-        except:
-            continue
-    return list(days)
+    """Номера дней месяца, на которые есть задачи (диапазон по индексу (user_id, due_ts))"""
+    month_start = to_ts(datetime(year, month, 1))
+    next_month = to_ts(datetime(year + month // 12, month % 12 + 1, 1))
+    rows = get_conn().execute(
+        "SELECT DISTINCT (due_ts - ?) / 86400 + 1 FROM tasks "
+        "WHERE user_id = ? AND due_ts >= ? AND due_ts < ?",
+        (month_start, user_id, month_start, next_month)
+    ).fetchall()
+    return [row[0] for row in rows]
 
 def get_tasks_for_day(user_id, date_str):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
     # date_str приходит как YYYY-MM-DD
-    search_pattern = f"{date_str}%"
-    cursor.execute("SELECT * FROM tasks WHERE user_id = ? AND due_datetime LIKE ? ORDER BY due_datetime", (user_id, search_pattern))
-    rows = cursor.fetchall()
-    conn.close()
+    day_start = to_ts(datetime.strptime(date_str, "%Y-%m-%d"))
+    rows = get_conn().execute(
+        "SELECT * FROM tasks WHERE user_id = ? AND due_ts >= ? AND due_ts < ? ORDER BY due_ts",
+        (user_id, day_start, day_start + 86400)
+    ).fetchall()
     return [dict(row) for row in rows]
 
+# ==========================================================
+# 🔎 ПОЛНОТЕКСТОВЫЙ ПОИСК
+# ==========================================================
+# Индекс tasks_fts (FTS5) поддерживается триггерами. Слова запроса ищутся по
+# префиксу без окончаний: «встречу» найдёт «встреча», «встречи», «встречей».
+
+_SEARCH_WORD_RE = re.compile(r"\w+")
+
+def fts_query(user_id, text):
+    """Текст пользователя -> выражение MATCH (или None, если искать нечего)"""
+    # Однобуквенные слова (предлоги «с», «в») по префиксу совпали бы почти со всем
+    words = [w for w in _SEARCH_WORD_RE.findall(text.lower().replace("ё", "е")) if len(w) > 1]
+    terms = []
+    for word in words:
+        # Отбрасываем окончание, но оставляем не меньше 3 букв
+        stem = word[:-2] if len(word) >= 6 else word[:-1] if len(word) >= 5 else word
+        terms.append(f'"{stem}" *')
+    if not terms:
+        return None
+    return f'owner : "u{int(user_id)}" AND title : ({" AND ".join(terms)})'
+
+def search_tasks(user_id, query, limit=10, offset=0, status="pending"):
+    """
+    Задачи пользователя, подходящие под query, по релевантности (bm25), затем по сроку.
+    status=None — искать среди всех задач. Возвращает (задачи, всего найдено).
+    """
+    match = fts_query(user_id, query)
+    if match is None:
+        return [], 0
+    # CROSS JOIN фиксирует порядок: сначала индекс FTS, потом задачи по rowid.
+    # Иначе планировщик может перебирать задачи пользователя и вычислять MATCH для каждой.
+    status_filter = "" if status is None else " AND t.status = ?"
+    params = (match, user_id) + (() if status is None else (status,))
+    conn = get_conn()
+    total = conn.execute(
+        f"SELECT COUNT(*) FROM tasks_fts f CROSS JOIN tasks t ON t.id = f.rowid "
+        f"WHERE tasks_fts MATCH ? AND t.user_id = ?{status_filter}", params
+    ).fetchone()[0]
+    rows = conn.execute(
+        f"SELECT t.* FROM tasks_fts f CROSS JOIN tasks t ON t.id = f.rowid "
+        f"WHERE tasks_fts MATCH ? AND t.user_id = ?{status_filter} "
+        f"ORDER BY f.rank, t.due_ts LIMIT ? OFFSET ?", params + (limit, offset)
+    ).fetchall()
+    return [_task_to_dict(row) for row in rows], total
+
+def delete_matching_tasks_in(conn, user_id, query):
+    """Удаляет одним DELETE все невыполненные задачи пользователя под query; возвращает их id"""
+    match = fts_query(user_id, query)
+    if match is None:
+        return []
+    rows = conn.execute(
+        "DELETE FROM tasks WHERE user_id = ? AND status = 'pending' "
+        "AND id IN (SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH ?) "
+        "RETURNING id, status, category, due_datetime",
+        (user_id, match)
+    ).fetchall()
+    for row in rows:
+        _stats_on_delete(conn, user_id, row["status"], row["category"], row["due_datetime"])
+    return [row["id"] for row in rows]
+
+# ==========================================================
+# 📊 МАТЕРИАЛИЗОВАННАЯ СТАТИСТИКА
+# ==========================================================
+# Счётчики по пользователю обновляются в той же транзакции, что и задача,
+# поэтому чтение статистики — это несколько точечных выборок по ключу,
+# без сканирования всех задач пользователя и разбора заголовков.
+
+def _stats_category(conn, user_id, category, delta):
+    if category is None:
+        return
+    conn.execute("""
+        INSERT INTO user_category_counts (user_id, category, count) VALUES (?, ?, ?)
+        ON CONFLICT(user_id, category) DO UPDATE SET count = count + excluded.count
+    """, (user_id, category, delta))
+    if delta < 0:
+        conn.execute(
+            "DELETE FROM user_category_counts WHERE user_id = ? AND category = ? AND count <= 0",
+            (user_id, category)
+        )
+
+def _stats_day(conn, user_id, due_datetime, delta):
+    """Счётчик задач за день; active_days меняется, когда день появляется или пустеет"""
+    if delta > 0:
+        day_count = conn.execute("""
+            INSERT INTO user_day_counts (user_id, day, count) VALUES (?, substr(?, 1, 10), ?)
+            ON CONFLICT(user_id, day) DO UPDATE SET count = count + excluded.count
+            RETURNING count
+        """, (user_id, due_datetime, delta)).fetchone()[0]
+        if day_count == delta:
+            conn.execute("UPDATE user_stats SET active_days = active_days + 1 WHERE user_id = ?", (user_id,))
+        return
+
+    day_row = conn.execute(
+        "UPDATE user_day_counts SET count = count + ? WHERE user_id = ? AND day = substr(?, 1, 10) RETURNING count",
+        (delta, user_id, due_datetime)
+    ).fetchone()
+    if day_row is not None and day_row[0] <= 0:
+        conn.execute(
+            "DELETE FROM user_day_counts WHERE user_id = ? AND day = substr(?, 1, 10)", (user_id, due_datetime)
+        )
+        conn.execute("UPDATE user_stats SET active_days = active_days - 1 WHERE user_id = ?", (user_id,))
+
+def _stats_on_add(conn, user_id, category, due_datetime):
+    conn.execute("""
+        INSERT INTO user_stats (user_id, pending) VALUES (?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET pending = pending + 1
+    """, (user_id,))
+    _stats_category(conn, user_id, category, +1)
+    _stats_day(conn, user_id, due_datetime, +1)
+
+def _stats_on_delete(conn, user_id, status, category, due_datetime):
+    column = "completed" if status == "done" else "pending"
+    conn.execute(f"UPDATE user_stats SET {column} = {column} - 1 WHERE user_id = ?", (user_id,))
+    _stats_category(conn, user_id, category, -1)
+    _stats_day(conn, user_id, due_datetime, -1)
+
+def rebuild_stats_in(conn, user_id=None):
+    where, params = ("WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+    for table in ("user_stats", "user_category_counts", "user_day_counts"):
+        conn.execute(f"DELETE FROM {table} {where}", params)
+    conn.execute(f"""
+        INSERT INTO user_day_counts (user_id, day, count)
+        SELECT user_id, substr(due_datetime, 1, 10), COUNT(*) FROM tasks {where}
+        GROUP BY user_id, substr(due_datetime, 1, 10)
+    """, params)
+    conn.execute(f"""
+        INSERT INTO user_category_counts (user_id, category, count)
+        SELECT user_id, category, COUNT(*) FROM tasks {where} {"AND" if where else "WHERE"} category IS NOT NULL
+        GROUP BY user_id, category
+    """, params)
+    conn.execute(f"""
+        INSERT INTO user_stats (user_id, completed, pending, active_days)
+        SELECT user_id,
+               SUM(status = 'done'),
+               SUM(status != 'done'),
+               (SELECT COUNT(*) FROM user_day_counts d WHERE d.user_id = t.user_id)
+        FROM tasks t {where}
+        GROUP BY user_id
+    """, params)
+
+def rebuild_stats(user_id=None):
+    """Пересчитывает счётчики с нуля (для всех пользователей или одного)"""
+    conn = get_conn()
+    with conn:
+        rebuild_stats_in(conn, user_id)
+
 def get_stats_data(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) FROM tasks WHERE user_id = ? AND status = 'done'", (user_id,))
-    completed = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM tasks WHERE user_id = ? AND status != 'done'", (user_id,))
-    pending = cursor.fetchone()[0]
-    
-    # Уникальные дни с задачами (активность)
-    cursor.execute("SELECT COUNT(DISTINCT substr(due_datetime, 1, 10)) FROM tasks WHERE user_id = ?", (user_id,))
-    active_days = cursor.fetchone()[0]
-    
-    # Категории (парсим из [Категория] Название)
-    cursor.execute("SELECT title FROM tasks WHERE user_id = ?", (user_id,))
-    all_titles = cursor.fetchall()
-    
-    category_counts = {}
-    for t in all_titles:
-        title = t[0]
-        if title.startswith("[") and "]" in title:
-            cat = title.split("]")[0].strip("[")
-            category_counts[cat] = category_counts.get(cat, 0) + 1
-            
-    conn.close()
-    return completed, pending, active_days, category_counts
\ No newline at end of file
+    conn = get_conn()
+    row = conn.execute(
+        "SELECT completed, pending, active_days FROM user_stats WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    completed, pending, active_days = tuple(row) if row else (0, 0, 0)
+
+    # Категории хранятся в отдельной колонке — заголовки больше не разбираем
+    category_counts = {
+        r["category"]: r["count"]
+        for r in conn.execute("SELECT category, count FROM user_category_counts WHERE user_id = ?", (user_id,))
+    }
+    return completed, pending, active_days, category_counts
+
+def get_upcoming_load(user_id, days=7):
+    """Нагрузка на ближайшие дни для графика: (['25.10', ...], [3, ...])"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    rows = get_conn().execute(
+        "SELECT day, count FROM user_day_counts WHERE user_id = ? AND day >= ? ORDER BY day LIMIT ?",
+        (user_id, today, days)
+    ).fetchall()
+    labels = [f"{r['day'][8:10]}.{r['day'][5:7]}" for r in rows]
+    return labels, [r["count"] for r in rows]
+
+def add_dead_letter(chat_id, task_id, error):
+    conn = get_conn()
+    with conn:
+        conn.execute("INSERT INTO dead_letters (chat_id, task_id, error) VALUES (?, ?, ?)",
+                     (chat_id, task_id, error))
+
+# --- СЕССИИ ---
+def load_session(key, min_updated_at):
+    row = get_conn().execute(
+        "SELECT data FROM sessions WHERE key = ? AND updated_at >= ?", (key, min_updated_at)
+    ).fetchone()
+    return json.loads(row["data"]) if row else None
+
+def save_sessions(items):
+    """items: {key: json-строка или None (удалить)} — всё одной транзакцией"""
+    now = time.time()
+    conn = get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT INTO sessions (key, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            [(key, data, now) for key, data in items.items() if data is not None]
+        )
+        conn.executemany(
+            "DELETE FROM sessions WHERE key = ?",
+            [(key,) for key, data in items.items() if data is None]
+        )
+
+def purge_sessions(before):
+    conn = get_conn()
+    with conn:
+        conn.execute("DELETE FROM sessions WHERE updated_at < ?", (before,))
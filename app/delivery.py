@@ -0,0 +1,142 @@
+"""
+Конвейер доставки сообщений (напоминаний) в Telegram.
+
+Очередь ограничена по размеру, сообщения разбирает пул воркеров. Общий
+token bucket держит темп ~30 сообщений/с на бота, плюс не чаще одного
+сообщения в секунду в один чат. На RetryAfter вся отправка ставится на паузу
+ровно на retry_after секунд и сообщение уходит повторно; чаты, которые
+заблокировали бота или не существуют, записываются в dead_letters.
+"""
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramBadRequest,
+    TelegramNetworkError,
+)
+
+from app import repo
+
+GLOBAL_RATE = 30          # сообщений в секунду на бота
+PER_CHAT_INTERVAL = 1.0   # секунд между сообщениями в один чат
+MAX_RETRIES = 5
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Flood control от Telegram: никто не отправляет, пока не истечёт пауза"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class DeliveryPipeline:
+    def __init__(self, bot, workers=8, max_queue=10000, rate=GLOBAL_RATE):
+        self.bot = bot
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.bucket = TokenBucket(rate)
+        self._chat_next_at = {}
+        self._tasks = []
+        self.counters = {"queued": 0, "sent": 0, "retried": 0, "dropped": 0}
+
+    # --- Публичный интерфейс ---
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        """Даёт очереди дообработаться (не дольше timeout) и гасит воркеров"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Доставка: не отправлено {self.queue.qsize()} сообщений при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def enqueue(self, chat_id, text, task_id=None):
+        """Ставит сообщение в очередь; при переполнении ждёт (backpressure)"""
+        await self.queue.put({
+            "chat_id": chat_id, "text": text, "task_id": task_id,
+            "attempt": 0, "enqueued_at": time.monotonic(),
+        })
+        self.counters["queued"] += 1
+
+    def stats(self):
+        """Счётчики и отставание доставки для логов/метрик"""
+        return {**self.counters, "in_queue": self.queue.qsize()}
+
+    # --- Воркеры ---
+
+    async def _wait_chat_slot(self, chat_id):
+        # Слот бронируем до ожидания, чтобы два воркера не попали в одну секунду
+        now = time.monotonic()
+        slot = max(now, self._chat_next_at.get(chat_id, 0.0))
+        self._chat_next_at[chat_id] = slot + PER_CHAT_INTERVAL
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        if len(self._chat_next_at) > 10000:
+            self._chat_next_at = {c: t for c, t in self._chat_next_at.items() if t > now}
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self._deliver(item)
+            except Exception as e:
+                logging.error(f"Доставка: непредвиденная ошибка для чата {item['chat_id']}: {e}")
+                self.counters["dropped"] += 1
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, item):
+        while True:
+            await self._wait_chat_slot(item["chat_id"])
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=item["chat_id"], text=item["text"])
+                self.counters["sent"] += 1
+                return
+            except TelegramRetryAfter as e:
+                self.bucket.pause(e.retry_after)
+                error = e
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Бот заблокирован / чат не найден — повторять бессмысленно
+                await self._dead_letter(item, e)
+                return
+            except TelegramNetworkError as e:
+                await asyncio.sleep(min(2 ** item["attempt"], 30))
+                error = e
+
+            item["attempt"] += 1
+            if item["attempt"] > MAX_RETRIES:
+                await self._dead_letter(item, error)
+                return
+            self.counters["retried"] += 1
+
+    async def _dead_letter(self, item, error):
+        self.counters["dropped"] += 1
+        logging.warning(f"Доставка: чат {item['chat_id']} недоступен: {error}")
+        await repo.add_dead_letter(item["chat_id"], item["task_id"], str(error))
@@ -2,66 +2,112 @@ import json
 import logging
 import asyncio
 import re
+import time
 from datetime import datetime
 
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove, BufferedInputFile, ContentType
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
 # Импорты наших модулей (Добавил task_actions)
-from app.ai_agent import ai_answer
+from app.ai_agent import ai_answer, ai_answer_stream
+from app.ai_context import build_tasks_context
+from app.intents import parse_intent, parse_date_time, intent_stats
 from app.keyboards import main_menu, ai_exit_kb, task_actions
 
-# Импорты для работы с базой данных
-from app.db import (
+# Импорты для работы с базой данных (асинхронный слой поверх потока БД)
+from app.repo import (
     add_task, 
     list_tasks, 
     delete_task, 
-    get_pending_reminders, 
     get_days_with_tasks,
     get_tasks_for_day,
     mark_task_completed,
-    get_stats_data
+    get_stats_data,
+    get_upcoming_load,
+    search_tasks,
+    delete_matching_tasks,
+    get_task_page,
+    current_task_page
 )
+from config import TASK_PAGE_SIZE
 
 # Импорты для доп. функционала
 from app.bot_calendar import build_month
-from app.stats import draw_stats_chart
+from app.stats import chart_renderer
+from app.reminders import ReminderEngine
+
+# Хранилище состояния пользователя (LRU + TTL в памяти, с сохранением в SQLite)
+from app.session import sessions
+from app.cleanup import cleaner
 
 # Инициализация роутера и логирования
 router = Router()
 logging.basicConfig(level=logging.INFO)
 
-# Хранилище состояния пользователя
-user_context = {}
-
 # ==========================================================
 # 🛠 СЛУЖЕБНЫЕ ФУНКЦИИ (УТИЛИТЫ)
 # ==========================================================
 
 async def safe_delete(bot, chat_id, message_id):
-    if not message_id: return
-    try: await bot.delete_message(chat_id=chat_id, message_id=message_id)
-    except Exception: pass
+    # Не ждём Telegram: удаление уйдёт пачкой deleteMessages после ответа пользователю
+    cleaner.schedule(bot, chat_id, message_id)
 
-def update_last_msg(user_id, msg_id):
-    if user_id not in user_context: user_context[user_id] = {}
-    user_context[user_id]["last_msg_id"] = msg_id
+async def update_last_msg(user_id, msg_id):
+    ctx_data = await sessions.get(user_id)
+    ctx_data["last_msg_id"] = msg_id
+    sessions.save(user_id, ctx_data)
 
-def get_last_msg(user_id):
-    return user_context.get(user_id, {}).get("last_msg_id")
+async def get_last_msg(user_id):
+    return (await sessions.get(user_id)).get("last_msg_id")
 
 async def nav_edit_or_send(callback: CallbackQuery, text: str, reply_markup):
     user_id = callback.from_user.id
     try:
         await callback.message.edit_text(text, reply_markup=reply_markup)
-        update_last_msg(user_id, callback.message.message_id)
+        await update_last_msg(user_id, callback.message.message_id)
     except TelegramBadRequest:
         await safe_delete(callback.bot, callback.message.chat.id, callback.message.message_id)
         sent_msg = await callback.message.answer(text, reply_markup=reply_markup)
-        update_last_msg(user_id, sent_msg.message_id)
+        await update_last_msg(user_id, sent_msg.message_id)
+
+# Пауза между правками сообщения при стриминге ответа ИИ (лимиты Telegram на edit)
+STREAM_EDIT_INTERVAL = 1.5
+
+async def stream_ai_reply(msg: Message, user_text: str, tasks_context: str, user_id=None):
+    """Стримит ответ ИИ в сообщение msg, редактируя его не чаще STREAM_EDIT_INTERVAL. Возвращает полный текст."""
+    text = ""
+    shown = ""
+    next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL
+    async for delta in ai_answer_stream(user_text, tasks_context=tasks_context, user_id=user_id):
+        text += delta
+        # JSON-команды пользователю не показываем — их обработает вызывающий код
+        if text.lstrip().startswith(("{", "`")):
+            continue
+        if time.monotonic() < next_edit_at or text == shown:
+            continue
+        try:
+            await msg.edit_text(text[:4000] + " ▌")
+            shown = text
+            next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL
+        except TelegramRetryAfter as e:
+            next_edit_at = time.monotonic() + e.retry_after
+        except TelegramBadRequest:
+            next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL
+    return text
+
+async def answer_stats_chart(message: Message, chart_args, **kwargs):
+    """Отправляет график статистики: повторно использует file_id, иначе рисует вне event loop"""
+    key = chart_renderer.key(*chart_args)
+    photo = chart_renderer.cached_file_id(key)
+    if photo is None:
+        png = await chart_renderer.render(key, *chart_args)
+        photo = BufferedInputFile(png, filename="stats.png")
+    sent_msg = await message.answer_photo(photo=photo, **kwargs)
+    chart_renderer.remember_file_id(key, sent_msg.photo[-1].file_id)
+    return sent_msg
 
 def parse_json_from_text(text: str):
     try:
@@ -74,15 +120,6 @@ def parse_json_from_text(text: str):
         logging.error(f"Ошибка парсинга JSON: {e}")
     return None
 
-def parse_date_time(date_str, time_str):
-    d = str(date_str).replace(".", "/").replace("-", "/").strip()
-    t = str(time_str).replace(".", ":").replace("-", ":").strip()
-    formats = ["%d/%m/%Y %H:%M", "%Y/%m/%d %H:%M", "%d-%m-%Y %H:%M", "%d/%m/%y %H:%M", "%Y-%m-%d %H:%M"]
-    for fmt in formats:
-        try: return datetime.strptime(f"{d} {t}", fmt)
-        except ValueError: continue
-    return None
-
 # ==========================================================
 # 🏠 ГЛАВНОЕ МЕНЮ И СТАРТ
 # ==========================================================
@@ -98,7 +135,7 @@ async def start(message: Message):
         "Теперь у меня есть удобное приложение! Жми кнопку ниже 👇", 
         reply_markup=main_menu()
     )
-    update_last_msg(message.from_user.id, sent_msg.message_id)
+    await update_last_msg(message.from_user.id, sent_msg.message_id)
 
 # ==========================================================
 # 🚀 ОБРАБОТЧИК ДАННЫХ ИЗ MINI APP (НОВЫЙ ФУНКЦИОНАЛ)
@@ -118,7 +155,7 @@ async def web_app_handler(message: Message):
             date_time = f"{data.get('date')} {data.get('time')}"
             full_title = f"[{cat}] {title}"
             
-            add_task(user_id, full_title, date_time)
+            await add_task(user_id, full_title, date_time)
             
             await message.answer(
                 f"✅ <b>Задача сохранена!</b>\n\n🎯 {full_title}\n📅 {date_time}",
@@ -128,7 +165,7 @@ async def web_app_handler(message: Message):
         # 2. ПОЛУЧЕНИЕ ПЛАНА (Кнопка в приложении)
         elif action == "get_plan":
             today = datetime.now().strftime("%Y-%m-%d")
-            tasks = get_tasks_for_day(user_id, today)
+            tasks = await get_tasks_for_day(user_id, today)
             
             if not tasks:
                 await message.answer("🌴 <b>На сегодня задач нет!</b>", reply_markup=main_menu(), parse_mode="HTML")
@@ -151,13 +188,11 @@ async def web_app_handler(message: Message):
 
         # 3. ПОЛУЧЕНИЕ СТАТИСТИКИ
         elif action == "get_stats":
-            comp, pend, days, counts = get_stats_data(user_id)
-            # Рисуем график
-            photo_buf = draw_stats_chart(comp, pend, days, counts)
-            img = BufferedInputFile(photo_buf.read(), filename="stats.png")
-            
-            await message.answer_photo(
-                photo=img,
+            comp, pend, days, counts = await get_stats_data(user_id)
+            load_labels, load_counts = await get_upcoming_load(user_id)
+            # Рисуем график (или берём готовый из кэша)
+            await answer_stats_chart(
+                message, (comp, pend, load_labels, load_counts),
                 caption=f"📊 <b>Ваша статистика:</b>\n\n✅ Сделано: {comp}\n🔥 В работе: {pend}",
                 reply_markup=main_menu()
             )
@@ -168,10 +203,10 @@ async def web_app_handler(message: Message):
             wait_msg = await message.answer(f"🧠 <b>Думаю над вопросом...</b>", parse_mode="HTML")
             
             # Собираем контекст задач
-            raw = list_tasks(user_id)
-            ctx = "\n".join([f"- {t['title']} ({t['due_datetime']})" for t in raw]) if raw else "Задач нет."
+            raw = await list_tasks(user_id)
+            ctx = build_tasks_context(raw, query)
             
-            resp = await ai_answer(query, tasks_context=ctx)
+            resp = await ai_answer(query, tasks_context=ctx, user_id=user_id)
             await wait_msg.delete()
             await message.answer(resp, parse_mode="Markdown", reply_markup=main_menu())
 
@@ -187,10 +222,10 @@ async def web_app_handler(message: Message):
 async def menu(message: Message):
     sent_msg = await message.answer("Главное меню:", reply_markup=main_menu())
     await safe_delete(message.bot, message.chat.id, message.message_id)
-    old_bot_msg_id = get_last_msg(message.from_user.id)
+    old_bot_msg_id = await get_last_msg(message.from_user.id)
     if old_bot_msg_id:
         await safe_delete(message.bot, message.chat.id, old_bot_msg_id)
-    update_last_msg(message.from_user.id, sent_msg.message_id)
+    await update_last_msg(message.from_user.id, sent_msg.message_id)
 
 @router.callback_query(F.data == "back_main")
 async def back_to_main(callback: CallbackQuery):
@@ -214,58 +249,91 @@ async def open_tasks(callback: CallbackQuery):
 @router.callback_query(F.data == "task_add")
 async def add_task_title(callback: CallbackQuery):
     user_id = callback.from_user.id
-    if user_id not in user_context: user_context[user_id] = {}
-    user_context[user_id]["mode"] = "add_title"
+    ctx_data = await sessions.get(user_id)
+    ctx_data["mode"] = "add_title"
+    sessions.save(user_id, ctx_data)
     await nav_edit_or_send(callback, "🆕 <b>Шаг 1 из 3:</b>\nНапиши название задачи:", None)
 
 async def ask_date_step(message: Message, last_bot_msg_id):
     user_id = message.from_user.id
-    user_context[user_id]["mode"] = "add_date"
+    ctx_data = await sessions.get(user_id)
+    ctx_data["mode"] = "add_date"
+    sessions.save(user_id, ctx_data)
     sent_msg = await message.answer("📅 <b>Шаг 2 из 3:</b>\nВведи дату (ДД/ММ/ГГГГ) или напиши «сегодня»:")
     await safe_delete(message.bot, message.chat.id, message.message_id)
     await safe_delete(message.bot, message.chat.id, last_bot_msg_id)
-    update_last_msg(user_id, sent_msg.message_id)
+    await update_last_msg(user_id, sent_msg.message_id)
 
 async def ask_time_step(message: Message, last_bot_msg_id):
     user_id = message.from_user.id
-    user_context[user_id]["mode"] = "add_time"
+    ctx_data = await sessions.get(user_id)
+    ctx_data["mode"] = "add_time"
+    sessions.save(user_id, ctx_data)
     sent_msg = await message.answer("⏰ <b>Шаг 3 из 3:</b>\nВведи время (ЧЧ:ММ):")
     await safe_delete(message.bot, message.chat.id, message.message_id)
     await safe_delete(message.bot, message.chat.id, last_bot_msg_id)
-    update_last_msg(user_id, sent_msg.message_id)
+    await update_last_msg(user_id, sent_msg.message_id)
 
 # --- БЛОК: СПИСОК ЗАДАЧ ---
 
-@router.callback_query(F.data == "task_list")
-async def show_tasks(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    tasks = list_tasks(user_id)
-    
-    if not tasks:
-        await nav_edit_or_send(callback, "📭 <b>Список задач пуст.</b>\nСамое время добавить что-то!", tasks_keyboard())
-        return
+# Длиннее названия в списке обрезаются: страница должна влезать в 4096 символов сообщения
+TASK_TITLE_LIMIT = 200
 
+def render_task_page(page):
+    """Текст и клавиатура страницы списка; «◀»/«▶» несут в callback_data ключ (sort_ts, id)"""
+    tasks = page["tasks"]
     kb = InlineKeyboardBuilder()
     text_output = "📋 <b>Ваши активные задачи:</b>\n\n"
-    
     for t in tasks:
-        text_output += f"🔹 <b>{t['title']}</b>\n🕒 {t['due_datetime']}\n\n"
+        title = t['title'] if len(t['title']) <= TASK_TITLE_LIMIT else t['title'][:TASK_TITLE_LIMIT] + "…"
+        text_output += f"🔹 <b>{title}</b>\n🕒 {t['due_datetime']}\n\n"
         kb.button(text="✅", callback_data=f"done:{t['id']}")
         kb.button(text="❌", callback_data=f"del:{t['id']}")
-        
+    nav = []
+    if page["anchor"] is not None:
+        kb.button(text="◀", callback_data=f"tl:prev:{tasks[0]['sort_ts']}:{tasks[0]['id']}")
+        nav.append(1)
+    if page["has_next"]:
+        kb.button(text="▶", callback_data=f"tl:next:{tasks[-1]['sort_ts']}:{tasks[-1]['id']}")
+        nav.append(1)
     kb.button(text="⬅ Назад", callback_data="tasks")
-    # Сетка: по 2 кнопки на задачу, последняя одна
-    sizes = [2] * len(tasks) + [1]
-    kb.adjust(*sizes)
-    
-    await nav_edit_or_send(callback, text_output, kb.as_markup())
+    # Сетка: по 2 кнопки на задачу, навигация в один ряд, «Назад» отдельно
+    kb.adjust(*([2] * len(tasks) + ([len(nav)] if nav else []) + [1]))
+    return text_output, kb.as_markup()
+
+async def show_task_page(callback: CallbackQuery, page):
+    if not page["tasks"]:
+        await nav_edit_or_send(callback, "📭 <b>Список задач пуст.</b>\nСамое время добавить что-то!", tasks_keyboard())
+        return
+    text_output, markup = render_task_page(page)
+    await nav_edit_or_send(callback, text_output, markup)
+
+@router.callback_query(F.data == "task_list")
+async def show_tasks(callback: CallbackQuery):
+    await show_task_page(callback, await get_task_page(callback.from_user.id, TASK_PAGE_SIZE))
+
+@router.callback_query(F.data.startswith("tl:"))
+async def task_page_handler(callback: CallbackQuery):
+    _, direction, sort_ts, task_id = callback.data.split(":")
+    key = (int(sort_ts), int(task_id))
+    user_id = callback.from_user.id
+    if direction == "next":
+        page = await get_task_page(user_id, TASK_PAGE_SIZE, after=key)
+    else:
+        page = await get_task_page(user_id, TASK_PAGE_SIZE, before=key)
+    if not page["tasks"]:
+        # Пока листали, задачи дальше закончились — возвращаемся к началу
+        page = await get_task_page(user_id, TASK_PAGE_SIZE)
+    await show_task_page(callback, page)
+    await callback.answer()
 
 @router.callback_query(F.data.startswith("del:"))
 async def del_task_handler(callback: CallbackQuery):
     try:
         task_id = int(callback.data.split(":")[1])
-        delete_task(task_id)
-        await show_tasks(callback)
+        await delete_task(task_id)
+        # Вычеркнутая задача уже убрана из снимка страницы — дочитываются только недостающие строки
+        await show_task_page(callback, await current_task_page(callback.from_user.id, TASK_PAGE_SIZE))
     except Exception as e:
         await callback.answer("Ошибка удаления!", show_alert=True)
 
@@ -273,12 +341,73 @@ async def del_task_handler(callback: CallbackQuery):
 async def done_task_handler(callback: CallbackQuery):
     try:
         task_id = int(callback.data.split(":")[1])
-        mark_task_completed(task_id)
+        await mark_task_completed(task_id)
         await callback.answer("Супер! Задача выполнена 🎉")
-        await show_tasks(callback)
+        await show_task_page(callback, await current_task_page(callback.from_user.id, TASK_PAGE_SIZE))
     except Exception as e:
         await callback.answer("Ошибка!", show_alert=True)
 
+# --- БЛОК: ПОИСК ЗАДАЧ (/search) ---
+
+SEARCH_PAGE_SIZE = 5
+
+async def render_search_page(user_id, query, offset):
+    """Текст и клавиатура страницы результатов поиска"""
+    tasks, total = await search_tasks(user_id, query, limit=SEARCH_PAGE_SIZE, offset=offset)
+    kb = InlineKeyboardBuilder()
+    if not total:
+        kb.button(text="⬅ В меню", callback_data="back_main")
+        return f"🔎 По запросу «{query}» ничего не найдено.", kb.as_markup()
+
+    page, pages = offset // SEARCH_PAGE_SIZE + 1, (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    text_output = f"🔎 <b>Найдено: {total}</b> (стр. {page}/{pages})\n\n"
+    for t in tasks:
+        text_output += f"🔹 <b>{t['title']}</b>\n🕒 {t['due_datetime']}\n\n"
+        kb.button(text="✅", callback_data=f"done:{t['id']}")
+        kb.button(text="❌", callback_data=f"del:{t['id']}")
+    nav = []
+    if offset > 0:
+        kb.button(text="◀", callback_data=f"search:{offset - SEARCH_PAGE_SIZE}")
+        nav.append(1)
+    if offset + SEARCH_PAGE_SIZE < total:
+        kb.button(text="▶", callback_data=f"search:{offset + SEARCH_PAGE_SIZE}")
+        nav.append(1)
+    kb.button(text="⬅ В меню", callback_data="back_main")
+    kb.adjust(*([2] * len(tasks) + ([len(nav)] if nav else []) + [1]))
+    return text_output, kb.as_markup()
+
+@router.message(F.text.startswith("/search"))
+async def search_command(message: Message):
+    user_id = message.from_user.id
+    query = message.text.removeprefix("/search").strip()
+    if not query:
+        await message.answer("🔎 Напиши, что искать: <code>/search отчёт</code>", parse_mode="HTML")
+        return
+    # Запрос храним в сессии: в callback_data (64 байта) он может не поместиться
+    ctx_data = await sessions.get(user_id)
+    ctx_data["search"] = query
+    sessions.save(user_id, ctx_data)
+
+    text_output, markup = await render_search_page(user_id, query, 0)
+    sent_msg = await message.answer(text_output, reply_markup=markup, parse_mode="HTML")
+    await safe_delete(message.bot, message.chat.id, message.message_id)
+    old_bot_msg_id = await get_last_msg(user_id)
+    if old_bot_msg_id:
+        await safe_delete(message.bot, message.chat.id, old_bot_msg_id)
+    await update_last_msg(user_id, sent_msg.message_id)
+
+@router.callback_query(F.data.startswith("search:"))
+async def search_page_handler(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    query = (await sessions.get(user_id)).get("search")
+    if not query:
+        await callback.answer("Поиск устарел, повтори /search", show_alert=True)
+        return
+    offset = max(0, int(callback.data.split(":")[1]))
+    text_output, markup = await render_search_page(user_id, query, offset)
+    await nav_edit_or_send(callback, text_output, markup)
+    await callback.answer()
+
 # ==========================================================
 # 📊 СТАТИСТИКА
 # ==========================================================
@@ -289,12 +418,10 @@ async def stats_handler(callback: CallbackQuery):
     # Удаляем старое сообщение (текст или фото)
     await safe_delete(callback.bot, callback.message.chat.id, callback.message.message_id)
     
-    comp, pend, days, counts = get_stats_data(user_id)
-    photo_buf = draw_stats_chart(comp, pend, days, counts)
-    image_file = BufferedInputFile(photo_buf.read(), filename="stats.png")
-    
-    sent_msg = await callback.message.answer_photo(
-        photo=image_file,
+    comp, pend, days, counts = await get_stats_data(user_id)
+    load_labels, load_counts = await get_upcoming_load(user_id)
+    sent_msg = await answer_stats_chart(
+        callback.message, (comp, pend, load_labels, load_counts),
         caption=(
             f"📊 <b>Твоя продуктивность:</b>\n\n"
             f"✅ Выполнено задач: <b>{comp}</b>\n"
@@ -303,7 +430,7 @@ async def stats_handler(callback: CallbackQuery):
         ),
         reply_markup=main_menu()
     )
-    update_last_msg(user_id, sent_msg.message_id)
+    await update_last_msg(user_id, sent_msg.message_id)
 
 # ==========================================================
 # 📅 КАЛЕНДАРЬ
@@ -313,7 +440,7 @@ async def stats_handler(callback: CallbackQuery):
 async def open_calendar_handler(callback: CallbackQuery):
     now = datetime.now()
     year, month = now.year, now.month
-    active_days = get_days_with_tasks(callback.from_user.id, year, month)
+    active_days = await get_days_with_tasks(callback.from_user.id, year, month)
     await nav_edit_or_send(
         callback,
         f"📅 <b>Календарь задач</b>\nВыберите дату:",
@@ -339,7 +466,7 @@ async def calendar_action_handler(callback: CallbackQuery):
             month += 1
             if month > 12: month = 1; year += 1
         
-        active_days = get_days_with_tasks(callback.from_user.id, year, month)
+        active_days = await get_days_with_tasks(callback.from_user.id, year, month)
         await callback.message.edit_reply_markup(
             reply_markup=build_month(year, month, active_days)
         )
@@ -350,7 +477,7 @@ async def calendar_action_handler(callback: CallbackQuery):
         month = int(parts[3])
         day = int(parts[4])
         date_str = f"{year}-{month:02d}-{day:02d}"
-        tasks = get_tasks_for_day(callback.from_user.id, date_str)
+        tasks = await get_tasks_for_day(callback.from_user.id, date_str)
         
         kb = InlineKeyboardBuilder()
         kb.button(text="⬅ Назад к календарю", callback_data=f"cal:back:{year}:{month}")
@@ -369,7 +496,7 @@ async def calendar_action_handler(callback: CallbackQuery):
     elif action == "back":
         year = int(parts[2])
         month = int(parts[3])
-        active_days = get_days_with_tasks(callback.from_user.id, year, month)
+        active_days = await get_days_with_tasks(callback.from_user.id, year, month)
         await callback.message.edit_text(
             f"📅 <b>Календарь задач</b>\nВыберите дату:",
             reply_markup=build_month(year, month, active_days)
@@ -380,7 +507,7 @@ async def calendar_action_handler(callback: CallbackQuery):
 @router.callback_query(F.data == "day")
 async def today_plan(callback: CallbackQuery):
     today_str = datetime.now().strftime("%Y-%m-%d")
-    tasks = list_tasks(callback.from_user.id)
+    tasks = await list_tasks(callback.from_user.id)
     today_tasks = [t for t in tasks if t["due_datetime"].startswith(today_str)]
     
     if not today_tasks:
@@ -399,8 +526,8 @@ async def reminders_menu(callback: CallbackQuery):
     await nav_edit_or_send(
         callback,
         "⏰ <b>Информация о напоминаниях:</b>\n\n"
-        "Бот автоматически проверяет ваши задачи каждые 30 секунд. "
-        "Если время задачи совпадает с текущим временем, вы получите уведомление.", 
+        "Бот присылает уведомление ровно в момент, на который назначена задача. "
+        "Если бот был перезапущен, пропущенные напоминания придут сразу после старта.", 
         main_menu()
     )
 
@@ -411,7 +538,7 @@ async def reminders_menu(callback: CallbackQuery):
 @router.callback_query(F.data == "ai")
 async def ai_start(callback: CallbackQuery):
     user_id = callback.from_user.id
-    user_context[user_id] = {"mode": "ai"}
+    sessions.save(user_id, {"mode": "ai"})
     await nav_edit_or_send(
         callback,
         "🧠 <b>ИИ-Ассистент активирован.</b>\n\n"
@@ -427,23 +554,90 @@ async def ai_start(callback: CallbackQuery):
 
 @router.callback_query(F.data == "ai_stop")
 async def ai_stop(callback: CallbackQuery):
-    user_context.pop(callback.from_user.id, None)
+    sessions.delete(callback.from_user.id)
     await nav_edit_or_send(callback, "👌 ИИ режим выключен. Возврат в меню.", main_menu())
 
 # ==========================================================
 # 📨 ОБРАБОТЧИК ТЕКСТА
 # ==========================================================
 
+async def run_ai_action(message: Message, user_id, action_data):
+    """Выполняет действие от ИИ или локального разбора (create_task / delete_task / list_tasks)"""
+    action = action_data.get("action")
+
+    if action == "create_task":
+        t_title = action_data.get("title", "Задача")
+        dt_obj = parse_date_time(action_data.get("date"), action_data.get("time"))
+        if dt_obj:
+            db_str = dt_obj.strftime("%Y-%m-%d %H:%M")
+            await add_task(user_id, t_title, db_str)
+            final_msg = await message.answer(f"✅ <b>Задача создана!</b>\n\n🎯 {t_title}\n📅 {db_str}", reply_markup=ai_exit_kb())
+        else:
+            final_msg = await message.answer(f"⚠ Ошибка в дате от ИИ.", reply_markup=ai_exit_kb())
+
+    elif action == "delete_task":
+        keywords = action_data.get("keywords", "").lower()
+        # Поиск по FTS-индексу: одну задачу удаляем сразу, несколько — только после подтверждения
+        found, total = await search_tasks(user_id, keywords, limit=5)
+        if not total:
+            final_msg = await message.answer(f"🤷‍♂️ Не нашел задач с «{keywords}».", reply_markup=ai_exit_kb())
+        elif total == 1:
+            await delete_task(found[0]["id"])
+            final_msg = await message.answer(f"🗑 <b>Удалена задача:</b> {found[0]['title']}", reply_markup=ai_exit_kb())
+        else:
+            ctx_data = await sessions.get(user_id)
+            ctx_data["delete_keywords"] = keywords
+            sessions.save(user_id, ctx_data)
+            kb = InlineKeyboardBuilder()
+            kb.button(text=f"🗑 Удалить все ({total})", callback_data="aidel:yes")
+            kb.button(text="Отмена", callback_data="aidel:no")
+            kb.adjust(2)
+            titles = "\n".join(f"🔹 {t['title']}" for t in found)
+            more = f"\n…и ещё {total - len(found)}" if total > len(found) else ""
+            final_msg = await message.answer(
+                f"❓ <b>Под «{keywords}» подходят {total} задач:</b>\n\n{titles}{more}\n\nУдалить все?",
+                reply_markup=kb.as_markup())
+
+    else:
+        date_str = action_data.get("date")
+        tasks = await get_tasks_for_day(user_id, date_str) if date_str else await list_tasks(user_id)
+        tasks = [t for t in tasks if t["status"] == "pending"]
+        header = f"📅 <b>Задачи на {datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y')}:</b>" if date_str else "📋 <b>Ваши активные задачи:</b>"
+        if not tasks:
+            text_out = f"{header}\n\nЗадач нет 🌴"
+        else:
+            text_out = header + "\n\n" + "\n".join(f"⏰ {t['due_datetime']} — {t['title']}" for t in tasks[:30])
+            if len(tasks) > 30:
+                text_out += f"\n…и ещё {len(tasks) - 30}"
+        final_msg = await message.answer(text_out, reply_markup=ai_exit_kb())
+
+    await update_last_msg(user_id, final_msg.message_id)
+
+@router.callback_query(F.data.startswith("aidel:"))
+async def confirm_bulk_delete(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    ctx_data = await sessions.get(user_id)
+    keywords = ctx_data.pop("delete_keywords", None)
+    sessions.save(user_id, ctx_data)
+    if callback.data == "aidel:yes" and keywords:
+        deleted = await delete_matching_tasks(user_id, keywords)
+        text_out = f"🗑 <b>Удалено задач: {len(deleted)}</b>"
+    else:
+        text_out = "Удаление отменено."
+    await nav_edit_or_send(callback, text_out, ai_exit_kb())
+    await callback.answer()
+
 @router.message()
 async def text_handler(message: Message):
     user_id = message.from_user.id
-    ctx_data = user_context.get(user_id, {})
+    ctx_data = await sessions.get(user_id)
     mode = ctx_data.get("mode")
     last_bot_msg_id = ctx_data.get("last_msg_id")
 
     # --- СЦЕНАРИЙ 1: РУЧНОЙ ВВОД ЗАДАЧИ ---
     if mode == "add_title":
-        user_context[user_id]["title"] = message.text
+        ctx_data["title"] = message.text
+        sessions.save(user_id, ctx_data)
         return await ask_date_step(message, last_bot_msg_id)
 
     if mode == "add_date":
@@ -457,97 +651,95 @@ async def text_handler(message: Message):
             sent_msg = await message.answer("⚠ Дата слишком короткая. Попробуй формат ДД/ММ/ГГГГ")
             await safe_delete(message.bot, message.chat.id, message.message_id)
             if last_bot_msg_id: await safe_delete(message.bot, message.chat.id, last_bot_msg_id)
-            update_last_msg(user_id, sent_msg.message_id)
+            await update_last_msg(user_id, sent_msg.message_id)
             return
 
-        user_context[user_id]["date"] = final_date_str
+        ctx_data["date"] = final_date_str
+        sessions.save(user_id, ctx_data)
         return await ask_time_step(message, last_bot_msg_id)
 
     if mode == "add_time":
         raw_time = message.text.strip()
-        dt_obj = parse_date_time(user_context[user_id]["date"], raw_time)
+        dt_obj = parse_date_time(ctx_data["date"], raw_time)
         
         if dt_obj is None:
             sent_msg = await message.answer("⚠ Неверный формат времени. Используй ЧЧ:ММ.")
             await safe_delete(message.bot, message.chat.id, message.message_id)
             if last_bot_msg_id: await safe_delete(message.bot, message.chat.id, last_bot_msg_id)
-            update_last_msg(user_id, sent_msg.message_id)
+            await update_last_msg(user_id, sent_msg.message_id)
             return
         
         db_datetime_str = dt_obj.strftime("%Y-%m-%d %H:%M")
-        task_title = user_context[user_id]["title"]
-        add_task(user_id, task_title, db_datetime_str)
-        user_context[user_id]["mode"] = None
+        task_title = ctx_data["title"]
+        await add_task(user_id, task_title, db_datetime_str)
+        ctx_data["mode"] = None
+        sessions.save(user_id, ctx_data)
         
         sent_msg = await message.answer(f"✅ <b>Отлично!</b>\nЗадача «{task_title}» сохранена.", reply_markup=main_menu())
         await safe_delete(message.bot, message.chat.id, message.message_id)
         if last_bot_msg_id: await safe_delete(message.bot, message.chat.id, last_bot_msg_id)
-        update_last_msg(user_id, sent_msg.message_id)
+        await update_last_msg(user_id, sent_msg.message_id)
         return
 
     # --- СЦЕНАРИЙ 2: ИИ АССИСТЕНТ ---
     if mode == "ai":
-        wait_msg = await message.answer("⏳ <i>Анализирую запрос...</i>")
+        started = time.perf_counter()
         await safe_delete(message.bot, message.chat.id, message.message_id)
         if last_bot_msg_id: await safe_delete(message.bot, message.chat.id, last_bot_msg_id)
 
-        raw_tasks = list_tasks(user_id)
-        if raw_tasks:
-            tasks_context_str = "\n".join([f"- {t['title']} ({t['due_datetime']})" for t in raw_tasks])
-        else:
-            tasks_context_str = "Список задач пуст."
+        # Частые команды разбираем локально, без похода в GigaChat
+        intent = parse_intent(message.text)
+        if intent:
+            await run_ai_action(message, user_id, intent)
+            intent_stats.observe(True, time.perf_counter() - started)
+            return
+
+        wait_msg = await message.answer("⏳ <i>Анализирую запрос...</i>")
+        raw_tasks = await list_tasks(user_id)
+        tasks_context_str = build_tasks_context(raw_tasks, message.text)
 
-        ai_response_text = await ai_answer(message.text, tasks_context=tasks_context_str)
+        ai_response_text = await stream_ai_reply(wait_msg, message.text, tasks_context_str, user_id=user_id)
         json_data = parse_json_from_text(ai_response_text)
-        await safe_delete(message.bot, message.chat.id, wait_msg.message_id)
+        intent_stats.observe(False, time.perf_counter() - started)
 
-        if json_data and "action" in json_data:
-            action = json_data.get("action")
-            
-            if action == "create_task":
-                t_title = json_data.get("title", "Задача")
-                dt_obj = parse_date_time(json_data.get("date"), json_data.get("time"))
-                if dt_obj:
-                    db_str = dt_obj.strftime("%Y-%m-%d %H:%M")
-                    add_task(user_id, t_title, db_str)
-                    final_msg = await message.answer(f"✅ <b>Задача создана!</b>\n\n🎯 {t_title}\n📅 {db_str}", reply_markup=ai_exit_kb())
-                else:
-                    final_msg = await message.answer(f"⚠ Ошибка в дате от ИИ.", reply_markup=ai_exit_kb())
-                update_last_msg(user_id, final_msg.message_id)
-                return
-
-            elif action == "delete_task":
-                keywords = json_data.get("keywords", "").lower()
-                to_delete = [t for t in raw_tasks if keywords in t['title'].lower()]
-                if not to_delete:
-                    final_msg = await message.answer(f"🤷‍♂️ Не нашел задач с «{keywords}».", reply_markup=ai_exit_kb())
-                else:
-                    for t in to_delete: delete_task(t['id'])
-                    final_msg = await message.answer(f"🗑 <b>Удалено задач: {len(to_delete)}</b>", reply_markup=ai_exit_kb())
-                update_last_msg(user_id, final_msg.message_id)
-                return
-
-        final_msg = await message.answer(ai_response_text, reply_markup=ai_exit_kb())
-        update_last_msg(user_id, final_msg.message_id)
+        if json_data and json_data.get("action") in ("create_task", "delete_task"):
+            await safe_delete(message.bot, message.chat.id, wait_msg.message_id)
+            await run_ai_action(message, user_id, json_data)
+            return
+
+        # Обычный ответ уже показан в wait_msg — дописываем финальный текст и кнопку
+        try:
+            await wait_msg.edit_text(ai_response_text[:4096], reply_markup=ai_exit_kb())
+            await update_last_msg(user_id, wait_msg.message_id)
+        except TelegramBadRequest:
+            await safe_delete(message.bot, message.chat.id, wait_msg.message_id)
+            final_msg = await message.answer(ai_response_text, reply_markup=ai_exit_kb())
+            await update_last_msg(user_id, final_msg.message_id)
         return
 
     # --- СЦЕНАРИЙ 3: МУСОР ---
     sent_msg = await message.answer("🤔 Я не понял. Выбери действие в меню:", reply_markup=main_menu())
     await safe_delete(message.bot, message.chat.id, message.message_id)
     if last_bot_msg_id: await safe_delete(message.bot, message.chat.id, last_bot_msg_id)
-    update_last_msg(user_id, sent_msg.message_id)
+    await update_last_msg(user_id, sent_msg.message_id)
 
 # ==========================================================
 # ⏰ ПЛАНИРОВЩИК ЗАДАЧ
 # ==========================================================
 
-async def setup_scheduler(scheduler, bot):
-    async def check_reminders():
-        now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
-        tasks = get_pending_reminders(now_str)
+async def setup_scheduler(scheduler, bot, delivery):
+    async def send_reminders(tasks):
         for t in tasks:
-            try:
-                await bot.send_message(chat_id=t["user_id"], text=f"🔔 <b>НАПОМИНАНИЕ!</b>\n\nНе забудь: {t['title']}")
-            except Exception:
-                pass
-    scheduler.add_job(check_reminders, "interval", seconds=30)
\ No newline at end of file
+            await delivery.enqueue(t["user_id"], f"🔔 <b>НАПОМИНАНИЕ!</b>\n\nНе забудь: {t['title']}", task_id=t["id"])
+
+    def log_delivery_stats():
+        stats = delivery.stats()
+        if stats["in_queue"]:
+            logging.info(f"Доставка напоминаний: {stats}")
+
+    engine = ReminderEngine(send_reminders)
+    await engine.start()
+    # Страховочная подгрузка горизонта (движок и сам перезагружается по его окончании)
+    scheduler.add_job(engine.reload, "interval", hours=1)
+    scheduler.add_job(log_delivery_stats, "interval", minutes=1)
+    return engine
@@ -0,0 +1,248 @@
+"""
+Локальный разбор частых команд без обращения к GigaChat.
+
+«напомни купить хлеб завтра в 10:00», «удали задачу про встречу», «что у меня
+сегодня?» разбираются заранее скомпилированными регулярками и грамматикой
+относительных дат. parse_intent возвращает действие в том же виде, что и JSON
+от ИИ, или None — тогда запрос уходит в ai_answer как раньше.
+"""
+import re
+from datetime import datetime, timedelta
+
+from app.ai_context import MONTHS, WEEKDAYS
+from app.metrics import REGISTRY
+
+# Время по умолчанию, если в команде есть только дата
+DEFAULT_TIME = (9, 0)
+
+_CREATE_RE = re.compile(
+    r"^(?:напомни(?:ть)?(?:\s+мне)?|создай(?:\s+задачу)?|добавь(?:\s+задачу)?|запиши(?:\s+задачу)?|новая\s+задача)"
+    r"[\s:,-]+(?P<rest>.+)$"
+)
+_DELETE_RE = re.compile(
+    r"^(?:удали(?:ть)?|убери|сотри)(?:\s+(?:задачу|задачи|все\s+задачи))?(?:\s+(?:про|о|об|с|со))?"
+    r"[\s:,-]+(?P<rest>.+)$"
+)
+_LIST_RE = re.compile(
+    r"^(?:что\s+у\s+меня|какие\s+(?:у\s+меня\s+)?(?:задачи|дела|планы)|покажи(?:\s+мои)?\s+задачи|"
+    r"список\s+задач|мои\s+задачи|план(?:\s+на)?)(?P<rest>.*)$"
+)
+
+# Грамматика дат и времени. Каждая регулярка вырезается из текста — остаток становится названием.
+# «10:30» и «в 10.30»; «10.03» без «в» — это дата
+_TIME_RE = re.compile(
+    r"(?:\bв\s+)?\b(?P<h>[01]?\d|2[0-3]):(?P<m>[0-5]\d)\b|\bв\s+(?P<h2>[01]?\d|2[0-3])\.(?P<m2>[0-5]\d)\b"
+)
+_HOUR_RE = re.compile(r"\bв\s+(?P<h>[01]?\d|2[0-3])(?:\s*(?:час(?:а|ов)?|ч))?(?:\s+(?P<part>утра|дня|вечера|ночи))?(?=\s|$)")
+_IN_RE = re.compile(
+    r"\bчерез\s+(?:(?P<n>\d+|полчаса|пол\s*часа)\s*)?(?P<unit>минут[уы]?|мин|час(?:а|ов)?|дн(?:я|ей)|день|недел[юиь])?(?=\s|$)"
+)
+_DAY_WORD_RE = re.compile(r"\b(?:на\s+)?(?P<word>сегодня|послезавтра|завтра)\b")
+_WEEKDAY_RE = re.compile(r"\b(?:(?:в|во|на)\s+)?(?P<word>понедельник|вторник|среду|четверг|пятницу|субботу|воскресенье)\b")
+_NUM_DATE_RE = re.compile(r"\b(?:на\s+)?(?P<d>\d{1,2})[./](?P<m>\d{1,2})(?:[./](?P<y>\d{2,4}))?\b")
+_TEXT_DATE_RE = re.compile(r"\b(?:на\s+)?(?P<d>\d{1,2})\s+(?P<month>[а-я]+)\b")
+_SPACES_RE = re.compile(r"\s+")
+
+# Слова, которые не указывают на конкретную задачу (текст уже без «ё»)
+_GENERIC_WORDS = {
+    "задача", "задачу", "задачи", "задач", "задачки", "дело", "дела", "дел", "напоминание",
+    "напоминания", "все", "всех", "это", "эту", "эти", "ее", "его", "их", "мои", "мою", "мое",
+    "свои", "мне", "меня", "пожалуйста", "и", "про", "о", "об", "с", "со",
+}
+
+# Старые форматы parse_date_time: день/месяц/год или год/месяц/день, время ЧЧ:ММ
+_FORM_DATE_RE = re.compile(r"^(?:(?P<d>\d{1,2})/(?P<m>\d{1,2})/(?P<y>\d{4}|\d{2})|(?P<Y>\d{4})/(?P<M>\d{1,2})/(?P<D>\d{1,2}))$")
+_FORM_TIME_RE = re.compile(r"^(?P<h>\d{1,2}):(?P<m>\d{2})$")
+
+def _safe_datetime(year, month, day, hour=0, minute=0):
+    try:
+        return datetime(year, month, day, hour, minute)
+    except ValueError:
+        return None
+
+def parse_date_time(date_str, time_str):
+    """Дата (ДД/ММ/ГГГГ, ДД/ММ/ГГ, ГГГГ/ММ/ДД; разделители / . -) и время ЧЧ:ММ -> datetime или None"""
+    d = str(date_str).replace(".", "/").replace("-", "/").strip()
+    t = str(time_str).replace(".", ":").replace("-", ":").strip()
+    date_match = _FORM_DATE_RE.match(d)
+    time_match = _FORM_TIME_RE.match(t)
+    if not date_match or not time_match:
+        return None
+    if date_match["Y"]:
+        year, month, day = int(date_match["Y"]), int(date_match["M"]), int(date_match["D"])
+    else:
+        year, month, day = int(date_match["y"]), int(date_match["m"]), int(date_match["d"])
+        if year < 100:
+            year += 2000
+    return _safe_datetime(year, month, day, int(time_match["h"]), int(time_match["m"]))
+
+def _cut(text, match):
+    return text[:match.start()] + " " + text[match.end():]
+
+def parse_when(text, now):
+    """
+    Ищет в тексте дату и время. Возвращает (datetime или None, есть ли время, текст без них).
+    Дата без времени получает DEFAULT_TIME; время без даты — сегодня, а если уже прошло — завтра.
+    """
+    date = None
+    hour = minute = None
+
+    match = _IN_RE.search(text)
+    if match and (match["n"] or match["unit"]):
+        amount = match["n"] or "1"
+        unit = match["unit"] or ""
+        if amount.startswith("пол"):
+            delta = timedelta(minutes=30)
+        elif unit.startswith("мин"):
+            delta = timedelta(minutes=int(amount))
+        elif unit.startswith("час"):
+            delta = timedelta(hours=int(amount))
+        elif unit.startswith(("дн", "день")):
+            delta = timedelta(days=int(amount))
+        elif unit.startswith("недел"):
+            delta = timedelta(weeks=int(amount))
+        else:
+            return None, False, text
+        moment = now + delta
+        if unit.startswith(("дн", "день", "недел")):
+            date = moment.date()
+        else:
+            return moment.replace(second=0, microsecond=0), True, _cut(text, match)
+        text = _cut(text, match)
+
+    # Время с минутами разбираем до дат, чтобы «10:30» не приняли за число и месяц
+    match = _TIME_RE.search(text)
+    if match:
+        hour, minute = int(match["h"] or match["h2"]), int(match["m"] or match["m2"])
+        text = _cut(text, match)
+
+    match = _DAY_WORD_RE.search(text)
+    if date is None and match:
+        date = now.date() + timedelta(days={"сегодня": 0, "завтра": 1, "послезавтра": 2}[match["word"]])
+        text = _cut(text, match)
+
+    match = _WEEKDAY_RE.search(text)
+    if date is None and match:
+        index = next(i for i, prefix in enumerate(WEEKDAYS) if match["word"].startswith(prefix))
+        # «в пятницу» в саму пятницу — это через неделю
+        date = now.date() + timedelta(days=(index - now.weekday()) % 7 or 7)
+        text = _cut(text, match)
+
+    match = _NUM_DATE_RE.search(text)
+    if date is None and match:
+        year = int(match["y"]) if match["y"] else now.year
+        if year < 100:
+            year += 2000
+        parsed = _safe_datetime(year, int(match["m"]), int(match["d"]))
+        if parsed:
+            date = parsed.date()
+            text = _cut(text, match)
+
+    match = _TEXT_DATE_RE.search(text)
+    if date is None and match:
+        word = match["month"]
+        for prefix, month in MONTHS.items():
+            if word.startswith(prefix) and (prefix != "ма" or word in ("мая", "май")):
+                parsed = _safe_datetime(now.year, month, int(match["d"]))
+                if parsed:
+                    date = parsed.date()
+                    text = _cut(text, match)
+                break
+
+    if hour is None:
+        match = _HOUR_RE.search(text)
+        if match:
+            hour, minute = int(match["h"]), 0
+            if match["part"] in ("дня", "вечера") and hour < 12:
+                hour += 12
+            text = _cut(text, match)
+
+    if date is None and hour is None:
+        return None, False, text
+    has_time = hour is not None
+    if not has_time:
+        hour, minute = DEFAULT_TIME
+    if date is None:
+        date = now.date()
+        if (hour, minute) <= (now.hour, now.minute):
+            date += timedelta(days=1)
+    return datetime(date.year, date.month, date.day, hour, minute), has_time, text
+
+def _clean_title(text):
+    return _SPACES_RE.sub(" ", text).strip(" ,.:;-!")
+
+def parse_intent(text, now=None):
+    """
+    Команда пользователя -> действие в формате ответа ИИ или None, если разбор не уверен:
+    {"action": "create_task", "title", "date": "ДД/ММ/ГГГГ", "time": "ЧЧ:ММ"},
+    {"action": "delete_task", "keywords"}, {"action": "list_tasks", "date": "ГГГГ-ММ-ДД" или None}.
+    """
+    if not text:
+        return None
+    now = now or datetime.now()
+    original = _SPACES_RE.sub(" ", text.strip())
+    lowered = original.lower().replace("ё", "е").rstrip("?!. ")
+
+    match = _CREATE_RE.match(lowered)
+    if match:
+        due, _, rest = parse_when(match["rest"], now)
+        title = _clean_title(rest)
+        if due is None or not title or due < now:
+            return None
+        # Название берём из исходного текста, чтобы сохранить регистр
+        start = lowered.find(title)
+        if start != -1:
+            title = original[start:start + len(title)]
+        return {"action": "create_task", "title": title[:1].upper() + title[1:],
+                "date": due.strftime("%d/%m/%Y"), "time": due.strftime("%H:%M")}
+
+    match = _DELETE_RE.match(lowered)
+    if match:
+        # Общие слова ничего не выбирают: «удалить задачи» по префиксу совпало бы со всеми
+        # задачами, где есть «задач...». Без конкретного слова решать оставляем ИИ.
+        words = [w for w in _clean_title(match["rest"]).split(" ") if w not in _GENERIC_WORDS]
+        if not words:
+            return None
+        return {"action": "delete_task", "keywords": " ".join(words)}
+
+    match = _LIST_RE.match(lowered)
+    if match:
+        rest = match["rest"].strip()
+        if not rest:
+            return {"action": "list_tasks", "date": None}
+        due, has_time, rest = parse_when(rest, now)
+        if due is None or has_time or _clean_title(rest):
+            return None
+        return {"action": "list_tasks", "date": due.strftime("%Y-%m-%d")}
+    return None
+
+class IntentStats:
+    """Доля запросов, разобранных локально, и время ответа по обоим путям"""
+
+    def __init__(self):
+        self.local = 0
+        self.llm = 0
+        self.local_latency = REGISTRY.histogram("ai_mode_reply_seconds", "Ответ в режиме ИИ", path="local")
+        self.llm_latency = REGISTRY.histogram("ai_mode_reply_seconds", "Ответ в режиме ИИ", path="llm")
+
+    def observe(self, local, seconds):
+        if local:
+            self.local += 1
+            self.local_latency.observe(seconds)
+        else:
+            self.llm += 1
+            self.llm_latency.observe(seconds)
+
+    def stats(self):
+        total = self.local + self.llm
+        return {
+            "local": self.local,
+            "llm": self.llm,
+            "local_ratio": self.local / total if total else 0.0,
+            "local_latency": self.local_latency.snapshot(),
+            "llm_latency": self.llm_latency.snapshot(),
+        }
+
+intent_stats = IntentStats()
+REGISTRY.gauge("ai_mode_requests_total", "Запросы в режиме ИИ: разобраны локально или ушли в LLM",
+               lambda: {"local": intent_stats.local, "llm": intent_stats.llm}, label="path", kind="counter")
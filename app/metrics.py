@@ -0,0 +1,138 @@
+"""
+Простые метрики процесса: счётчики и гистограммы с фиксированными корзинами,
+реестр REGISTRY и вывод в текстовом формате Prometheus (/metrics).
+
+Метрики живут в памяти процесса: при нескольких webhook-воркерах у каждого свои.
+"""
+import bisect
+import math
+
+# Корзины по умолчанию (секунды): от 0.5 мс до 10 с
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # последняя корзина — +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (верхняя граница корзины)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+def _escape(value, quote=True):
+    """Экранирование текстового формата: обратная косая черта, перевод строки и — в значениях меток — кавычка"""
+    text = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+    return text.replace('"', '\\"') if quote else text
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    # Значения приходят извне (имя команды, ключ очереди): кавычка или перевод строки сломали бы вывод
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Registry:
+    """
+    Метрики по имени и набору меток. counter()/histogram() возвращают существующую
+    метрику или создают новую — вызывать можно прямо на горячем пути.
+    gauge() регистрирует функцию, значение которой читается только при выводе.
+    """
+
+    def __init__(self):
+        self._metrics = {}   # (имя, метки) -> метрика
+        self._meta = {}      # имя -> (тип, описание)
+        self._gauges = {}    # имя -> (функция, имя метки для словаря)
+
+    def _get(self, kind, factory, name, help_text, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            self._meta.setdefault(name, (kind, help_text))
+            metric = self._metrics[key] = factory()
+        return metric
+
+    def counter(self, name, help_text="", **labels):
+        return self._get("counter", Counter, name, help_text, labels)
+
+    def histogram(self, name, help_text="", buckets=LATENCY_BUCKETS, **labels):
+        return self._get("histogram", lambda: Histogram(buckets), name, help_text, labels)
+
+    def gauge(self, name, help_text, func, label="key", kind="gauge"):
+        """func() -> число или {значение метки: число}; нечисловые значения пропускаются"""
+        self._meta[name] = (kind, help_text)
+        self._gauges[name] = (func, label)
+
+    def render(self):
+        by_name = {}
+        for (name, labels), metric in self._metrics.items():
+            by_name.setdefault(name, []).append((labels, metric))
+        lines = []
+        for name, (kind, help_text) in self._meta.items():
+            if help_text:
+                lines.append(f"# HELP {name} {_escape(help_text, quote=False)}")
+            lines.append(f"# TYPE {name} {kind}")
+            if name in self._gauges:
+                lines.extend(self._render_gauge(name, *self._gauges[name]))
+                continue
+            for labels, metric in by_name.get(name, ()):
+                if kind == "counter":
+                    lines.append(f"{name}{_labels_text(labels)} {metric.value}")
+                    continue
+                seen = 0
+                for bound, n in zip(metric.buckets + (float("inf"),), metric.counts):
+                    seen += n
+                    lines.append(f"{name}_bucket{_labels_text(labels + (('le', _number(bound)),))} {seen}")
+                lines.append(f"{name}_sum{_labels_text(labels)} {metric.sum}")
+                lines.append(f"{name}_count{_labels_text(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_gauge(name, func, label):
+        try:
+            value = func()
+        except Exception:
+            return []
+        items = value.items() if isinstance(value, dict) else [(None, value)]
+        lines = []
+        for key, number in items:
+            if isinstance(number, bool) or not isinstance(number, (int, float)) or math.isnan(number):
+                continue
+            labels = () if key is None else ((label, key),)
+            lines.append(f"{name}{_labels_text(labels)} {number}")
+        return lines
+
+REGISTRY = Registry()
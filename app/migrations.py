@@ -0,0 +1,252 @@
+"""
+Версионные миграции схемы БД.
+
+Текущая версия схемы хранится в PRAGMA user_version. Каждая миграция —
+функция, получающая соединение; все ещё не применённые миграции выполняются
+по порядку, каждая в своей транзакции, вместе с записью нового номера версии.
+Чтобы изменить схему, добавьте функцию в конец MIGRATIONS — уже выпущенные
+миграции не редактируются.
+"""
+import logging
+
+from app import db
+
+TASKS_DDL = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        title TEXT,
+        due_datetime TEXT,
+        status TEXT DEFAULT 'pending',
+        reminded INTEGER DEFAULT 0,
+        category TEXT
+    )
+"""
+
+def _columns(conn, table):
+    return {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def m001_base_schema(conn):
+    """Приводит таблицу tasks к единому виду, включая старые базы с completed/remind"""
+    columns = _columns(conn, "tasks")
+    if not columns:
+        conn.execute(TASKS_DDL)
+        return
+
+    if "completed" in columns:
+        status_expr = "CASE WHEN completed THEN 'done' ELSE 'pending' END"
+    else:
+        status_expr = "COALESCE(status, 'pending')"
+    reminded_expr = "reminded" if "reminded" in columns else "0"
+    category_expr = "category" if "category" in columns else "NULL"
+
+    conn.execute("ALTER TABLE tasks RENAME TO tasks_old")
+    conn.execute(TASKS_DDL)
+    conn.execute(f"""
+        INSERT INTO tasks (id, user_id, title, due_datetime, status, reminded, category)
+        SELECT id, user_id, title, due_datetime, {status_expr}, {reminded_expr}, {category_expr}
+        FROM tasks_old
+    """)
+    conn.execute("DROP TABLE tasks_old")
+    conn.execute("DROP INDEX IF EXISTS idx_tasks_status_due")
+    conn.execute("""
+        UPDATE tasks SET category = substr(title, 2, instr(title, ']') - 2)
+        WHERE category IS NULL AND title LIKE '[%]%'
+    """)
+
+def m002_due_ts(conn):
+    """Срок как целое число секунд (настенное время, см. db.to_ts) — для диапазонных запросов по индексу"""
+    conn.execute("ALTER TABLE tasks ADD COLUMN due_ts INTEGER")
+    conn.execute("UPDATE tasks SET due_ts = CAST(strftime('%s', due_datetime) AS INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_status_due ON tasks (user_id, status, due_ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_due ON tasks (status, due_ts)")
+
+def m003_dead_letters(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            task_id INTEGER,
+            error TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def m004_stats_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            completed INTEGER NOT NULL DEFAULT 0,
+            pending INTEGER NOT NULL DEFAULT 0,
+            active_days INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_category_counts (
+            user_id INTEGER,
+            category TEXT,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, category)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_day_counts (
+            user_id INTEGER,
+            day TEXT,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    """)
+    db.rebuild_stats_in(conn)
+
+def m005_user_due_index(conn):
+    """Календарь и полный список задач: диапазон по сроку без фильтра по статусу"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_due ON tasks (user_id, due_ts)")
+
+def m006_sessions(conn):
+    """Сессии пользователей и FSM (app/session.py); data — JSON"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            key TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at)")
+
+def m007_revisions(conn):
+    """
+    Ревизии для дельта-синхронизации Mini App. Глобальный счётчик растёт на каждое
+    видимое изменение задачи; удалённые задачи остаются в task_tombstones.
+    Всё поддерживается триггерами, поэтому любой код записи получает это бесплатно.
+    """
+    conn.execute("ALTER TABLE tasks ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    conn.execute("ALTER TABLE tasks ADD COLUMN updated_at INTEGER")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sync_counter (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            revision INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS task_tombstones (
+            task_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            revision INTEGER NOT NULL,
+            deleted_at INTEGER
+        )
+    """)
+    # Существующие задачи получают ревизии по порядку id
+    conn.execute("UPDATE tasks SET revision = id, updated_at = CAST(strftime('%s', 'now') AS INTEGER)")
+    conn.execute("INSERT INTO sync_counter (id, revision) SELECT 1, COALESCE(MAX(id), 0) FROM tasks")
+
+    bump = """
+        UPDATE sync_counter SET revision = revision + 1 WHERE id = 1;
+        UPDATE tasks SET revision = (SELECT revision FROM sync_counter WHERE id = 1),
+                         updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = NEW.id;
+    """
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS tasks_revision_insert AFTER INSERT ON tasks BEGIN {bump} END")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS tasks_revision_update
+        AFTER UPDATE OF title, due_datetime, status, category ON tasks BEGIN {bump} END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS tasks_revision_delete AFTER DELETE ON tasks BEGIN
+            UPDATE sync_counter SET revision = revision + 1 WHERE id = 1;
+            INSERT OR REPLACE INTO task_tombstones (task_id, user_id, revision, deleted_at)
+            VALUES (OLD.id, OLD.user_id, (SELECT revision FROM sync_counter WHERE id = 1),
+                    CAST(strftime('%s', 'now') AS INTEGER));
+        END
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_revision ON tasks (user_id, revision)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tombstones_user_revision ON task_tombstones (user_id, revision)")
+
+def m008_applied_ops(conn):
+    """Идемпотентность пакетных операций Mini App: результат каждого op_id клиента"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS applied_ops (
+            user_id INTEGER,
+            op_id TEXT,
+            result TEXT NOT NULL,
+            applied_at INTEGER,
+            PRIMARY KEY (user_id, op_id)
+        ) WITHOUT ROWID
+    """)
+
+def m009_tasks_fts(conn):
+    """
+    Полнотекстовый индекс FTS5 по заголовкам задач. Таблица contentless: в ней только
+    токены заголовка и владельца («u<user_id>»), поэтому поиск фильтрует по пользователю
+    внутри индекса. Синхронизация — триггерами; «ё» приводится к «е», как и в запросах.
+    """
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+            owner, title, content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+        )
+    """)
+    new_doc = "'u' || NEW.user_id, replace(replace(NEW.title, 'ё', 'е'), 'Ё', 'Е')"
+    old_doc = "'u' || OLD.user_id, replace(replace(OLD.title, 'ё', 'е'), 'Ё', 'Е')"
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, owner, title) VALUES (NEW.id, {new_doc});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, owner, title) VALUES ('delete', OLD.id, {old_doc});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF title, user_id ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, owner, title) VALUES ('delete', OLD.id, {old_doc});
+            INSERT INTO tasks_fts (rowid, owner, title) VALUES (NEW.id, {new_doc});
+        END
+    """)
+    conn.execute("""
+        INSERT INTO tasks_fts (rowid, owner, title)
+        SELECT id, 'u' || user_id, replace(replace(title, 'ё', 'е'), 'Ё', 'Е') FROM tasks
+    """)
+
+def m010_analyze(conn):
+    """
+    Статистика для планировщика (sqlite_stat1). Без неё индекс выбирается по эвристикам
+    и может оказаться хуже поиска по id. Дальше статистику обновляет PRAGMA optimize
+    при закрытии соединения (db.close_db).
+    """
+    conn.execute("PRAGMA analysis_limit=1000")
+    conn.execute("ANALYZE")
+
+def m011_task_page_index(conn):
+    """Индекс по ключу страницы списка задач: без срока — в конце (db.PAGE_KEY)"""
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_tasks_user_status_page ON tasks (user_id, status, {db.PAGE_KEY})")
+
+MIGRATIONS = [
+    m001_base_schema,
+    m002_due_ts,
+    m003_dead_letters,
+    m004_stats_tables,
+    m005_user_due_index,
+    m006_sessions,
+    m007_revisions,
+    m008_applied_ops,
+    m009_tasks_fts,
+    m010_analyze,
+    m011_task_page_index,
+]
+
+def migrate(conn):
+    """Применяет недостающие миграции; возвращает итоговую версию схемы"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logging.info(f"Миграция БД {number}: {migration.__name__}")
+        # Явный BEGIN: иначе sqlite3 выполнил бы DDL вне транзакции
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(MIGRATIONS)
@@ -0,0 +1,113 @@
+"""
+Инструментирование горячих путей: задержки и ошибки обработчиков aiogram и
+маршрутов API, отставание event loop и вывод всех метрик на /metrics.
+"""
+import asyncio
+import time
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+from app.metrics import REGISTRY
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner-middleware роутера: время и ошибки каждого обработчика по имени функции"""
+
+    def __init__(self, event_type):
+        self.event_type = event_type
+        self._metrics = {}  # callback обработчика -> (гистограмма, счётчик ошибок)
+
+    def _for(self, callback):
+        metrics = self._metrics.get(callback)
+        if metrics is None:
+            name = getattr(callback, "__name__", "unknown")
+            metrics = self._metrics[callback] = (
+                REGISTRY.histogram("bot_handler_seconds", "Время обработчиков бота",
+                                   event=self.event_type, handler=name),
+                REGISTRY.counter("bot_handler_errors_total", "Исключения в обработчиках бота",
+                                 event=self.event_type, handler=name),
+            )
+        return metrics
+
+    async def __call__(self, handler, event, data):
+        latency, errors = self._for(getattr(data.get("handler"), "callback", None))
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - started)
+
+def setup_bot_metrics(router):
+    router.message.middleware(HandlerMetricsMiddleware("message"))
+    router.callback_query.middleware(HandlerMetricsMiddleware("callback_query"))
+
+# (метод, маршрут) -> гистограмма; (метод, маршрут, код) -> счётчик
+_http_latency = {}
+_http_responses = {}
+
+@web.middleware
+async def http_metrics_middleware(request, handler):
+    """Время и коды ответа по шаблону маршрута (а не по конкретному URL)"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        resource = request.match_info.route.resource
+        key = (request.method, resource.canonical if resource is not None else "unmatched")
+        latency = _http_latency.get(key)
+        if latency is None:
+            latency = _http_latency[key] = REGISTRY.histogram(
+                "http_request_seconds", "Время обработки HTTP-запросов", method=key[0], route=key[1])
+        latency.observe(elapsed)
+        responses = _http_responses.get(key + (status,))
+        if responses is None:
+            responses = _http_responses[key + (status,)] = REGISTRY.counter(
+                "http_responses_total", "HTTP-ответы по кодам", method=key[0], route=key[1], status=status)
+        responses.inc()
+
+async def metrics_handler(request):
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+# Корзины отставания event loop (секунды)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+class LoopLagMonitor:
+    """Раз в interval проверяет, насколько позже запланированного проснулся event loop"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.lag = REGISTRY.histogram("event_loop_lag_seconds", "Опоздание event loop",
+                                      buckets=LOOP_LAG_BUCKETS)
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag.observe(max(loop.time() - expected, 0.0))
+
+loop_monitor = LoopLagMonitor()
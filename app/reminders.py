@@ -0,0 +1,130 @@
+"""
+Движок напоминаний.
+
+Вместо опроса базы каждые 30 секунд держим в памяти min-heap ближайших
+сроков (горизонт HORIZON) и спим ровно до следующего срока. Набор на горизонт
+берётся одним диапазонным запросом по индексу (status, due_ts), новые
+задачи попадают в кучу сразу через repo.on_change. Отправленные напоминания
+помечаются в БД (reminded = 1), поэтому дублей не бывает, а после рестарта
+пропущенные за CATCHUP_WINDOW напоминания досылаются.
+"""
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+
+from app import repo
+from app.db import parse_due, to_ts, from_ts
+
+HORIZON = timedelta(hours=6)
+CATCHUP_WINDOW = timedelta(hours=12)
+
+class ReminderEngine:
+    def __init__(self, send):
+        # send(tasks) — корутина, которая доставляет список напоминаний
+        self._send = send
+        self._heap = []          # (due: datetime, task_id)
+        self._queued = {}        # task_id -> актуальный срок в куче
+        self._horizon_end = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    # --- Загрузка ---
+
+    async def reload(self):
+        """Подгружает сроки на следующий горизонт (и пропущенные после рестарта)"""
+        now = datetime.now()
+        start = now - CATCHUP_WINDOW if self._horizon_end is None else self._horizon_end
+        end = now + HORIZON
+        rows = await repo.get_upcoming_reminders(to_ts(start), to_ts(end))
+        self._horizon_end = end
+        for row in rows:
+            self._push(row["id"], from_ts(row["due_ts"]))
+        self._wakeup.set()
+
+    async def rescan(self):
+        """
+        Перечитывает уже загруженный горизонт: нужно, когда задачи добавляют другие
+        процессы и repo.on_change до этого движка не доходит.
+        """
+        if self._horizon_end is None:
+            return
+        start = datetime.now() - timedelta(minutes=1)
+        rows = await repo.get_upcoming_reminders(to_ts(start), to_ts(self._horizon_end))
+        for row in rows:
+            self._push(row["id"], from_ts(row["due_ts"]))
+        self._wakeup.set()
+
+    def _push(self, task_id, due):
+        # Если срок задачи изменили, старая запись остаётся в куче и будет отброшена при срабатывании
+        if due is None or self._queued.get(task_id) == due:
+            return
+        heapq.heappush(self._heap, (due, task_id))
+        self._queued[task_id] = due
+
+    def _on_change(self, event, data):
+        if event not in ("add", "edit") or self._horizon_end is None:
+            return
+        due = parse_due(data["due_datetime"])
+        # Всё, что позже горизонта, подхватит следующий reload(); задачи в прошлом не напоминаем
+        if due is not None and datetime.now() - timedelta(minutes=1) <= due <= self._horizon_end:
+            is_earliest = not self._heap or due < self._heap[0][0]
+            self._push(data["task_id"], due)
+            if is_earliest:
+                self._wakeup.set()
+
+    # --- Основной цикл ---
+
+    async def start(self):
+        repo.on_change(self._on_change)
+        await self.reload()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                if datetime.now() >= self._horizon_end:
+                    await self.reload()
+                    continue
+                if self._heap and self._heap[0][0] <= datetime.now():
+                    await self._fire_due()
+                    continue
+            except Exception as e:
+                logging.error(f"Ошибка движка напоминаний: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            next_at = min(self._heap[0][0], self._horizon_end) if self._heap else self._horizon_end
+            delay = max((next_at - datetime.now()).total_seconds(), 0.01)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire_due(self):
+        now = datetime.now()
+        due_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            due, task_id = heapq.heappop(self._heap)
+            if self._queued.get(task_id) != due:
+                continue  # устаревшая запись: срок задачи с тех пор изменился
+            del self._queued[task_id]
+            due_ids.append(task_id)
+        # Атомарно помечаем отправленными: выполненные/удалённые отсеются здесь
+        try:
+            tasks = await repo.claim_reminders(due_ids, to_ts(now))
+        except Exception:
+            for task_id in due_ids:
+                self._push(task_id, now)
+            raise
+        if tasks:
+            await self._send(tasks)
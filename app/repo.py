@@ -0,0 +1,249 @@
+"""
+Асинхронный слой доступа к данным.
+
+Обработчики aiogram, API для Mini App и планировщик работают с базой только
+через этот модуль: каждый вызов уходит в выделенный поток БД из app/db.py,
+а event loop в это время обслуживает других пользователей.
+"""
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+
+from app import db
+from app.coalescer import WriteCoalescer
+from app.metrics import REGISTRY
+
+# Одиночные записи задач идут через group commit
+writes = WriteCoalescer()
+
+# Подписчики на изменения задач (движок напоминаний, кэши и т.п.)
+_listeners = []
+
+def on_change(callback):
+    """Регистрирует callback(event, data), вызываемый после каждой записи"""
+    _listeners.append(callback)
+    return callback
+
+def _notify(event, **data):
+    for callback in _listeners:
+        callback(event, data)
+
+# Кэш дней с задачами для календаря: user_id -> {(год, месяц): [дни]}.
+# Навигация «<<»/«>>» по уже открытым месяцам не ходит в БД вовсе.
+# 0 — кэш выключен (несколько процессов не видят изменений друг друга).
+MONTH_CACHE_USERS = 10000
+_month_cache = OrderedDict()
+_month_cache_version = 0
+
+@on_change
+def _invalidate_month_cache(event, data):
+    global _month_cache_version
+    # Выполнение задачи не меняет набор дней — сбрасываем только на добавлении/правке/удалении
+    if event in ("add", "edit", "delete"):
+        _month_cache.pop(data.get("user_id"), None)
+        _month_cache_version += 1
+
+# Снимок открытой страницы списка задач: user_id -> {"anchor", "tasks", "has_next", "stale"}.
+# anchor — ключ (sort_ts, id) последней задачи предыдущей страницы (None — первая страница).
+# Выполненные и удалённые задачи вычёркиваются из снимка, и после клика «✅»/«❌»
+# дочитываются только недостающие строки, а не весь список.
+TASK_PAGE_CACHE_USERS = 10000
+_task_pages = OrderedDict()
+_task_pages_version = 0
+
+@on_change
+def _update_task_pages(event, data):
+    global _task_pages_version
+    _task_pages_version += 1
+    page = _task_pages.get(data.get("user_id"))
+    if page is None:
+        return
+    if event in ("complete", "delete"):
+        page["tasks"] = [t for t in page["tasks"] if t["id"] != data.get("task_id")]
+    else:
+        # Новая или перенесённая задача может попасть куда угодно — страницу перечитаем
+        page["stale"] = True
+
+# Гистограмма времени по функции БД: без поиска в реестре на каждом запросе
+_db_latency = {}
+
+async def run_db(func, *args, **kwargs):
+    """Выполняет синхронную функцию из app/db.py в потоке БД"""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(db.executor, functools.partial(func, *args, **kwargs))
+    except Exception:
+        REGISTRY.counter("db_errors_total", "Ошибки запросов к БД", query=func.__name__).inc()
+        raise
+    finally:
+        latency = _db_latency.get(func)
+        if latency is None:
+            latency = _db_latency[func] = REGISTRY.histogram(
+                "db_query_seconds", "Время запросов к БД", query=func.__name__)
+        # Вместе с ожиданием очереди потока БД — это задержка, которую видит обработчик
+        latency.observe(time.perf_counter() - started)
+
+async def init_db():
+    return await run_db(db.init_db)
+
+async def close_db():
+    await writes.drain()
+    await asyncio.get_running_loop().run_in_executor(None, db.close_db)
+
+async def add_task(user_id, title, due_datetime):
+    task_id = await writes.submit(db.insert_task_in, user_id, title, due_datetime)
+    _notify("add", task_id=task_id, user_id=user_id, due_datetime=due_datetime)
+    return task_id
+
+async def list_tasks(user_id):
+    return await run_db(db.list_tasks, user_id)
+
+def _task_key(task):
+    return (task["sort_ts"], task["id"])
+
+def _remember_task_page(user_id, page, version):
+    if not TASK_PAGE_CACHE_USERS:
+        return
+    # Пока шёл запрос, задачи изменились — снимок сразу помечаем устаревшим
+    page["stale"] = version != _task_pages_version
+    _task_pages[user_id] = page
+    _task_pages.move_to_end(user_id)
+    if len(_task_pages) > TASK_PAGE_CACHE_USERS:
+        _task_pages.popitem(last=False)
+
+async def get_task_page(user_id, size, after=None, before=None):
+    """
+    Страница невыполненных задач: первая, следующая после ключа after или
+    предыдущая перед ключом before. Возвращает {"anchor", "tasks", "has_next"}
+    и запоминает её как снимок открытой страницы пользователя.
+    """
+    version = _task_pages_version
+    if before is not None:
+        # На одну строку больше: она станет якорем страницы, а если её нет — это первая страница
+        rows = await run_db(db.list_tasks_page, user_id, size + 1, before=before)
+        anchor = _task_key(rows[0]) if len(rows) > size else None
+        tasks = rows[-size:]
+        if anchor is None and len(tasks) < size:
+            return await get_task_page(user_id, size)
+        page = {"anchor": anchor, "tasks": tasks, "has_next": True}
+    else:
+        rows = await run_db(db.list_tasks_page, user_id, size + 1, after=after)
+        page = {"anchor": after, "tasks": rows[:size], "has_next": len(rows) > size}
+    _remember_task_page(user_id, page, version)
+    return page
+
+async def current_task_page(user_id, size):
+    """
+    Открытая страница после изменений: из снимка без вычеркнутых задач, дополненного
+    одним запросом на недостающие строки. Опустевшая страница сменяется предыдущей.
+    """
+    page = _task_pages.get(user_id)
+    if page is None:
+        return await get_task_page(user_id, size)
+    if page["stale"]:
+        return await get_task_page(user_id, size, after=page["anchor"])
+    _task_pages.move_to_end(user_id)
+    missing = size - len(page["tasks"])
+    if missing > 0 and page["has_next"]:
+        version = _task_pages_version
+        last = _task_key(page["tasks"][-1]) if page["tasks"] else page["anchor"]
+        rows = await run_db(db.list_tasks_page, user_id, missing + 1, after=last)
+        page = {"anchor": page["anchor"], "tasks": page["tasks"] + rows[:missing], "has_next": len(rows) > missing}
+        _remember_task_page(user_id, page, version)
+    if not page["tasks"] and page["anchor"] is not None:
+        # Ключ якоря + 1 к id: «до якоря включительно», сам якорь попадёт на страницу
+        sort_ts, task_id = page["anchor"]
+        page = await get_task_page(user_id, size, before=(sort_ts, task_id + 1))
+        page["has_next"] = False  # дальше задач нет: эта страница опустела после дочитывания
+    return page
+
+async def get_all_tasks_json(user_id):
+    return await run_db(db.get_all_tasks_json, user_id)
+
+async def get_user_revision(user_id):
+    return await run_db(db.get_user_revision, user_id)
+
+async def get_task_changes(user_id, since=0, limit=500):
+    return await run_db(db.get_task_changes, user_id, since, limit)
+
+async def delete_task(task_id):
+    user_id = await writes.submit(db.delete_task_in, task_id)
+    if user_id is not None:
+        _notify("delete", task_id=task_id, user_id=user_id)
+    return user_id
+
+async def mark_task_completed(task_id):
+    user_id = await writes.submit(db.complete_task_in, task_id)
+    if user_id is not None:
+        _notify("complete", task_id=task_id, user_id=user_id)
+    return user_id
+
+async def search_tasks(user_id, query, limit=10, offset=0, status="pending"):
+    return await run_db(db.search_tasks, user_id, query, limit, offset, status)
+
+async def delete_matching_tasks(user_id, query):
+    """Удаляет невыполненные задачи пользователя, найденные по query; возвращает их id"""
+    task_ids = await writes.submit(db.delete_matching_tasks_in, user_id, query)
+    for task_id in task_ids:
+        _notify("delete", task_id=task_id, user_id=user_id)
+    return task_ids
+
+async def apply_task_batch(user_id, ops):
+    results = await run_db(db.apply_task_batch, user_id, ops)
+    for result in results:
+        if result["status"] != "ok" or result.get("duplicate"):
+            continue
+        if result["action"] in ("add", "edit"):
+            _notify(result["action"], task_id=result["id"], user_id=user_id, due_datetime=result["due_datetime"])
+        else:
+            _notify(result["action"], task_id=result["id"], user_id=user_id)
+    return results
+
+async def get_upcoming_reminders(start_str, end_str):
+    return await run_db(db.get_upcoming_reminders, start_str, end_str)
+
+async def claim_reminders(task_ids, now_ts):
+    return await run_db(db.claim_reminders, task_ids, now_ts)
+
+async def get_days_with_tasks(user_id, year, month):
+    user_months = _month_cache.get(user_id)
+    if user_months is not None and (year, month) in user_months:
+        _month_cache.move_to_end(user_id)
+        return user_months[(year, month)]
+
+    version = _month_cache_version
+    days = await run_db(db.get_days_with_tasks, user_id, year, month)
+    if version != _month_cache_version or not MONTH_CACHE_USERS:
+        # Пока шёл запрос, задачи изменились — результат в кэш не кладём
+        return days
+    _month_cache.setdefault(user_id, {})[(year, month)] = days
+    _month_cache.move_to_end(user_id)
+    if len(_month_cache) > MONTH_CACHE_USERS:
+        _month_cache.popitem(last=False)
+    return days
+
+async def get_tasks_for_day(user_id, date_str):
+    return await run_db(db.get_tasks_for_day, user_id, date_str)
+
+async def get_stats_data(user_id):
+    return await run_db(db.get_stats_data, user_id)
+
+async def get_upcoming_load(user_id, days=7):
+    return await run_db(db.get_upcoming_load, user_id, days)
+
+async def rebuild_stats(user_id=None):
+    return await run_db(db.rebuild_stats, user_id)
+
+async def add_dead_letter(chat_id, task_id, error):
+    return await run_db(db.add_dead_letter, chat_id, task_id, error)
+
+async def load_session(key, min_updated_at):
+    return await run_db(db.load_session, key, min_updated_at)
+
+async def save_sessions(items):
+    return await run_db(db.save_sessions, items)
+
+async def purge_sessions(before):
+    return await run_db(db.purge_sessions, before)
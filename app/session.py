@@ -0,0 +1,157 @@
+"""
+Хранилище пользовательских сессий.
+
+Заменяет глобальный словарь user_context: в памяти держится не больше
+max_size сессий (LRU) и не дольше ttl секунд с последнего обращения, а
+изменения пачками сбрасываются в SQLite (write-behind), так что шаги мастера
+добавления задачи переживают перезапуск бота. Тот же store используется как
+FSM-хранилище aiogram (SessionFSMStorage).
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+from app import repo
+
+class SessionStore:
+    def __init__(self, max_size=10000, ttl=7 * 24 * 3600, flush_interval=1.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        # Несколько процессов (webhook-воркеры): читаем из БД и пишем сразу
+        self.shared = False
+        self._cache = OrderedDict()   # key -> (data, last_access)
+        self._dirty = {}              # key -> data (None — удалить из БД)
+        self._flusher = None
+        self._flushes = set()         # немедленные flush в shared-режиме: ссылки держим до завершения
+
+    # --- Жизненный цикл ---
+
+    async def start(self):
+        await repo.purge_sessions(time.time() - self.ttl)
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+
+    # --- Доступ к сессиям ---
+
+    async def get(self, key) -> dict:
+        """Живой словарь сессии (пустой, если её нет); после изменения вызовите save()"""
+        key = str(key)
+        now = time.time()
+        entry = self._cache.get(key)
+        fresh = not self.shared or key in self._dirty
+        if entry is not None and fresh and now - entry[1] <= self.ttl:
+            self._cache[key] = (entry[0], now)
+            self._cache.move_to_end(key)
+            return entry[0]
+
+        if key in self._dirty:
+            # Вытеснена из памяти, но ещё не записана — берём несохранённую версию
+            data = self._dirty[key] or {}
+        else:
+            data = await repo.load_session(key, now - self.ttl) or {}
+        self._put(key, data, now)
+        return data
+
+    def save(self, key, data=None):
+        """Отмечает сессию изменённой; в БД она попадёт при ближайшем flush"""
+        key = str(key)
+        if data is None:
+            data = self._cache[key][0]
+        self._put(key, data, time.time())
+        self._dirty[key] = data
+        self._flush_if_shared()
+
+    def delete(self, key):
+        key = str(key)
+        self._cache.pop(key, None)
+        self._dirty[key] = None
+        self._flush_if_shared()
+
+    def _flush_if_shared(self):
+        if self.shared:
+            # Event loop держит на задачу только слабую ссылку: без набора её может собрать GC
+            task = asyncio.get_running_loop().create_task(self._flush_logged())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    def _put(self, key, data, now):
+        self._cache[key] = (data, now)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            # Несохранённые изменения вытесненной сессии остаются в _dirty до flush
+            self._cache.popitem(last=False)
+
+    # --- Write-behind ---
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        try:
+            await repo.save_sessions({key: None if data is None else json.dumps(data, ensure_ascii=False)
+                                      for key, data in batch.items()})
+        except Exception:
+            # Вернём в очередь то, что не успели перезаписать заново
+            for key, data in batch.items():
+                self._dirty.setdefault(key, data)
+            raise
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Ошибка сохранения сессий: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logged()
+
+class SessionFSMStorage(BaseStorage):
+    """FSM-хранилище aiogram поверх SessionStore (вместо MemoryStorage)"""
+
+    def __init__(self, store: SessionStore, key_builder=None):
+        self.store = store
+        self.key_builder = key_builder or DefaultKeyBuilder()
+
+    async def set_state(self, key, state=None):
+        session_key = self.key_builder.build(key)
+        session = await self.store.get(session_key)
+        session["state"] = state.state if isinstance(state, State) else state
+        self.store.save(session_key, session)
+
+    async def get_state(self, key):
+        session = await self.store.get(self.key_builder.build(key))
+        return session.get("state")
+
+    async def set_data(self, key, data):
+        session_key = self.key_builder.build(key)
+        session = await self.store.get(session_key)
+        session["data"] = dict(data)
+        self.store.save(session_key, session)
+
+    async def get_data(self, key):
+        session = await self.store.get(self.key_builder.build(key))
+        return dict(session.get("data", {}))
+
+    async def close(self):
+        await self.store.close()
+
+# Общее хранилище на весь процесс (запускается и закрывается в run.py)
+sessions = SessionStore()
@@ -1,14 +1,25 @@
-import matplotlib.pyplot as plt
+import asyncio
+import hashlib
 import io
+import json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
-def draw_stats_chart(completed, pending, days_labels, tasks_per_day):
+def render_stats_png(completed, pending, days_labels, tasks_per_day) -> bytes:
     """
-    Рисует два графика на одной картинке:
+    Рисует два графика на одной картинке и возвращает PNG:
     1. Круговая диаграмма (Выполнено vs В работе)
     2. Столбчатая диаграмма (Нагрузка по дням)
     """
+    # matplotlib грузится ~0.7 с и десятки МБ: импортируем только там, где рисуем
+    # (обычно в процессе пула). Объектный API без pyplot безопасен в воркерах.
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
     # Создаем фигуру с двумя зонами (1 строка, 2 колонки)
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 5))
+    fig = Figure(figsize=(10, 5))
+    FigureCanvasAgg(fig)
+    ax1, ax2 = fig.subplots(1, 2)
     fig.suptitle('📊 Статистика МойРитм', fontsize=16)
 
     # --- 1. Круговая диаграмма (Общий прогресс) ---
@@ -45,8 +56,75 @@ def draw_stats_chart(completed, pending, days_labels, tasks_per_day):
 
     # Сохраняем в буфер (в память), а не в файл
     buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
-    
-    return buf
\ No newline at end of file
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+def draw_stats_chart(completed, pending, days_labels, tasks_per_day):
+    """Синхронный вариант для скриптов: PNG в BytesIO"""
+    return io.BytesIO(render_stats_png(completed, pending, days_labels, tasks_per_day))
+
+class ChartRenderer:
+    """
+    Сервис отрисовки графиков вне event loop.
+
+    Рендер идёт в пуле процессов, готовые PNG лежат в LRU-кэше по хэшу входных
+    данных, а для уже отправленных картинок запоминается Telegram file_id,
+    чтобы одинаковый график не загружать повторно.
+    """
+
+    def __init__(self, workers=2, cache_size=256):
+        self.workers = workers
+        self.cache_size = cache_size
+        self._pool = None
+        self._png_cache = OrderedDict()
+        self._file_ids = OrderedDict()
+        self._inflight = {}
+
+    @staticmethod
+    def key(*args) -> str:
+        raw = json.dumps(args, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def cached_file_id(self, key):
+        file_id = self._file_ids.get(key)
+        if file_id is not None:
+            self._file_ids.move_to_end(key)
+        return file_id
+
+    def remember_file_id(self, key, file_id):
+        self._remember(self._file_ids, key, file_id)
+
+    async def render(self, key, *args) -> bytes:
+        """PNG для набора данных: из кэша или из пула процессов (одинаковые запросы рисуются один раз)"""
+        png = self._png_cache.get(key)
+        if png is not None:
+            self._png_cache.move_to_end(key)
+            return png
+
+        future = self._inflight.get(key)
+        if future is None:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._pool, render_stats_png, *args)
+            self._inflight[key] = future
+        try:
+            png = await asyncio.shield(future)
+        finally:
+            self._inflight.pop(key, None)
+        self._remember(self._png_cache, key, png)
+        return png
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+# Общий сервис на весь процесс (останавливается в run.py)
+chart_renderer = ChartRenderer()
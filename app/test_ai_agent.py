@@ -0,0 +1,95 @@
+"""GigaChatClient против локальной заглушки: один OAuth-запрос на всех, обновление токена"""
+import asyncio
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from app import ai_agent
+from app.ai_agent import GigaChatClient
+
+class StubGigaChat:
+    """Заглушка OAuth и чата: считает вызовы, токены выдаёт по порядку"""
+
+    def __init__(self, token_ttl=1800):
+        self.token_ttl = token_ttl
+        self.auth_calls = 0
+        self.chat_tokens = []
+        self.revoked = set()
+        app = web.Application()
+        app.router.add_post("/auth", self.auth)
+        app.router.add_post("/chat", self.chat)
+        self.server = TestServer(app)
+
+    async def auth(self, request):
+        self.auth_calls += 1
+        await asyncio.sleep(0.05)  # пока идёт запрос, остальные должны ждать его же
+        expires_at = int((time.time() + self.token_ttl) * 1000)
+        return web.json_response({"access_token": f"token-{self.auth_calls}", "expires_at": expires_at})
+
+    async def chat(self, request):
+        token = request.headers["Authorization"].removeprefix("Bearer ")
+        if token in self.revoked:
+            return web.Response(status=401)
+        self.chat_tokens.append(token)
+        return web.json_response({"choices": [{"message": {"content": "ok"}}]})
+
+    async def __aenter__(self):
+        await self.server.start_server()
+        self.client = GigaChatClient(
+            credentials="stub", auth_url=str(self.server.make_url("/auth")),
+            chat_url=str(self.server.make_url("/chat")),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.close()
+        await self.server.close()
+
+MESSAGES = [{"role": "user", "content": "привет"}]
+
+def test_concurrent_requests_share_one_oauth_call():
+    async def scenario():
+        async with StubGigaChat() as stub:
+            answers = await asyncio.gather(*(stub.client.chat(MESSAGES) for _ in range(50)))
+            assert answers == ["ok"] * 50
+            assert stub.auth_calls == 1
+            assert set(stub.chat_tokens) == {"token-1"}
+            # Пока токен свежий, OAuth больше не вызывается
+            await stub.client.chat(MESSAGES)
+            assert stub.auth_calls == 1
+    asyncio.run(scenario())
+
+def test_token_near_expiry_refreshes_once_in_background():
+    async def scenario():
+        async with StubGigaChat() as stub:
+            await stub.client.chat(MESSAGES)
+            # До истечения меньше TOKEN_REFRESH_MARGIN: запросы идут со старым токеном,
+            # а обновление — одно на всех, в фоне
+            stub.client._expires_at = time.time() + ai_agent.TOKEN_REFRESH_MARGIN / 2
+            await asyncio.gather(*(stub.client.chat(MESSAGES) for _ in range(20)))
+            assert stub.chat_tokens[1:] == ["token-1"] * 20
+            await stub.client._refresh_task
+            assert stub.auth_calls == 2
+            await stub.client.chat(MESSAGES)
+            assert stub.chat_tokens[-1] == "token-2" and stub.auth_calls == 2
+    asyncio.run(scenario())
+
+def test_expired_token_is_refreshed_once_before_requests():
+    async def scenario():
+        async with StubGigaChat() as stub:
+            await stub.client.chat(MESSAGES)
+            stub.client._expires_at = time.time() - 1
+            await asyncio.gather(*(stub.client.chat(MESSAGES) for _ in range(20)))
+            assert stub.auth_calls == 2
+            assert stub.chat_tokens[1:] == ["token-2"] * 20
+    asyncio.run(scenario())
+
+def test_revoked_token_is_replaced_and_request_retried():
+    async def scenario():
+        async with StubGigaChat() as stub:
+            await stub.client.chat(MESSAGES)
+            stub.revoked.add("token-1")
+            assert await stub.client.chat(MESSAGES) == "ok"
+            assert stub.auth_calls == 2 and stub.chat_tokens[-1] == "token-2"
+    asyncio.run(scenario())
@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta, timezone
+
+from app.ai_context import build_tasks_context, EMPTY_CONTEXT
+
+NOW = datetime(2026, 10, 21, 14, 0)
+
+def task(title, due):
+    return {"title": title, "due_datetime": due}
+
+def test_due_with_timezone_is_compared_with_local_now():
+    # Срок с часовым поясом — как его присылает Mini App
+    soon = (NOW + timedelta(hours=1)).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    tasks = [
+        task("Отчёт", "2026-10-22T10:00:00Z"),
+        task("Звонок", "2026-10-22T10:00:00+03:00"),
+        task("Позже", "2026-12-01 10:00"),
+        task("Скоро", soon),
+    ]
+    # Бюджет на одну задачу: попадает обязательная — та, что рядом с now
+    context = build_tasks_context(tasks, "что дальше?", budget=22, now=NOW)
+    assert context.splitlines()[0] == f"- Скоро ({soon})"
+
+def test_mentioned_date_and_keywords_rank_first():
+    tasks = [task(f"Задача {i}", f"2026-11-{i + 1:02d} 10:00") for i in range(20)]
+    tasks.append(task("Сдать отчёт", "2026-12-20 10:00"))
+    context = build_tasks_context(tasks, "когда отчёт?", budget=30, now=NOW)
+    assert "Сдать отчёт" in context
+    assert context.endswith("задач")
+    assert build_tasks_context([], "вопрос") == EMPTY_CONTEXT
@@ -0,0 +1,148 @@
+"""AIGateway и CircuitBreaker против локальной заглушки GigaChat с задержкой и ошибками"""
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from app.ai_agent import GigaChatClient
+from app.ai_gateway import AIGateway, CircuitBreaker, AISuperseded, AITimeout, AIUnavailable
+
+class StubChat:
+    """Заглушка чата: latency и status можно менять по ходу теста"""
+
+    def __init__(self, latency=0.05, status=200):
+        self.latency = latency
+        self.status = status
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        app = web.Application()
+        app.router.add_post("/auth", self.auth)
+        app.router.add_post("/chat", self.chat)
+        self.server = TestServer(app)
+
+    async def auth(self, request):
+        return web.json_response({"access_token": "stub", "expires_at": int((time.time() + 1800) * 1000)})
+
+    async def chat(self, request):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        if self.status != 200:
+            return web.Response(status=self.status, text="stub error")
+        return web.json_response({"choices": [{"message": {"content": "ok"}}]})
+
+    async def __aenter__(self):
+        await self.server.start_server()
+        self.client = GigaChatClient(
+            credentials="stub", auth_url=str(self.server.make_url("/auth")),
+            chat_url=str(self.server.make_url("/chat")),
+        )
+        await self.client.get_token()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.close()
+        await self.server.close()
+
+async def ask(gateway, stub, user_id):
+    """Как ai_answer: место в шлюзе и таймаут шлюза на запрос"""
+    async with gateway.slot(user_id):
+        return await asyncio.wait_for(stub.client.chat([{"role": "user", "content": "?"}]), gateway.timeout)
+
+def test_concurrency_is_capped():
+    async def scenario():
+        async with StubChat(latency=0.05) as stub:
+            gateway = AIGateway(max_concurrency=3, timeout=5)
+            answers = await asyncio.gather(*(ask(gateway, stub, user_id) for user_id in range(12)))
+            assert answers == ["ok"] * 12
+            assert stub.max_in_flight == 3
+            assert gateway.in_flight == 0 and gateway.admitted == 12
+    asyncio.run(scenario())
+
+def test_newer_request_supersedes_waiting_one():
+    async def scenario():
+        async with StubChat(latency=0.1) as stub:
+            gateway = AIGateway(max_concurrency=10, timeout=5)
+            first = asyncio.create_task(ask(gateway, stub, 1))
+            await asyncio.sleep(0.01)
+            waiting = asyncio.create_task(ask(gateway, stub, 1))
+            await asyncio.sleep(0.01)
+            newest = asyncio.create_task(ask(gateway, stub, 1))
+            with pytest.raises(AISuperseded):
+                await waiting
+            assert await first == "ok" and await newest == "ok"
+            # Запросы одного пользователя не шли параллельно, вытесненный не дошёл до GigaChat
+            assert stub.calls == 2 and stub.max_in_flight == 1
+            assert gateway.superseded == 1 and not gateway._users
+    asyncio.run(scenario())
+
+def test_slow_answer_becomes_ai_timeout():
+    async def scenario():
+        async with StubChat(latency=1.0) as stub:
+            gateway = AIGateway(max_concurrency=2, timeout=0.05)
+            with pytest.raises(AITimeout):
+                await ask(gateway, stub, 1)
+            assert gateway.timeouts == 1 and gateway.in_flight == 0
+            assert gateway.breaker.failures == 1
+    asyncio.run(scenario())
+
+def test_breaker_opens_after_threshold_and_rejects_without_calling():
+    async def scenario():
+        async with StubChat(latency=0, status=500) as stub:
+            gateway = AIGateway(max_concurrency=5, timeout=5, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+            for _ in range(3):
+                with pytest.raises(ValueError):
+                    await ask(gateway, stub, 1)
+            assert gateway.breaker.state == CircuitBreaker.OPEN
+            with pytest.raises(AIUnavailable):
+                await ask(gateway, stub, 1)
+            with pytest.raises(AIUnavailable):
+                gateway.check()
+            assert stub.calls == 3 and gateway.rejected == 2
+    asyncio.run(scenario())
+
+def test_half_open_lets_single_probe_through():
+    async def scenario():
+        async with StubChat(latency=0, status=500) as stub:
+            breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+            gateway = AIGateway(max_concurrency=5, timeout=5, breaker=breaker)
+            with pytest.raises(ValueError):
+                await ask(gateway, stub, 1)
+            assert breaker.state == CircuitBreaker.OPEN
+
+            # GigaChat ожил; после reset_timeout пропускается только один пробный запрос
+            stub.status, stub.latency = 200, 0.1
+            await asyncio.sleep(0.15)
+            results = await asyncio.gather(*(ask(gateway, stub, user_id) for user_id in range(5)),
+                                           return_exceptions=True)
+            assert results.count("ok") == 1
+            assert all(isinstance(r, AIUnavailable) for r in results if r != "ok")
+            assert stub.calls == 2
+            assert breaker.state == CircuitBreaker.CLOSED
+
+            # Предохранитель замкнут — снова пропускаются все
+            assert await asyncio.gather(*(ask(gateway, stub, user_id) for user_id in range(5))) == ["ok"] * 5
+    asyncio.run(scenario())
+
+def test_failed_probe_reopens_breaker():
+    async def scenario():
+        async with StubChat(latency=0, status=500) as stub:
+            breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+            gateway = AIGateway(max_concurrency=5, timeout=5, breaker=breaker)
+            with pytest.raises(ValueError):
+                await ask(gateway, stub, 1)
+            await asyncio.sleep(0.15)
+            with pytest.raises(ValueError):
+                await ask(gateway, stub, 1)
+            assert breaker.state == CircuitBreaker.OPEN
+            with pytest.raises(AIUnavailable):
+                await ask(gateway, stub, 1)
+            assert stub.calls == 2
+    asyncio.run(scenario())
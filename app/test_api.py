@@ -0,0 +1,40 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+
+from app import repo
+from app.api import setup_api_routes
+
+def api_client():
+    app = web.Application()
+    setup_api_routes(app)
+    return TestClient(TestServer(app))
+
+def test_etag_of_full_list_does_not_answer_delta_request(conn):
+    async def scenario():
+        first = await repo.add_task(1, "Отчёт", "2026-10-22 10:00")
+        async with api_client() as client:
+            response = await client.get("/api/tasks?user_id=1")
+            since = (await response.json())["revision"]
+            await repo.add_task(1, "Встреча", "2026-10-23 10:00")
+            await repo.delete_task(first)
+
+            response = await client.get("/api/tasks?user_id=1")
+            full_etag = response.headers["ETag"]
+            response = await client.get("/api/tasks?user_id=1", headers={"If-None-Match": full_etag})
+            assert response.status == 304
+
+            # Актуальный ETag полного списка, но дельта от старой ревизии — нужны изменения, а не 304
+            response = await client.get(f"/api/tasks?user_id=1&since={since}", headers={"If-None-Match": full_etag})
+            assert response.status == 200
+            delta = await response.json()
+            assert [t["title"] for t in delta["tasks"]] == ["Встреча"]
+            assert delta["deleted"] == [first]
+
+            # Повтор той же дельты со своим ETag — 304
+            delta_etag = response.headers["ETag"]
+            assert delta_etag != full_etag
+            response = await client.get(f"/api/tasks?user_id=1&since={since}", headers={"If-None-Match": delta_etag})
+            assert response.status == 304
+    asyncio.run(scenario())
@@ -0,0 +1,89 @@
+import asyncio
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import DeleteMessages
+
+from app.cleanup import MessageCleaner
+
+METHOD = DeleteMessages(chat_id=1, message_ids=[1])
+
+class FakeBot:
+    """deleteMessages отказывает всей пачке, если в ней есть хоть одно «неудаляемое» сообщение"""
+
+    def __init__(self, undeletable=(), errors=()):
+        self.undeletable = set(undeletable)
+        self.errors = list(errors)
+        self.calls = []
+        self.deleted = set()
+
+    async def delete_messages(self, chat_id, message_ids):
+        self.calls.append(list(message_ids))
+        if self.errors:
+            raise self.errors.pop(0)
+        if self.undeletable & set(message_ids):
+            raise TelegramBadRequest(METHOD, "message can't be deleted")
+        self.deleted.update(message_ids)
+        return True
+
+def run_cleaner(bot, message_ids):
+    async def scenario():
+        cleaner = MessageCleaner(flush_delay=0)
+        for message_id in message_ids:
+            cleaner.schedule(bot, 1, message_id)
+        await cleaner.stop()
+        return cleaner.stats()
+    return asyncio.run(scenario())
+
+def test_batches_of_100():
+    bot = FakeBot()
+    stats = run_cleaner(bot, range(1, 251))
+    assert [len(c) for c in bot.calls] == [100, 100, 50]
+    assert stats["deleted"] == 250 and stats["dropped"] == 0
+
+def test_bad_message_does_not_cost_the_rest():
+    bot = FakeBot(undeletable={7, 40})
+    stats = run_cleaner(bot, range(1, 51))
+    assert bot.deleted == set(range(1, 51)) - {7, 40}
+    assert stats["deleted"] == 48 and stats["dropped"] == 2
+
+def test_retry_after_retries_and_forbidden_drops():
+    bot = FakeBot(errors=[TelegramRetryAfter(METHOD, "flood", 0)])
+    stats = run_cleaner(bot, [1, 2])
+    assert stats["deleted"] == 2 and stats["retried"] == 1
+
+    bot = FakeBot(errors=[TelegramForbiddenError(METHOD, "bot was blocked")])
+    stats = run_cleaner(bot, [1, 2, 3])
+    assert len(bot.calls) == 1 and stats["dropped"] == 3
+
+def test_retry_after_in_one_chat_does_not_hold_other_chats():
+    class FloodedBot(FakeBot):
+        """Чат 1 под flood control на секунду, остальные чаты доступны"""
+
+        async def delete_messages(self, chat_id, message_ids):
+            if chat_id == 1 and not self.calls:
+                self.calls.append(list(message_ids))
+                raise TelegramRetryAfter(METHOD, "flood", 1)
+            return await super().delete_messages(chat_id, message_ids)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        bot = FloodedBot()
+        cleaner = MessageCleaner(flush_delay=0.01)
+        started = loop.time()
+        cleaner.schedule(bot, 1, 10)
+        await asyncio.sleep(0.1)
+        assert cleaner.stats()["retried"] == 1
+        # Чат 2 очищается, пока чат 1 ждёт свою паузу
+        cleaner.schedule(bot, 2, 20)
+        await asyncio.sleep(0.1)
+        assert bot.deleted == {20} and loop.time() - started < 0.5
+        # Чат 1 повторяется фоновой задачей по сроку, без нового schedule
+        while 10 not in bot.deleted:
+            assert loop.time() - started < 3
+            await asyncio.sleep(0.05)
+        assert loop.time() - started >= 1
+        await cleaner.stop()
+        return cleaner.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["deleted"] == 2 and stats["dropped"] == 0 and stats["pending"] == 0
@@ -0,0 +1,46 @@
+import sqlite3
+
+import pytest
+
+from app import db
+
+def walk_pages(user_id, size):
+    page = db.list_tasks_page(user_id, size)
+    seen = list(page)
+    while len(page) == size:
+        last = page[-1]
+        page = db.list_tasks_page(user_id, size, after=(last["sort_ts"], last["id"]))
+        seen += page
+    return seen
+
+def test_task_pages_keep_tasks_without_due_ts_last(conn):
+    with conn:
+        dated = [db.insert_task_in(conn, 1, f"Задача {i}", f"2026-10-{i + 1:02d} 10:00") for i in range(5)]
+        # Формат, который parse_due не знает: due_ts остаётся NULL
+        undated = [db.insert_task_in(conn, 1, f"Без срока {i}", "2026-10-22T10:00:00Z") for i in range(3)]
+    assert conn.execute("SELECT COUNT(*) FROM tasks WHERE due_ts IS NULL").fetchone()[0] == 3
+
+    seen = walk_pages(1, 2)
+    assert [t["id"] for t in seen] == dated + undated
+    assert all(isinstance(t["sort_ts"], int) for t in seen)
+
+    # Назад от первой задачи без срока — последние задачи со сроком
+    first_undated = seen[len(dated)]
+    page = db.list_tasks_page(1, 2, before=(first_undated["sort_ts"], first_undated["id"]))
+    assert [t["id"] for t in page] == dated[-2:]
+
+def test_write_batch_locks_before_reading(conn):
+    # Второе соединение — как другой процесс-воркер, без ожидания блокировки
+    other = sqlite3.connect(db.DB_NAME, timeout=0)
+
+    def read_then_write(c):
+        c.execute("SELECT COUNT(*) FROM tasks").fetchone()
+        # Пока батч между чтением и записью, чужая запись ждёт, а не ломает батч
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            other.execute("UPDATE tasks SET title = title")
+        return db.insert_task_in(c, 1, "Задача", "2026-10-20 10:00")
+
+    [(ok, task_id)] = db.run_write_batch([(read_then_write, ())])
+    other.close()
+    assert ok, task_id
+    assert conn.execute("SELECT title FROM tasks WHERE id = ?", (task_id,)).fetchone()["title"] == "Задача"
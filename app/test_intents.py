@@ -0,0 +1,71 @@
+"""
+Корпус фраз для локального разбора команд: что разбирается без GigaChat и во что,
+и что обязательно уходит в ИИ (None). Сейчас — среда, 21.10.2026, 14:00.
+"""
+from datetime import datetime
+
+import pytest
+
+from app.intents import parse_intent, parse_date_time
+
+NOW = datetime(2026, 10, 21, 14, 0)
+
+def create(title, date, time):
+    return {"action": "create_task", "title": title, "date": date, "time": time}
+
+def delete(keywords):
+    return {"action": "delete_task", "keywords": keywords}
+
+def listing(date=None):
+    return {"action": "list_tasks", "date": date}
+
+CORPUS = [
+    # Создание
+    ("напомни купить хлеб завтра в 10:00", create("Купить хлеб", "22/10/2026", "10:00")),
+    ("Напомни мне позвонить маме в пятницу в 18:30", create("Позвонить маме", "23/10/2026", "18:30")),
+    ("создай задачу отчёт 25.10 в 9", create("Отчёт", "25/10/2026", "09:00")),
+    ("добавь задачу тренировка через 2 часа", create("Тренировка", "21/10/2026", "16:00")),
+    ("запиши встречу с Олегом 5 ноября в 15:00", create("Встречу с Олегом", "05/11/2026", "15:00")),
+    ("новая задача: сдать проект послезавтра", create("Сдать проект", "23/10/2026", "09:00")),
+    ("напомни выпить таблетку через полчаса", create("Выпить таблетку", "21/10/2026", "14:30")),
+    ("напомни полить цветы в 8 вечера", create("Полить цветы", "21/10/2026", "20:00")),
+    ("напомни сделать что-нибудь", None),      # нет срока
+    ("напомни купить хлеб вчера", None),       # срок в прошлом
+    ("напомни завтра", None),                  # нет названия
+    # Удаление: только с конкретным словом, общие слова решает ИИ
+    ("удали задачу про встречу", delete("встречу")),
+    ("убери задачу о тренировке", delete("тренировке")),
+    ("сотри задачи про отчёт и встречу", delete("отчет встречу")),
+    ("удалить задачи", None),
+    ("удали все задачи", None),
+    ("удали всё", None),
+    ("удали это", None),
+    ("удали мои задачи", None),
+    ("удали", None),
+    # Список
+    ("что у меня сегодня?", listing("2026-10-21")),
+    ("какие задачи на завтра", listing("2026-10-22")),
+    ("мои задачи", listing()),
+    ("покажи задачи", listing()),
+    ("план на пятницу", listing("2026-10-23")),
+    ("что у меня завтра в 10:00", None),       # время в вопросе — пусть отвечает ИИ
+    # Не команды
+    ("как дела?", None),
+    ("спланируй мне день", None),
+    ("", None),
+]
+
+@pytest.mark.parametrize("text, expected", CORPUS)
+def test_parse_intent(text, expected):
+    assert parse_intent(text, NOW) == expected
+
+@pytest.mark.parametrize("date_str, time_str, expected", [
+    ("22/10/2026", "10:00", datetime(2026, 10, 22, 10, 0)),
+    ("22.10.26", "9.05", datetime(2026, 10, 22, 9, 5)),
+    ("2026-10-22", "23:59", datetime(2026, 10, 22, 23, 59)),
+    ("31/02/2026", "10:00", None),
+    ("завтра", "10:00", None),
+    ("22/10/2026", "25:00", None),
+])
+def test_parse_date_time(date_str, time_str, expected):
+    assert parse_date_time(date_str, time_str) == expected
@@ -0,0 +1,20 @@
+from app.metrics import Registry
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("bot_updates_total", "Апдейты\nпо командам", handler='say "hi"\\now\nbye').inc()
+    registry.gauge("queue_depth", "Очередь", lambda: {'a"b': 3}, label="queue")
+    text = registry.render()
+    assert '# HELP bot_updates_total Апдейты\\nпо командам\n' in text
+    assert 'bot_updates_total{handler="say \\"hi\\"\\\\now\\nbye"} 1\n' in text
+    assert 'queue_depth{queue="a\\"b"} 3\n' in text
+    # Каждая метрика — одна строка: перевод строки в значении не рвёт вывод
+    assert all(line.startswith(("#", "bot_updates_total", "queue_depth")) for line in text.splitlines())
+
+def test_histogram_le_label_and_plain_values():
+    registry = Registry()
+    registry.histogram("db_query_seconds", "Запросы", buckets=(0.1,), query="list_tasks").observe(0.05)
+    text = registry.render()
+    assert 'db_query_seconds_bucket{query="list_tasks",le="0.1"} 1\n' in text
+    assert 'db_query_seconds_bucket{query="list_tasks",le="+Inf"} 1\n' in text
+    assert 'db_query_seconds_count{query="list_tasks"} 1\n' in text
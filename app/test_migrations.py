@@ -0,0 +1,76 @@
+"""
+Планы горячих запросов (EXPLAIN QUERY PLAN): ни один не должен перебирать таблицу
+задач целиком — ни на свежей базе без статистики, ни после ANALYZE на данных.
+"""
+import pytest
+
+from app import db
+from app.migrations import MIGRATIONS
+
+NOW_TS = db.to_ts("2026-10-20 12:00")
+
+HOT_QUERIES = {
+    "list_tasks": lambda: db.list_tasks(1),
+    "list_tasks_page": lambda: db.list_tasks_page(1, 10, after=(NOW_TS, 5)),
+    "list_tasks_page_before": lambda: db.list_tasks_page(1, 10, before=(NOW_TS, 5)),
+    "get_upcoming_reminders": lambda: db.get_upcoming_reminders(NOW_TS, NOW_TS + 3600),
+    "claim_reminders": lambda: db.claim_reminders([1, 2, 3], NOW_TS),
+    "get_days_with_tasks": lambda: db.get_days_with_tasks(1, 2026, 10),
+    "get_tasks_for_day": lambda: db.get_tasks_for_day(1, "2026-10-20"),
+    "get_user_revision": lambda: db.get_user_revision(1),
+    "get_task_changes": lambda: db.get_task_changes(1, 0),
+    "search_tasks": lambda: db.search_tasks(1, "отчёт"),
+}
+
+def captured_statements(conn, query):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        query()
+    finally:
+        conn.set_trace_callback(None)
+    # Строки «-- TRIGGER ...» и управление транзакцией планов не имеют
+    return [s for s in statements if s.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))]
+
+def plan(conn, sql):
+    return [row["detail"] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+
+def fill(conn, users=50, per_user=200):
+    with conn:
+        for user_id in range(1, users + 1):
+            for i in range(per_user):
+                due = f"2026-{i % 12 + 1:02d}-{i % 28 + 1:02d} {i % 24:02d}:00"
+                task_id = db.insert_task_in(conn, user_id, f"Отчёт {i}", due)
+                if i % 3 == 0:
+                    db.complete_task_in(conn, task_id)
+
+def assert_plans(conn):
+    for name, query in HOT_QUERIES.items():
+        statements = captured_statements(conn, query)
+        assert statements, name
+        for sql in statements:
+            details = plan(conn, sql)
+            assert not any(d.startswith(("SCAN tasks", "SCAN t ")) for d in details), (name, sql, details)
+            if name.startswith("list_tasks_page"):
+                # Страница — диапазон по ключу, а не перебор задач пользователя с начала
+                assert any("<expr>" in d for d in details), (name, details)
+            if name == "claim_reminders":
+                assert any("INTEGER PRIMARY KEY" in d for d in details), (name, details)
+
+def test_migrations_reach_latest_version(conn):
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+
+@pytest.mark.parametrize("analyzed", [False, True])
+def test_hot_queries_use_indexes(conn, analyzed):
+    if not analyzed:
+        # Как на базе, где статистики ещё нет
+        conn.execute("DELETE FROM sqlite_stat1")
+        conn.commit()
+    fill(conn)
+    if analyzed:
+        conn.execute("ANALYZE")
+        conn.commit()
+    # Новая статистика применяется к соединению только после перечитывания схемы
+    conn.execute("ANALYZE sqlite_schema")
+    assert_plans(conn)
@@ -0,0 +1,82 @@
+"""SessionStore: память ограничена max_size при любом числе пользователей, вытесненное не теряется"""
+import asyncio
+import gc
+import tracemalloc
+
+from app.session import SessionStore
+
+def test_cache_bounded_and_evicted_sessions_reload(conn):
+    async def scenario():
+        store = SessionStore(max_size=100, flush_interval=0.01)
+        await store.start()
+        for user_id in range(5000):
+            session = await store.get(user_id)
+            session["mode"] = f"m{user_id}"
+            store.save(user_id)
+            assert len(store._cache) <= 100
+        await store.flush()
+        assert not store._dirty
+        # Давно вытесненные сессии перечитываются из SQLite
+        assert (await store.get(1))["mode"] == "m1"
+        assert (await store.get(2500))["mode"] == "m2500"
+        assert len(store._cache) <= 100
+        await store.close()
+    asyncio.run(scenario())
+
+def test_evicted_unflushed_session_is_not_lost(conn):
+    async def scenario():
+        # flush не успеет сработать: вытесненная сессия живёт только в очереди записи
+        store = SessionStore(max_size=10, flush_interval=3600)
+        await store.start()
+        (await store.get("first"))["title"] = "Отчёт"
+        store.save("first")
+        for user_id in range(50):
+            await store.get(user_id)
+        assert "first" not in store._cache
+        assert (await store.get("first"))["title"] == "Отчёт"
+        await store.close()
+        reopened = SessionStore()
+        assert (await reopened.get("first"))["title"] == "Отчёт"
+    asyncio.run(scenario())
+
+def test_memory_flat_under_many_users(conn):
+    async def fill(store, users):
+        for user_id in users:
+            session = await store.get(user_id)
+            session["mode"] = "add_title"
+            session["title"] = "x" * 200
+            store.save(user_id)
+        await store.flush()
+
+    async def scenario():
+        store = SessionStore(max_size=200, flush_interval=3600)
+        await fill(store, range(1000))
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        # В 10 раз больше пользователей, чем уже было, и в 50 раз больше лимита
+        await fill(store, range(1000, 11000))
+        gc.collect()
+        grown = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        # Без вытеснения 10 000 сессий по ~0.5 КБ заняли бы ~5 МБ
+        assert grown < 512 * 1024, grown
+        assert len(store._cache) <= 200 and not store._dirty
+        await store.close()
+    asyncio.run(scenario())
+
+def test_shared_flush_tasks_are_kept_until_done(conn):
+    async def scenario():
+        store = SessionStore(flush_interval=3600)
+        store.shared = True
+        (await store.get("a"))["title"] = "Отчёт"
+        store.save("a")
+        store.delete("b")
+        assert len(store._flushes) == 2
+        # Сборка мусора между save и flush не должна терять запись
+        gc.collect()
+        await store.close()
+        assert not store._flushes and not store._dirty
+        reopened = SessionStore()
+        assert (await reopened.get("a"))["title"] == "Отчёт"
+    asyncio.run(scenario())
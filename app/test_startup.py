@@ -0,0 +1,20 @@
+"""
+Холодный старт: тяжёлое грузится лениво. Бюджеты времени и памяти зависят от машины,
+поэтому проверяются только по запросу: STARTUP_BUDGET_CHECK=1 python -m pytest app/test_startup.py
+"""
+import os
+
+import pytest
+
+import run
+
+def test_heavy_parts_are_lazy():
+    # Замер — в отдельном процессе: на него не влияет, что уже импортировали другие тесты
+    probe, _ = run.startup_probe()
+    assert probe["loaded"] == []
+    assert not probe["ai_client_built"]
+    assert not probe["stats_pool_built"]
+
+@pytest.mark.skipif(not os.getenv("STARTUP_BUDGET_CHECK"), reason="бюджет старта зависит от машины")
+def test_import_within_budget(capsys):
+    assert run.import_profile() == 0, capsys.readouterr().out
@@ -0,0 +1,829 @@
+"""
+Воспроизводимые замеры горячих путей без сети, на временной SQLite.
+
+Каждый режим сравнивает прежнюю реализацию («до» — воспроизведена здесь как
+эталон, на той же машине и тех же данных) с текущей («после») и печатает
+таблицу; результат можно сохранить в JSON и сравнить с прогоном другого коммита.
+
+    python bench.py db --users 500                 # задержка обработчиков: соединение на вызов vs поток БД
+    python bench.py db --users 500 --out db.json
+    python bench.py db --users 500 --compare db.json
+    python bench.py charts --requests 40           # графики/с и простой event loop: рендер в loop vs пул и кэш
+    python bench.py calendar --tasks 50000         # навигация по месяцам: LIKE + разбор строк vs диапазон due_ts и кэш
+    python bench.py sync --tasks 20000             # GET /api/tasks: весь список vs дельта и 304, байты и задержка
+    python bench.py writes --concurrency 1,10,100,500   # записи/с: коммит на запись vs group commit
+    python bench.py search --tasks 100000          # поиск задач: перебор списка vs FTS5
+    python bench.py metrics                        # цена инструментирования: обработчик, HTTP, запрос к БД
+    python bench.py tasklist --tasks 10000         # клик «✅»: весь список и его рендер vs страница по ключу
+
+Для задержки полного пути через Dispatcher есть loadtest.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from loadtest import percentile, git_commit
+
+def summarize(values):
+    """Перцентили в миллисекундах"""
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(max(values, default=0.0) * 1000, 3),
+    }
+
+def print_table(rows, baseline_rows=None):
+    """rows: {название: {поле: число}} — печать с колонками по полям первой строки"""
+    if not rows:
+        return
+    fields = list(next(iter(rows.values())))
+    print(f"{'':<34}" + "".join(f"{field:>16}" for field in fields))
+    for name, values in rows.items():
+        line = f"{name:<34}" + "".join(f"{values[field]:>16}" for field in fields)
+        old = (baseline_rows or {}).get(name)
+        if old:
+            changes = [f"{field} {(values[field] / old[field] - 1) * 100:+.0f}%"
+                       for field in fields if isinstance(old.get(field), (int, float)) and old[field]]
+            line += "   " + ", ".join(changes)
+        print(line)
+
+def due(days=0, hours=0, base=datetime(2026, 10, 20, 9, 0)):
+    return (base + timedelta(days=days, hours=hours)).strftime("%Y-%m-%d %H:%M")
+
+# ==========================================================
+# 🗄 DB: ОБРАБОТЧИКИ ПРИ 500 ПОЛЬЗОВАТЕЛЯХ
+# ==========================================================
+
+class LegacyDB:
+    """
+    Прежний доступ к данным: новое соединение на каждый вызов прямо в event loop,
+    журнал отката и синхронный fsync на каждом коммите (как в app/db.py до пула).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        conn = sqlite3.connect(path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                title TEXT,
+                due_datetime TEXT,
+                status TEXT DEFAULT 'pending'
+            )
+        """)
+        conn.commit()
+        conn.close()
+
+    def add_task(self, user_id, title, due_datetime):
+        conn = sqlite3.connect(self.path)
+        conn.execute("INSERT INTO tasks (user_id, title, due_datetime) VALUES (?, ?, ?)",
+                     (user_id, title, due_datetime))
+        conn.commit()
+        conn.close()
+
+    def list_tasks(self, user_id):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute("SELECT * FROM tasks WHERE user_id = ? AND status != 'done' ORDER BY due_datetime",
+                            (user_id,)).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def mark_task_completed(self, task_id):
+        conn = sqlite3.connect(self.path)
+        conn.execute("UPDATE tasks SET status = 'done' WHERE id = ?", (task_id,))
+        conn.commit()
+        conn.close()
+
+    def get_days_with_tasks(self, user_id, year, month):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute("SELECT due_datetime FROM tasks WHERE user_id = ? AND due_datetime LIKE ?",
+                            (user_id, f"{year}-{month:02d}-%")).fetchall()
+        conn.close()
+        days = set()
+        for row in rows:
+            try:
+                days.add(int(row[0].split(" ")[0].split("-")[2]))
+            except (IndexError, ValueError):
+                continue
+        return list(days)
+
+    def get_tasks_for_day(self, user_id, date_str):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute("SELECT * FROM tasks WHERE user_id = ? AND due_datetime LIKE ? ORDER BY due_datetime",
+                            (user_id, f"{date_str}%")).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def get_all_tasks_json(self, user_id):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute("SELECT * FROM tasks WHERE user_id = ? ORDER BY due_datetime", (user_id,)).fetchall()
+        conn.close()
+        return [{"id": row["id"], "title": row["title"], "due_datetime": row["due_datetime"],
+                 "status": row["status"]} for row in rows]
+
+    def fill(self, tasks):
+        """tasks: [(user_id, title, due_datetime)] одной транзакцией"""
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.executemany("INSERT INTO tasks (user_id, title, due_datetime) VALUES (?, ?, ?)", tasks)
+        conn.close()
+
+async def fill_current(tasks, batch=5000):
+    """Те же задачи в текущую схему (с индексами, FTS и статистикой) пачками в потоке БД"""
+    from app import db, repo
+
+    def insert(chunk):
+        conn = db.get_conn()
+        with conn:
+            for user_id, title, due_datetime in chunk:
+                db.insert_task_in(conn, user_id, title, due_datetime)
+
+    for i in range(0, len(tasks), batch):
+        await repo.run_db(insert, tasks[i:i + batch])
+
+def timed_calls(func, calls):
+    """Синхронные вызовы по одному: список длительностей"""
+    latencies = []
+    for call in calls:
+        started = time.perf_counter()
+        func(*call)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+async def timed_async_calls(func, calls):
+    latencies = []
+    for call in calls:
+        started = time.perf_counter()
+        await func(*call)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+async def bench_db(args):
+    """
+    Все пользователи одновременно присылают по три апдейта: запись задачи, список задач
+    и команду без БД (меню). Задержка — от прихода апдейта до ответа, то есть вместе
+    с ожиданием event loop: при синхронных вызовах БД меню ждёт чужих fsync.
+    """
+    from app import db, repo
+
+    legacy = LegacyDB(db.DB_NAME + ".legacy")
+    await repo.init_db()
+
+    async def legacy_write(user_id, i):
+        legacy.add_task(user_id, f"Задача {i}", due(i % 30))
+        tasks = legacy.list_tasks(user_id)
+        legacy.mark_task_completed(tasks[0]["id"])
+
+    async def legacy_read(user_id, i):
+        legacy.list_tasks(user_id)
+
+    async def current_write(user_id, i):
+        await repo.add_task(user_id, f"Задача {i}", due(i % 30))
+        tasks = await repo.list_tasks(user_id)
+        await repo.mark_task_completed(tasks[0]["id"])
+
+    async def current_read(user_id, i):
+        await repo.list_tasks(user_id)
+
+    async def menu(user_id, i):
+        await asyncio.sleep(0)
+
+    async def run_variant(write, read):
+        latencies = defaultdict(list)
+
+        async def timed(kind, func, user_id, i, arrived):
+            await func(user_id, i)
+            latencies[kind].append(time.perf_counter() - arrived)
+
+        started = time.perf_counter()
+        for i in range(args.rounds):
+            arrived = time.perf_counter()
+            await asyncio.gather(*(
+                timed(kind, func, user_id, i, arrived)
+                for user_id in range(1, args.users + 1)
+                for kind, func in (("запись", write), ("список", read), ("меню (без БД)", menu))
+            ))
+        seconds = time.perf_counter() - started
+        return latencies, seconds
+
+    rows = {}
+    for variant, write, read in (("до", legacy_write, legacy_read), ("после", current_write, current_read)):
+        latencies, seconds = await run_variant(write, read)
+        for kind in ("запись", "список", "меню (без БД)"):
+            rows[f"{variant}: {kind}"] = summarize(latencies[kind])
+        rows[f"{variant}: всего"] = {**summarize([v for values in latencies.values() for v in values]),
+                                     "count": round(sum(len(v) for v in latencies.values()) / seconds)}
+    print(f"{args.users} пользователей × {args.rounds} раундов; в строке «всего» count — апдейтов в секунду")
+    return rows
+
+# ==========================================================
+# 📊 CHARTS: ГРАФИКИ СТАТИСТИКИ
+# ==========================================================
+
+class LoopStall:
+    """Тикер раз в interval: на сколько позже срока просыпается event loop"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(loop.time() - expected, 0.0))
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._run())
+        await asyncio.sleep(0)
+        return self
+
+    async def __aexit__(self, *exc):
+        # Даём тикеру проснуться: иначе последнее (самое длинное) опоздание не попадёт в замер
+        await asyncio.sleep(self.interval * 2)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+async def bench_charts(args):
+    """
+    args.requests одновременных запросов статистики. «До» — тот же рисунок прямо
+    в event loop (как draw_stats_chart в обработчике), «после» — ChartRenderer:
+    пул процессов, а для одинаковых данных — кэш PNG. Простой loop — опоздание тикера.
+    """
+    from app.stats import ChartRenderer, render_stats_png
+
+    labels = [f"{day:02d}.10" for day in range(20, 27)]
+
+    def chart_args(i):
+        return (10 + i, 5 + i % 7, labels, [(i + day) % 6 for day in range(7)])
+
+    async def inline(i):
+        render_stats_png(*chart_args(i))
+
+    renderer = ChartRenderer(workers=args.workers)
+
+    async def pooled(i):
+        data = chart_args(i)
+        await renderer.render(renderer.key(*data), *data)
+
+    async def cached(i):
+        data = chart_args(0)
+        await renderer.render(renderer.key(*data), *data)
+
+    # Прогрев: импорт matplotlib здесь и запуск воркеров пула в замер не входят
+    render_stats_png(*chart_args(-1))
+    await asyncio.gather(*(pooled(-2 - w) for w in range(args.workers)))
+
+    rows = {}
+    for name, func in (("до: рисование в event loop", inline),
+                       ("после: пул, разные графики", pooled),
+                       ("после: повтор одного графика", cached)):
+        latencies = []
+
+        async def timed(i, arrived):
+            await func(i)
+            latencies.append(time.perf_counter() - arrived)
+
+        async with LoopStall() as stall:
+            started = arrived = time.perf_counter()
+            await asyncio.gather(*(timed(i, arrived) for i in range(args.requests)))
+            seconds = time.perf_counter() - started
+        stats = summarize(latencies)
+        rows[name] = {
+            "charts_per_s": round(args.requests / seconds, 1),
+            "p50_ms": stats["p50_ms"],
+            "p99_ms": stats["p99_ms"],
+            "stall_p99_ms": round(percentile(stall.lags, 0.99) * 1000, 1),
+            "stall_max_ms": round(max(stall.lags, default=0.0) * 1000, 1),
+        }
+    renderer.shutdown()
+    print(f"{args.requests} одновременных запросов, пул на {args.workers} процесса; "
+          f"stall — опоздание тикера event loop (5 мс)")
+    return rows
+
+# ==========================================================
+# 📅 CALENDAR: НАВИГАЦИЯ ПО МЕСЯЦАМ
+# ==========================================================
+
+async def bench_calendar(args):
+    """
+    Пользователь с args.tasks задачами на два года листает календарь «>>» вперёд
+    и «<<» назад и открывает дни. «До» — LIKE по строке срока и разбор строк в Python,
+    «после» — диапазон по индексу (user_id, due_ts) и кэш месяцев в repo.
+    """
+    from app import db, repo
+
+    user_id = 1
+    tasks = [(user_id, f"Задача {i}", due(i % 730, i % 12)) for i in range(args.tasks)]
+    # Соседи по базе: у них тоже есть задачи, как в рабочей базе
+    tasks += [(2 + i % 100, f"Чужая {i}", due(i % 730)) for i in range(args.tasks // 10)]
+    legacy = LegacyDB(db.DB_NAME + ".legacy")
+    legacy.fill(tasks)
+    await repo.init_db()
+    await fill_current(tasks)
+
+    months = [(2026 + (9 + m) // 12, (9 + m) % 12 + 1) for m in range(24)]
+    # Вперёд и назад, как по кнопкам, args.rounds раз
+    navigation = [(user_id, year, month) for _ in range(args.rounds) for year, month in months + months[::-1]]
+    days = [(user_id, due(d).split(" ")[0]) for d in range(0, 730, 7)]
+
+    async def cold_month(user_id, year, month):
+        await repo.run_db(db.get_days_with_tasks, user_id, year, month)
+
+    rows = {
+        "до: месяц (LIKE + разбор)": summarize(timed_calls(legacy.get_days_with_tasks, navigation)),
+        "после: месяц (диапазон due_ts)": summarize(await timed_async_calls(cold_month, navigation)),
+        "после: месяц (кэш repo)": summarize(await timed_async_calls(repo.get_days_with_tasks, navigation)),
+        "до: задачи дня (LIKE)": summarize(timed_calls(legacy.get_tasks_for_day, days)),
+        "после: задачи дня (диапазон)": summarize(await timed_async_calls(repo.get_tasks_for_day, days)),
+    }
+    print(f"{args.tasks} задач у пользователя, {len(navigation)} переходов по месяцам, {len(days)} дней")
+    return rows
+
+# ==========================================================
+# 🔄 SYNC: GET /api/tasks ДЛЯ MINI APP
+# ==========================================================
+
+async def bench_sync(args):
+    """
+    Mini App пользователя с args.tasks задачами открывается args.rounds раз.
+    «До» — прежний обработчик: весь список при каждом открытии. «После» — первый раз
+    весь список, затем 304 по ETag, пока ничего не менялось, или дельта ?since=
+    после нескольких изменений. Запросы идут через aiohttp-приложение с маршрутами API.
+    """
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer, TestClient
+    from app import db, repo
+    from app.api import setup_api_routes
+
+    user_id = 1
+    tasks = [(user_id, f"Задача {i}", due(i % 365, i % 12)) for i in range(args.tasks)]
+    legacy = LegacyDB(db.DB_NAME + ".legacy")
+    legacy.fill(tasks)
+    await repo.init_db()
+    await fill_current(tasks)
+
+    async def legacy_handler(request):
+        return web.json_response({"tasks": legacy.get_all_tasks_json(int(request.query["user_id"]))})
+
+    app = web.Application()
+    setup_api_routes(app)
+    app.router.add_get("/legacy/tasks", legacy_handler)
+
+    async def measure(client, path, headers=None):
+        sizes, latencies = [], []
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            body = await response.read()
+            latencies.append(time.perf_counter() - started)
+            sizes.append(len(body))
+        return {"bytes": sizes[-1], **summarize(latencies)}
+
+    async with TestClient(TestServer(app)) as client:
+        rows = {"до: весь список": await measure(client, f"/legacy/tasks?user_id={user_id}")}
+        rows["после: весь список"] = await measure(client, f"/api/tasks?user_id={user_id}")
+        response = await client.get(f"/api/tasks?user_id={user_id}")
+        await response.read()
+        etag = response.headers["ETag"]
+        rows["после: без изменений (304)"] = await measure(
+            client, f"/api/tasks?user_id={user_id}", headers={"If-None-Match": etag})
+        # Между открытиями пользователь выполнил 3 задачи и удалил 2
+        revision = (await (await client.get(f"/api/tasks?user_id={user_id}&limit=1")).json())["revision"]
+        page = await repo.get_task_page(user_id, 5)
+        for task in page["tasks"][:3]:
+            await repo.mark_task_completed(task["id"])
+        for task in page["tasks"][3:]:
+            await repo.delete_task(task["id"])
+        rows["после: дельта ?since= (5 изменений)"] = await measure(
+            client, f"/api/tasks?user_id={user_id}&since={revision}")
+    print(f"{args.tasks} задач у пользователя, {args.rounds} открытий Mini App на вариант")
+    return rows
+
+# ==========================================================
+# ✍️ WRITES: GROUP COMMIT
+# ==========================================================
+
+async def bench_writes(args):
+    """
+    args.writes добавлений задач от N одновременных обработчиков. «До» — коммит на
+    каждую запись (db.add_task в потоке БД), «после» — repo.add_task через WriteCoalescer.
+    batch — средний размер пачки в одной транзакции.
+    """
+    from app import db, repo
+
+    await repo.init_db()
+    flush_size = repo.writes.flush_size
+    rows = {}
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        for name, write in (("до", lambda user_id, i: repo.run_db(db.add_task, user_id, f"Задача {i}", due(i % 30))),
+                            ("после", lambda user_id, i: repo.add_task(user_id, f"Задача {i}", due(i % 30)))):
+            latencies = []
+            per_worker = max(args.writes // concurrency, 1)
+
+            async def worker(user_id):
+                for i in range(per_worker):
+                    started = time.perf_counter()
+                    await write(user_id, i)
+                    latencies.append(time.perf_counter() - started)
+
+            batches, batched = flush_size.count, flush_size.sum
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(user_id) for user_id in range(1, concurrency + 1)))
+            seconds = time.perf_counter() - started
+            batches, batched = flush_size.count - batches, flush_size.sum - batched
+            stats = summarize(latencies)
+            rows[f"{name}: {concurrency} параллельно"] = {
+                "writes_per_s": round(len(latencies) / seconds),
+                "batch": round(batched / batches, 1) if batches else 1.0,
+                "p50_ms": stats["p50_ms"],
+                "p99_ms": stats["p99_ms"],
+            }
+    print(f"~{args.writes} записей на каждый уровень параллельности, WAL, synchronous=NORMAL")
+    return rows
+
+# ==========================================================
+# 🔎 SEARCH: ПОИСК ПО НАЗВАНИЯМ
+# ==========================================================
+
+SEARCH_WORDS = ("отчёт", "встреча", "звонок", "оплатить", "купить", "проект", "врач", "спорт",
+                "договор", "презентация", "письмо", "ремонт", "бассейн", "налоги", "подарок", "собрание")
+SEARCH_QUERIES = ("отчёт", "встречу с клиентом", "оплатить налоги", "подарок маме", "ремонт машины")
+
+async def bench_search(args):
+    """
+    Поиск по пользователю с args.tasks задачами. «До» — как прежнее удаление через ИИ:
+    весь список задач и подстрока в Python, «после» — search_tasks по индексу FTS5.
+    """
+    from app import db, repo
+
+    user_id = 1
+    objects = ("клиентом", "маме", "машины", "командой", "банком", "соседом")
+    tasks = [(user_id, f"{SEARCH_WORDS[i % len(SEARCH_WORDS)].capitalize()} {objects[i % len(objects)]} {i}",
+              due(i % 365, i % 12)) for i in range(args.tasks)]
+    legacy = LegacyDB(db.DB_NAME + ".legacy")
+    legacy.fill(tasks)
+    await repo.init_db()
+    await fill_current(tasks)
+
+    def legacy_search(user_id, query):
+        keywords = query.lower()
+        return [t for t in legacy.list_tasks(user_id) if keywords in t["title"].lower()]
+
+    calls = [(user_id, query) for _ in range(args.rounds) for query in SEARCH_QUERIES]
+    rows = {
+        "до: список + подстрока": summarize(timed_calls(legacy_search, calls)),
+        "после: FTS5, первые 10": summarize(await timed_async_calls(repo.search_tasks, calls)),
+    }
+    print(f"{args.tasks} задач у пользователя, запросы: {', '.join(SEARCH_QUERIES)}")
+    return rows
+
+# ==========================================================
+# 📈 METRICS: ЦЕНА ИНСТРУМЕНТИРОВАНИЯ
+# ==========================================================
+
+async def bench_metrics(args):
+    """
+    Одна и та же работа без метрик и с ними: апдейт через Dispatcher (middleware
+    обработчика), запрос к aiohttp (http_metrics_middleware) и запрос к БД
+    (repo.run_db против голого run_in_executor).
+
+    Разница целых операций (e2e_*) на общей машине тонет в шуме, поэтому отдельно
+    меряется сама обвязка (instr_us) — тот же код метрик вокруг пустой операции,
+    без сети и без перехода в поток БД; instr_% — её доля во времени операции.
+    Везде — лучший из args.trials чередующихся прогонов.
+    """
+    import functools
+    from concurrent.futures import Executor, Future
+    from types import SimpleNamespace
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer, TestClient
+    from aiogram import Bot, Dispatcher, Router
+    from aiogram.types import Update, Message, Chat, User
+    from app import db, repo
+    from app.monitoring import setup_bot_metrics, http_metrics_middleware, HandlerMetricsMiddleware
+
+    await repo.init_db()
+    await fill_current([(1, f"Задача {i}", due(i % 30)) for i in range(20)])
+
+    def best(func, iterations):
+        """Лучшее время одной операции (мкс) из args.trials прогонов; func — корутинная функция"""
+        async def run():
+            results = []
+            for _ in range(args.trials):
+                started = time.perf_counter()
+                for _ in range(iterations):
+                    await func()
+                results.append((time.perf_counter() - started) / iterations * 1e6)
+            return min(results)
+        return run()
+
+    async def nothing(*_):
+        return None
+
+    # --- Обработчик бота: список задач из БД, как у «📋 Мои задачи» ---
+    def make_dispatcher(with_metrics):
+        router = Router()
+
+        @router.message()
+        async def list_handler(message):
+            await repo.list_tasks(message.from_user.id)
+
+        if with_metrics:
+            setup_bot_metrics(router)
+        dp = Dispatcher()
+        dp.include_router(router)
+        return dp
+
+    bot = Bot(token="42:bench")
+    update = Update(update_id=1, message=Message(
+        message_id=1, date=datetime.now(), chat=Chat(id=1, type="private"),
+        from_user=User(id=1, is_bot=False, first_name="u"), text="задачи"))
+    plain_dp, measured_dp = make_dispatcher(False), make_dispatcher(True)
+    handler_middleware = HandlerMetricsMiddleware("message")
+    handler_data = {"handler": SimpleNamespace(callback=nothing)}
+
+    # --- HTTP: маршрут, отдающий список задач ---
+    async def tasks_handler(request):
+        return web.json_response({"tasks": await repo.list_tasks(1)})
+
+    clients = []
+    for middlewares in ([], [http_metrics_middleware]):
+        app = web.Application(middlewares=middlewares)
+        app.router.add_get("/api/tasks", tasks_handler)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        clients.append(client)
+
+    async def get(client):
+        response = await client.get("/api/tasks")
+        await response.read()
+
+    fake_request = SimpleNamespace(method="GET", match_info=SimpleNamespace(
+        route=SimpleNamespace(resource=SimpleNamespace(canonical="/api/tasks"))))
+    fake_response = SimpleNamespace(status=200)
+
+    async def http_handler(request):
+        return fake_response
+
+    # --- Запрос к БД; для обвязки — исполнитель, выполняющий функцию сразу на месте ---
+    class InlineExecutor(Executor):
+        def submit(self, fn, *args, **kwargs):
+            future = Future()
+            future.set_result(fn(*args, **kwargs))
+            return future
+
+    def revision():
+        return 0
+
+    async def raw_query(executor, func):
+        await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func))
+
+    async def inline_run_db():
+        db_executor, db.executor = db.executor, inline
+        try:
+            await repo.run_db(revision)
+        finally:
+            db.executor = db_executor
+
+    inline = InlineExecutor()
+    cases = (
+        ("апдейт бота", args.iterations,
+         lambda: plain_dp.feed_update(bot, update), lambda: measured_dp.feed_update(bot, update),
+         lambda: nothing(), lambda: handler_middleware(nothing, None, handler_data)),
+        ("HTTP-запрос", args.iterations // 5,
+         lambda: get(clients[0]), lambda: get(clients[1]),
+         lambda: http_handler(fake_request), lambda: http_metrics_middleware(fake_request, http_handler)),
+        ("запрос к БД", args.iterations,
+         lambda: raw_query(db.executor, functools.partial(db.get_user_revision, 1)),
+         lambda: repo.run_db(db.get_user_revision, 1),
+         lambda: raw_query(inline, revision), inline_run_db),
+    )
+    rows = {}
+    for name, iterations, plain, measured, bare, wrapped in cases:
+        e2e_plain = e2e_metrics = float("inf")
+        # Чередуем варианты, чтобы медленные периоды машины доставались обоим
+        for _ in range(3):
+            e2e_plain = min(e2e_plain, await best(plain, iterations))
+            e2e_metrics = min(e2e_metrics, await best(measured, iterations))
+        instr = max(await best(wrapped, args.iterations * 10) - await best(bare, args.iterations * 10), 0.0)
+        rows[name] = {
+            "e2e_plain_us": round(e2e_plain, 1),
+            "e2e_metrics_us": round(e2e_metrics, 1),
+            "instr_us": round(instr, 2),
+            "instr_%": round(instr / e2e_plain * 100, 2),
+        }
+    for client in clients:
+        await client.close()
+    await bot.session.close()
+    # Апдейт «📋 Мои задачи» — это middleware обработчика и один запрос к БД
+    per_update = rows["апдейт бота"]["instr_us"] + rows["запрос к БД"]["instr_us"]
+    print(f"Метрики на апдейт с одним запросом к БД: {per_update:.1f} мкс, "
+          f"{per_update / rows['апдейт бота']['e2e_plain_us'] * 100:.1f}% его времени")
+    print(f"лучший из {args.trials} прогонов по {args.iterations} операций (HTTP — в 5 раз меньше); "
+          f"обвязка — по {args.iterations * 10}")
+    return rows
+
+# ==========================================================
+# 📋 TASKLIST: КЛИК «ВЫПОЛНЕНО» В ДЛИННОМ СПИСКЕ
+# ==========================================================
+
+def legacy_render_tasks(tasks, buttons):
+    """Прежний show_tasks: весь список одним сообщением, кнопки для первых buttons задач"""
+    from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+    kb = InlineKeyboardBuilder()
+    text_output = "📋 <b>Ваши активные задачи:</b>\n\n"
+    for t in tasks:
+        text_output += f"🔹 <b>{t['title']}</b>\n🕒 {t['due_datetime']}\n\n"
+    # kb.adjust квадратичен по числу кнопок: на всём списке рендер шёл бы минуты
+    for t in tasks[:buttons]:
+        kb.button(text="✅", callback_data=f"done:{t['id']}")
+        kb.button(text="❌", callback_data=f"del:{t['id']}")
+    kb.button(text="⬅ Назад", callback_data="tasks")
+    kb.adjust(*([2] * min(len(tasks), buttons) + [1]))
+    return text_output, kb.as_markup()
+
+async def bench_tasklist(args):
+    """
+    Пользователь с args.tasks задачами жмёт «✅» на странице args.page. «До» — прежний
+    обработчик: UPDATE, весь список заново и рендер всего списка; «после» —
+    mark_task_completed, current_task_page (снимок страницы + недостающие строки)
+    и render_task_page. Отдельно — время БД, рендера и число SQL-выражений на клик.
+    """
+    from app import db, repo
+    from app.handlers import render_task_page
+    from config import TASK_PAGE_SIZE
+
+    user_id = 1
+    tasks = [(user_id, f"Задача {i}", due(i // 24, i % 24)) for i in range(args.tasks)]
+    legacy = LegacyDB(db.DB_NAME + ".legacy")
+    legacy.fill(tasks)
+    await repo.init_db()
+    await fill_current(tasks)
+
+    statements = []
+
+    def trace_statements(enabled):
+        db.get_conn().set_trace_callback(statements.append if enabled else None)
+
+    rows = {}
+    db_times, render_times, sizes = [], [], []
+    legacy_ids = [t["id"] for t in legacy.list_tasks(user_id)]
+    for task_id in legacy_ids[:args.rounds]:
+        started = time.perf_counter()
+        legacy.mark_task_completed(task_id)
+        page = legacy.list_tasks(user_id)
+        db_times.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        text_output, _ = legacy_render_tasks(page, args.legacy_buttons)
+        render_times.append(time.perf_counter() - started)
+        sizes.append(len(text_output))
+    # Одно соединение, UPDATE с коммитом и SELECT всего списка
+    rows["до: БД"] = {**summarize(db_times), "sql_per_click": 2, "reads_per_click": 1,
+                      "rows_read": len(legacy_ids), "chars": max(sizes)}
+    rows[f"до: рендер ({args.legacy_buttons} с кнопками)"] = {**summarize(render_times), "sql_per_click": 0,
+                                                              "reads_per_click": 0, "rows_read": 0,
+                                                              "chars": max(sizes)}
+
+    # Открываем страницу args.page, как после листания «▶»
+    page = await repo.get_task_page(user_id, TASK_PAGE_SIZE)
+    for _ in range(args.page - 1):
+        if not page["has_next"]:
+            break
+        last = page["tasks"][-1]
+        page = await repo.get_task_page(user_id, TASK_PAGE_SIZE, after=(last["sort_ts"], last["id"]))
+
+    db_times, render_times, sizes, counts, reads, limits = [], [], [], [], [], []
+    for _ in range(args.rounds):
+        task_id = page["tasks"][0]["id"]
+        await repo.run_db(trace_statements, True)
+        started = time.perf_counter()
+        await repo.mark_task_completed(task_id)
+        page = await repo.current_task_page(user_id, TASK_PAGE_SIZE)
+        db_times.append(time.perf_counter() - started)
+        await repo.run_db(trace_statements, False)
+        counts.append(len(statements))
+        selects = [statement for statement in statements if statement.startswith("SELECT")]
+        reads.append(len(selects))
+        # Страница читается диапазоном по индексу: строк не больше LIMIT запроса
+        limits.append(sum(int(statement.rsplit("LIMIT", 1)[1]) for statement in selects))
+        statements.clear()
+        started = time.perf_counter()
+        text_output, _ = render_task_page(page)
+        render_times.append(time.perf_counter() - started)
+        sizes.append(len(text_output))
+    rows["после: БД"] = {**summarize(db_times), "sql_per_click": round(sum(counts) / len(counts), 1),
+                         "reads_per_click": round(sum(reads) / len(reads), 1),
+                         "rows_read": max(limits), "chars": max(sizes)}
+    rows["после: рендер страницы"] = {**summarize(render_times), "sql_per_click": 0, "reads_per_click": 0,
+                                      "rows_read": 0, "chars": max(sizes)}
+    print(f"{args.tasks} задач у пользователя, клик на странице {args.page} по {TASK_PAGE_SIZE}, "
+          f"{args.rounds} кликов; sql_per_click после — вместе с BEGIN/COMMIT и триггерами, "
+          f"rows_read после — сумма LIMIT запросов страницы")
+    return rows
+
+BENCHES = {
+    "db": bench_db,
+    "charts": bench_charts,
+    "calendar": bench_calendar,
+    "sync": bench_sync,
+    "writes": bench_writes,
+    "search": bench_search,
+    "metrics": bench_metrics,
+    "tasklist": bench_tasklist,
+}
+
+def parse_args():
+    # Общие параметры — после имени режима: python bench.py db --out db.json
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--out", help="сохранить результат в JSON")
+    common.add_argument("--compare", help="JSON прошлого прогона того же режима для сравнения")
+    parser = argparse.ArgumentParser(description="Замеры горячих путей МойРитм без сети")
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    db_mode = modes.add_parser("db", parents=[common], help="p50/p99 обработчиков: соединение на вызов vs поток БД")
+    db_mode.add_argument("--users", type=int, default=500)
+    db_mode.add_argument("--rounds", type=int, default=3)
+
+    charts_mode = modes.add_parser("charts", parents=[common], help="графики/с и простой event loop при рендере")
+    charts_mode.add_argument("--requests", type=int, default=40)
+    charts_mode.add_argument("--workers", type=int, default=2)
+
+    calendar_mode = modes.add_parser("calendar", parents=[common], help="задержка навигации по календарю")
+    calendar_mode.add_argument("--tasks", type=int, default=50000)
+    calendar_mode.add_argument("--rounds", type=int, default=3)
+
+    sync_mode = modes.add_parser("sync", parents=[common], help="размер и задержка синхронизации Mini App")
+    sync_mode.add_argument("--tasks", type=int, default=20000)
+    sync_mode.add_argument("--rounds", type=int, default=20)
+
+    writes_mode = modes.add_parser("writes", parents=[common], help="пропускная способность записи задач")
+    writes_mode.add_argument("--concurrency", default="1,10,100,500", help="уровни через запятую")
+    writes_mode.add_argument("--writes", type=int, default=5000)
+
+    search_mode = modes.add_parser("search", parents=[common], help="задержка поиска задач")
+    search_mode.add_argument("--tasks", type=int, default=100000)
+    search_mode.add_argument("--rounds", type=int, default=10)
+
+    metrics_mode = modes.add_parser("metrics", parents=[common], help="надбавка метрик к горячим путям")
+    metrics_mode.add_argument("--iterations", type=int, default=1000)
+    metrics_mode.add_argument("--trials", type=int, default=5)
+
+    tasklist_mode = modes.add_parser("tasklist", parents=[common], help="рендер и работа БД на клик «✅» в списке")
+    tasklist_mode.add_argument("--tasks", type=int, default=10000)
+    tasklist_mode.add_argument("--page", type=int, default=500)
+    tasklist_mode.add_argument("--rounds", type=int, default=5)
+    tasklist_mode.add_argument("--legacy-buttons", type=int, default=200,
+                               help="сколько задач получают кнопки в прежнем рендере")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    # Временная база: замеры не трогают рабочие данные
+    tmp_dir = tempfile.mkdtemp(prefix="moyritm-bench-")
+    os.environ["DB_PATH"] = os.path.join(tmp_dir, "bench.db")
+
+    async def run():
+        from app import repo
+        try:
+            return await BENCHES[args.mode](args)
+        finally:
+            await repo.close_db()
+
+    rows = asyncio.run(run())
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_table(rows, baseline and baseline["rows"])
+    if args.out:
+        result = {
+            "mode": args.mode,
+            "commit": git_commit(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "config": {key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+            "rows": rows,
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Результат сохранён в {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+Нагрузочный прогон бота без сети.
+
+Настоящий Dispatcher с router получает синтетические Update через feed_update
+(как при long polling) или, с --transport webhook, POST-запросами на WEBHOOK_PATH
+aiohttp-приложения из run.create_web_app (как в webhook-режиме) — так оба пути
+можно сравнить на одной нагрузке.
+Вместо Telegram — FakeSession, которая только считает вызовы Bot API; вместо
+GigaChat — локальный заглушка-сервер с заданной задержкой; база — временная
+SQLite. В конце печатаются updates/sec и перцентили задержки по сценариям,
+результат можно сохранить в JSON и сравнить с прогоном другого коммита.
+
+    python loadtest.py --users 50 --rounds 3 --out bench.json
+    python loadtest.py --users 50 --compare bench.json
+    python loadtest.py --users 50 --transport webhook --compare bench.json
+    python loadtest.py --save-trace trace.jsonl        # записать сгенерированные апдейты
+    python loadtest.py --replay trace.jsonl            # прогнать записанный трейс (JSON апдейтов по строке)
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+SCENARIOS = ("start", "menu", "wizard", "calendar", "done_del", "web_app", "ai", "stats")
+DEFAULT_SCENARIOS = ("start", "menu", "wizard", "calendar", "done_del", "web_app", "ai")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота МойРитм без сети")
+    parser.add_argument("--users", type=int, default=20, help="одновременных пользователей")
+    parser.add_argument("--rounds", type=int, default=3, help="проходов по сценариям на пользователя")
+    parser.add_argument("--scenarios", default=",".join(DEFAULT_SCENARIOS),
+                        help=f"через запятую из: {', '.join(SCENARIOS)}")
+    parser.add_argument("--ai-latency", type=float, default=0.05, help="задержка заглушки GigaChat, с")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка каждого вызова Bot API, с")
+    parser.add_argument("--transport", choices=("feed", "webhook"), default="feed",
+                        help="feed — dp.feed_update, как polling; webhook — HTTP POST на WEBHOOK_PATH")
+    parser.add_argument("--replay", help="JSONL-трейс апдейтов вместо сценариев")
+    parser.add_argument("--save-trace", help="записать все отправленные апдейты в JSONL")
+    parser.add_argument("--out", help="сохранить результат в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    return parser.parse_args()
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+def print_report(result, baseline=None):
+    print(f"\nОбновлений: {result['updates']}, ошибок: {result['errors']}, "
+          f"{result['updates_per_sec']:.0f} updates/sec за {result['seconds']:.2f} с")
+    if baseline:
+        delta = (result["updates_per_sec"] / baseline["updates_per_sec"] - 1) * 100
+        print(f"  было {baseline['updates_per_sec']:.0f} updates/sec ({baseline.get('commit')}), {delta:+.1f}%")
+    print(f"{'сценарий':<20}{'n':>7}{'p50 мс':>10}{'p90 мс':>10}{'p99 мс':>10}{'max мс':>10}")
+    for name, stats in result["scenarios"].items():
+        line = f"{name:<20}{stats['count']:>7}{stats['p50_ms']:>10.2f}{stats['p90_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}"
+        old = (baseline or {}).get("scenarios", {}).get(name)
+        if old and old["p50_ms"]:
+            line += f"   p50 {(stats['p50_ms'] / old['p50_ms'] - 1) * 100:+.0f}%, p99 {(stats['p99_ms'] / max(old['p99_ms'], 1e-9) - 1) * 100:+.0f}%"
+        print(line)
+    print("Вызовы Bot API:", dict(result["api_calls"]))
+
+async def run(args):
+    # Модули проекта импортируем только здесь: DB_PATH уже указывает на временную базу
+    from aiohttp import web, ClientSession
+    from aiogram import Bot
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import (
+        Update, Message, CallbackQuery, Chat, User, PhotoSize, WebAppData
+    )
+    from app import ai_agent, repo
+    from run import create_dispatcher, create_web_app, start_services, stop_services
+    from config import WEBHOOK_PATH, WEBHOOK_SECRET
+
+    # --- Telegram: FakeSession вместо HTTP ---
+
+    class FakeSession(BaseSession):
+        """Отвечает на любой вызов Bot API сразу и записывает, что вызывали"""
+
+        def __init__(self):
+            super().__init__()
+            self.calls = Counter()
+            self._message_ids = itertools.count(10_000)
+
+        async def make_request(self, bot, method, timeout=None):
+            name = method.__api_method__
+            self.calls[name] += 1
+            if args.api_latency:
+                await asyncio.sleep(args.api_latency)
+            if method.__returning__ is bool:
+                return True
+            chat_id = getattr(method, "chat_id", None) or 0
+            message = Message(
+                message_id=next(self._message_ids), date=datetime.now(),
+                chat=Chat(id=chat_id, type="private"),
+                text=getattr(method, "text", None) or getattr(method, "caption", None),
+                photo=[PhotoSize(file_id=f"photo-{self.calls[name]}", file_unique_id="u", width=1, height=1)]
+                if name == "sendPhoto" else None,
+            )
+            return message.as_(bot)
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b""
+
+        async def close(self):
+            pass
+
+    # --- GigaChat: локальная заглушка ---
+
+    async def stub_auth(request):
+        return web.json_response({"access_token": "stub", "expires_at": int((time.time() + 1800) * 1000)})
+
+    async def stub_chat(request):
+        body = await request.json()
+        await asyncio.sleep(args.ai_latency)
+        answer = "Сначала сделайте самое срочное, потом остальное."
+        if not body.get("stream"):
+            return web.json_response({"choices": [{"message": {"content": answer}}]})
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in answer.split(" "):
+            chunk = {"choices": [{"delta": {"content": word + " "}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    stub = web.Application()
+    stub.router.add_post("/auth", stub_auth)
+    stub.router.add_post("/chat", stub_chat)
+    stub_runner = web.AppRunner(stub)
+    await stub_runner.setup()
+    site = web.TCPSite(stub_runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    ai_client = ai_agent.get_client()
+    ai_client.auth_url = f"http://127.0.0.1:{port}/auth"
+    ai_client.chat_url = f"http://127.0.0.1:{port}/chat"
+
+    session = FakeSession()
+    bot = Bot(token="42:loadtest", session=session)
+    dp = create_dispatcher()
+    web_runner = http = None
+    if args.transport == "webhook":
+        # Сервисы поднимает и останавливает само приложение (on_startup / on_cleanup)
+        # Обработка в запросе: иначе ответ {} приходит до обработчика и мерить было бы нечего
+        web_runner = web.AppRunner(create_web_app(bot, dp, primary=False, handle_in_background=False))
+        await web_runner.setup()
+        web_site = web.TCPSite(web_runner, "127.0.0.1", 0)
+        await web_site.start()
+        webhook_url = f"http://127.0.0.1:{web_site._server.sockets[0].getsockname()[1]}{WEBHOOK_PATH}"
+        http = ClientSession(headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET} if WEBHOOK_SECRET else None)
+    else:
+        await start_services(bot, primary=False)
+
+    # --- Апдейты ---
+
+    update_ids = itertools.count(1)
+    trace = open(args.save_trace, "w", encoding="utf-8") if args.save_trace else None
+    latencies = defaultdict(list)
+    errors = Counter()
+
+    def user(user_id):
+        return User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+
+    def message_update(user_id, text=None, web_app_data=None):
+        return Update(update_id=next(update_ids), message=Message(
+            message_id=next(update_ids), date=datetime.now(), chat=Chat(id=user_id, type="private"),
+            from_user=user(user_id), text=text,
+            web_app_data=WebAppData(data=json.dumps(web_app_data, ensure_ascii=False), button_text="App")
+            if web_app_data is not None else None,
+        ))
+
+    def callback_update(user_id, data):
+        return Update(update_id=next(update_ids), callback_query=CallbackQuery(
+            id=str(next(update_ids)), from_user=user(user_id), chat_instance="loadtest", data=data,
+            message=Message(message_id=next(update_ids), date=datetime.now(),
+                            chat=Chat(id=user_id, type="private"), from_user=user(0), text="…"),
+        ))
+
+    async def post_update(payload):
+        # handle_in_background=False: ответ приходит только после обработчика апдейта
+        async with http.post(webhook_url, data=payload, headers={"Content-Type": "application/json"}) as response:
+            await response.read()
+            if response.status != 200:
+                raise RuntimeError(f"webhook: HTTP {response.status}")
+
+    async def feed(scenario, update):
+        payload = update.model_dump_json(exclude_none=True) if trace or http else None
+        if trace:
+            trace.write(payload + "\n")
+        started = time.perf_counter()
+        try:
+            if http:
+                await post_update(payload)
+            else:
+                await dp.feed_update(bot, update)
+        except Exception as e:
+            errors[scenario] += 1
+            logging.debug(f"{scenario}: {e!r}")
+        latencies[scenario].append(time.perf_counter() - started)
+
+    # --- Сценарии: последовательность действий одного пользователя ---
+
+    async def start(user_id):
+        await feed("start", message_update(user_id, "/start"))
+
+    async def menu(user_id):
+        await feed("menu", message_update(user_id, "/menu"))
+
+    async def wizard(user_id):
+        due = datetime.now() + timedelta(days=1 + user_id % 20)
+        await feed("wizard", callback_update(user_id, "task_add"))
+        await feed("wizard", message_update(user_id, f"Задача {user_id} {next(update_ids)}"))
+        await feed("wizard", message_update(user_id, due.strftime("%d/%m/%Y")))
+        await feed("wizard", message_update(user_id, "10:00"))
+
+    async def calendar(user_id):
+        now = datetime.now()
+        following = now.replace(day=1) + timedelta(days=32)
+        await feed("calendar", callback_update(user_id, "calendar_open"))
+        await feed("calendar", callback_update(user_id, f"cal:next:{now.year}:{now.month}"))
+        await feed("calendar", callback_update(user_id, f"cal:prev:{following.year}:{following.month}"))
+        await feed("calendar", callback_update(user_id, f"cal:day:{now.year}:{now.month}:{now.day}"))
+
+    async def done_del(user_id):
+        await feed("done_del", callback_update(user_id, "task_list"))
+        tasks = await repo.list_tasks(user_id)
+        if tasks:
+            await feed("done_del", callback_update(user_id, f"done:{tasks[0]['id']}"))
+        if len(tasks) > 1:
+            await feed("done_del", callback_update(user_id, f"del:{tasks[-1]['id']}"))
+
+    async def web_app(user_id):
+        due = datetime.now() + timedelta(hours=2)
+        await feed("web_app", message_update(user_id, web_app_data={
+            "action": "add_task_full", "category": "Работа", "task": "Отчёт",
+            "date": due.strftime("%Y-%m-%d"), "time": due.strftime("%H:%M"),
+        }))
+        await feed("web_app", message_update(user_id, web_app_data={"action": "get_plan"}))
+
+    async def ai(user_id):
+        await feed("ai", callback_update(user_id, "ai"))
+        await feed("ai", message_update(user_id, "что важнее сделать первым?"))
+        await feed("ai", message_update(user_id, "напомни купить хлеб завтра в 10:00"))
+        await feed("ai", callback_update(user_id, "ai_stop"))
+
+    async def stats(user_id):
+        await feed("stats", message_update(user_id, web_app_data={"action": "get_stats"}))
+
+    scenario_funcs = {name: func for name, func in locals().items() if name in SCENARIOS}
+
+    async def run_user(user_id, names):
+        for _ in range(args.rounds):
+            for name in names:
+                await scenario_funcs[name](user_id)
+
+    async def replay_chat(updates):
+        for update in updates:
+            kind = update.event_type
+            await feed(f"replay:{kind}", update)
+
+    # --- Прогон ---
+
+    started = time.perf_counter()
+    if args.replay:
+        # Порядок внутри чата сохраняем, разные чаты идут параллельно
+        by_chat = defaultdict(list)
+        with open(args.replay, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    update = Update.model_validate(json.loads(line), context={"bot": bot})
+                    sender = update.event.from_user if hasattr(update.event, "from_user") else None
+                    by_chat[sender.id if sender else 0].append(update)
+        await asyncio.gather(*(replay_chat(updates) for updates in by_chat.values()))
+    else:
+        names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise SystemExit(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+        await asyncio.gather(*(run_user(1000 + i, names) for i in range(args.users)))
+    seconds = time.perf_counter() - started
+
+    if trace:
+        trace.close()
+    if web_runner:
+        await http.close()
+        await web_runner.cleanup()
+    else:
+        await stop_services(bot, {})
+    await stub_runner.cleanup()
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+        "updates": total,
+        "errors": sum(errors.values()),
+        "errors_by_scenario": dict(errors),
+        "seconds": round(seconds, 3),
+        "updates_per_sec": total / seconds if seconds else 0.0,
+        "scenarios": {name: summarize(values) for name, values in latencies.items()},
+        "all": summarize([value for values in latencies.values() for value in values]),
+        "api_calls": dict(session.calls),
+    }
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, stream=sys.stdout)
+    # Временная база: прогон не трогает рабочие данные
+    tmp_dir = tempfile.mkdtemp(prefix="moyritm-loadtest-")
+    os.environ["DB_PATH"] = os.path.join(tmp_dir, "loadtest.db")
+
+    result = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Результат сохранён в {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,98 @@
+import argparse
 import asyncio
+import json
 import logging
+import multiprocessing
+import subprocess
 import sys
+from collections import defaultdict
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 # Импорты проекта
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEB_HOST, WEB_PORT, WEB_WORKERS, METRICS_PORT,
+    STARTUP_BUDGET_MS, STARTUP_RSS_BUDGET_MB
+)
+from app import db, repo
 from app.handlers import router, setup_scheduler
-from app.db import init_db
+from app.repo import init_db, close_db, rebuild_stats
+from app.delivery import DeliveryPipeline
+from app.ai_agent import close_client as close_ai_client
+from app.stats import chart_renderer
+from app.session import sessions, SessionFSMStorage
+from app.metrics import REGISTRY
+from app.monitoring import setup_bot_metrics, loop_monitor, metrics_handler
+from app.cleanup import cleaner
 
 # Логирование
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 
+# ==========================================================
+# ⚙️ ОБЩИЙ ЗАПУСК И ОСТАНОВКА СЕРВИСОВ
+# ==========================================================
+
+def create_dispatcher():
+    dp = Dispatcher(storage=SessionFSMStorage(sessions))
+    dp.include_router(router)
+    setup_bot_metrics(router)
+    return dp
+
+async def start_services(bot, primary=True, shared=False):
+    """
+    Поднимает БД, сессии и (в основном процессе) доставку с напоминаниями.
+    shared=True — процессов несколько: кэши, которые не видят чужих изменений, выключаются.
+    """
+    await init_db()
+    if shared:
+        sessions.shared = True
+        repo.MONTH_CACHE_USERS = 0
+        repo.TASK_PAGE_CACHE_USERS = 0
+    await sessions.start()
+    loop_monitor.start()
+
+    services = {}
+    if primary:
+        delivery = DeliveryPipeline(bot)
+        await delivery.start()
+        REGISTRY.gauge("reminder_delivery", "Доставка напоминаний (счётчики и очередь)", delivery.stats, label="stat")
+        scheduler = AsyncIOScheduler()
+        reminder_engine = await setup_scheduler(scheduler, bot, delivery)
+        if shared:
+            # Задачи, добавленные другими воркерами, подхватываем перечитыванием горизонта
+            scheduler.add_job(reminder_engine.rescan, "interval", seconds=20)
+        scheduler.start()
+        services = {"delivery": delivery, "scheduler": scheduler, "reminder_engine": reminder_engine}
+    return services
+
+async def stop_services(bot, services):
+    if services:
+        services["scheduler"].shutdown(wait=False)
+        await services["reminder_engine"].stop()
+        await services["delivery"].stop()
+    await loop_monitor.stop()
+    await cleaner.stop()
+    await sessions.close()
+    await bot.session.close()
+    await close_ai_client()
+    await close_db()
+    chart_renderer.shutdown()
+
+# ==========================================================
+# 🔁 LONG POLLING
+# ==========================================================
+
 async def main():
-    # 1. Инициализация Базы Данных
-    init_db()
-    
-    # 2. Создаем объекты бота и диспетчера
+    # 1. Создаем объекты бота и диспетчера (с роутерами)
     bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
-    
-    # 3. Регистрируем роутеры (обработчики)
-    dp.include_router(router)
-    
-    # 4. Настраиваем планировщик (Scheduler)
-    scheduler = AsyncIOScheduler()
-    await setup_scheduler(scheduler, bot)
-    scheduler.start()
+    dp = create_dispatcher()
+
+    # 2. База данных, сессии, доставка и планировщик напоминаний
+    services = await start_services(bot)
+    metrics_runner = await start_metrics_server(METRICS_PORT) if METRICS_PORT else None
 
-    # 5. Запускаем бота
+    # 3. Запускаем бота
     try:
         logging.info("🚀 Бот запущен в Нативном режиме (без серверов)!")
         await bot.delete_webhook(drop_pending_updates=True)
@@ -37,10 +100,192 @@ async def main():
     except Exception as e:
         logging.error(f"Ошибка при запуске: {e}")
     finally:
-        await bot.session.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await stop_services(bot, services)
+
+async def start_metrics_server(port):
+    """/metrics на отдельном порту: в polling своего сервера нет, а webhook-сервер публичный"""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEB_HOST, port).start()
+    logging.info(f"📈 Метрики: http://{WEB_HOST}:{port}/metrics")
+    return runner
+
+# ==========================================================
+# 🌐 WEBHOOK + API ДЛЯ MINI APP (ОДИН AIOHTTP-СЕРВЕР)
+# ==========================================================
+
+def create_web_app(bot, dp, primary=True, shared=False, metrics_port=0, handle_in_background=True):
+    """
+    aiohttp-приложение: webhook Telegram на WEBHOOK_PATH и маршруты /api/*.
+    metrics_port — порт отдельного сервера /metrics (0 — не поднимать).
+    handle_in_background — отвечать Telegram сразу, а апдейт обрабатывать фоновой задачей;
+    False — ответ только после обработчика (нужно нагрузочному прогону, чтобы мерить обработку).
+    """
+    # В режиме polling webhook и API (с aiohttp_cors) не нужны — импортируем здесь
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+    from app.api import setup_api_routes
+
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, handle_in_background=handle_in_background, secret_token=WEBHOOK_SECRET or None
+    ).register(app, path=WEBHOOK_PATH)
+    setup_api_routes(app)
+    setup_application(app, dp, bot=bot)
+
+    async def on_startup(app):
+        app["services"] = await start_services(bot, primary=primary, shared=shared)
+        app["metrics_runner"] = await start_metrics_server(metrics_port) if metrics_port else None
+        if primary:
+            await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None)
+            logging.info(f"🚀 Бот запущен в режиме webhook: {WEBHOOK_URL + WEBHOOK_PATH}")
+
+    async def on_cleanup(app):
+        if app["metrics_runner"]:
+            await app["metrics_runner"].cleanup()
+        await stop_services(bot, app["services"])
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+def run_webhook_worker(index, workers):
+    """Один воркер: все слушают один порт через SO_REUSEPORT, ядро делит между ними соединения"""
+    bot = Bot(token=BOT_TOKEN)
+    # У каждого воркера свой REGISTRY — и свой порт метрик
+    metrics_port = METRICS_PORT + index if METRICS_PORT else 0
+    app = create_web_app(bot, create_dispatcher(), primary=index == 0, shared=workers > 1, metrics_port=metrics_port)
+    web.run_app(app, host=WEB_HOST, port=WEB_PORT, reuse_port=workers > 1, print=None)
+
+def run_webhook(workers):
+    if workers <= 1:
+        run_webhook_worker(0, 1)
+        return
+
+    # Миграции выполняем один раз до старта воркеров
+    db.init_db()
+    db.close_db()
+
+    # spawn: каждый воркер получает свои соединение с БД, поток БД и сессию aiohttp
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=run_webhook_worker, args=(i, workers), daemon=False) for i in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+async def rebuild_stats_command():
+    await init_db()
+    await rebuild_stats()
+    await close_db()
+    logging.info("📊 Счётчики статистики пересчитаны")
+
+# ==========================================================
+# 🐢 ВРЕМЯ СТАРТА
+# ==========================================================
+
+# Тяжёлые модули, которые должны грузиться при первом использовании, а не при старте
+LAZY_MODULES = ("matplotlib", "aiohttp_cors", "app.api")
+
+_IMPORT_PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import run
+print(json.dumps({
+    "seconds": time.perf_counter() - started,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "loaded": [name for name in %r if name in sys.modules],
+    "ai_client_built": sys.modules["app.ai_agent"]._client is not None,
+    "stats_pool_built": sys.modules["app.stats"].chart_renderer._pool is not None,
+}))
+"""
+
+def startup_probe():
+    """
+    Импортирует run в чистом процессе с -X importtime. Возвращает (замер, вывод importtime);
+    замер — время и RSS импорта и что из ленивого успело загрузиться или создаться.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", _IMPORT_PROBE % (LAZY_MODULES,)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+def import_profile(top=15):
+    """
+    Печатает, кто сколько стоит при импорте run (см. startup_probe).
+    Код выхода 1, если старт вышел за STARTUP_BUDGET_MS / STARTUP_RSS_BUDGET_MB,
+    при старте загрузился модуль из LAZY_MODULES, создан клиент GigaChat или пул
+    отрисовки графиков — годится как проверка в CI.
+    """
+    try:
+        probe, importtime = startup_probe()
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    # Строки вида "import time:  self [us] | cumulative | имя" (вложенность — отступом)
+    modules = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    packages = defaultdict(int)
+    for name, self_us, _ in modules:
+        packages[name.split(".")[0]] += self_us
+
+    print(f"Импорт run: {probe['seconds'] * 1000:.0f} мс, RSS {probe['rss_mb']:.0f} МБ "
+          f"(бюджет {STARTUP_BUDGET_MS} мс, {STARTUP_RSS_BUDGET_MB} МБ)")
+    print(f"\nПакеты по собственному времени, топ-{top}:")
+    for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"{self_us / 1000:>10.1f} мс  {name}")
+    print(f"\nМодули по накопленному времени, топ-{top}:")
+    for name, _, cumulative_us in sorted(modules, key=lambda item: -item[2])[:top]:
+        print(f"{cumulative_us / 1000:>10.1f} мс  {name}")
+
+    problems = []
+    if STARTUP_BUDGET_MS and probe["seconds"] * 1000 > STARTUP_BUDGET_MS:
+        problems.append(f"импорт дольше {STARTUP_BUDGET_MS} мс")
+    if STARTUP_RSS_BUDGET_MB and probe["rss_mb"] > STARTUP_RSS_BUDGET_MB:
+        problems.append(f"RSS больше {STARTUP_RSS_BUDGET_MB} МБ")
+    if probe["loaded"]:
+        problems.append(f"при старте загружены {', '.join(probe['loaded'])}")
+    if probe["ai_client_built"]:
+        problems.append("клиент GigaChat создан при импорте")
+    if probe["stats_pool_built"]:
+        problems.append("пул отрисовки графиков создан при импорте")
+    for problem in problems:
+        print(f"❌ {problem}")
+    return 1 if problems else 0
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telegram-бот МойРитм")
+    parser.add_argument("--rebuild-stats", action="store_true",
+                        help="пересчитать материализованную статистику и выйти")
+    parser.add_argument("--polling", action="store_true",
+                        help="long polling, даже если задан WEBHOOK_URL")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS,
+                        help="число процессов в webhook-режиме")
+    parser.add_argument("--import-profile", action="store_true",
+                        help="показать время импорта по модулям, проверить бюджет старта и выйти")
+    args = parser.parse_args()
+    if args.import_profile:
+        sys.exit(import_profile())
     try:
-        asyncio.run(main())
+        if args.rebuild_stats:
+            asyncio.run(rebuild_stats_command())
+        elif WEBHOOK_URL and not args.polling:
+            run_webhook(args.workers)
+        else:
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
-        logging.info("Бот остановлен")
\ No newline at end of file
+        logging.info("Бот остановлен")